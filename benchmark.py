@@ -0,0 +1,547 @@
+import argparse
+import json
+import math
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+from geo import LocalProjection, haversine_one_to_many
+from instrument import silenced
+from json_stream import iter_chunks, iter_elements
+from line_data import add_levels_of_detail, load_record, path_points_to_record, save_record_npz
+from main import MetroLinePlotter
+
+
+def generate_synthetic_ways(way_count, points_per_way=8, seed=0, shuffle=True):
+    """生成一条打乱顺序、随机反向的合成线路，shuffle 为 False 时保持沿线顺序（与关系成员顺序一致）
+
+    Returns:
+        ways_info 列表，格式与 extract_line_geometry 的输出一致
+    """
+    rng = random.Random(seed)
+    lon, lat = 120.1, 30.2
+    coords = [[lon, lat]]
+    for _ in range(way_count * points_per_way):
+        lon += 0.0005 + rng.uniform(-0.0001, 0.0001)
+        lat += rng.uniform(-0.0003, 0.0003)
+        coords.append([lon, lat])
+
+    ways_info = []
+    for i in range(way_count):
+        way_coords = coords[i * points_per_way:(i + 1) * points_per_way + 1]
+        if rng.random() < 0.5:
+            way_coords = way_coords[::-1]
+        ways_info.append({'id': i, 'coordinates': [list(c) for c in way_coords]})
+    if shuffle:
+        rng.shuffle(ways_info)
+    return ways_info
+
+
+def time_call(func, *args):
+    """执行函数并返回 (结果, 耗时秒数)，屏蔽函数内部的日志输出"""
+    with silenced():
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+    return result, elapsed
+
+
+def benchmark_merge(sizes=(100, 200, 400, 800, 1600)):
+    """对比 merge_ways（端点索引）、merge_ways_scan（逐轮扫描）与 merge_ways_ordered（按成员顺序）
+    随way数量的耗时，按成员顺序合并使用未打乱的同一组way
+
+    Returns:
+        合并结果不一致的规模数，非零时 main 以失败状态退出
+    """
+    plotter = MetroLinePlotter(cache=False, quiet=True)
+    mismatches = 0
+    print(f"{'way数':>8} {'扫描(s)':>10} {'索引(s)':>10} {'按序(s)':>10} {'加速比':>8}")
+    for size in sizes:
+        ways_info = generate_synthetic_ways(size)
+        scan_coords, scan_time = time_call(plotter.merge_ways_scan, ways_info)
+        index_coords, index_time = time_call(plotter.merge_ways, ways_info)
+        if scan_coords != index_coords:
+            print(f"错误: {size} 个way时两种合并结果不一致")
+            mismatches += 1
+        ordered_coords, ordered_time = time_call(plotter.merge_ways_ordered,
+                                                 generate_synthetic_ways(size, seed=0, shuffle=False))
+        if ordered_coords is None or len(ordered_coords) != len(index_coords):
+            print(f"错误: {size} 个way时按成员顺序合并的结果不完整")
+            mismatches += 1
+        print(f"{size:>8} {scan_time:>10.3f} {index_time:>10.3f} {ordered_time:>10.3f} "
+              f"{scan_time / index_time:>8.1f}")
+    return mismatches
+
+
+def generate_synthetic_records(line_count, points_per_line=2000, stations_per_line=30, seed=0):
+    """生成用于绘图基准的合成线路记录"""
+    rng = np.random.default_rng(seed)
+    records = []
+    for i in range(line_count):
+        steps = rng.normal(0, 0.0003, size=(points_per_line, 2)) + [0.0004, 0]
+        coords = np.cumsum(steps, axis=0) + [120.0, 30.0 + i * 0.01]
+        records.append({
+            'relation_id': i,
+            'name': f'线路{i}',
+            'colour': f'#{rng.integers(0, 0xFFFFFF):06x}',
+            'coords': coords,
+            'station_indices': np.linspace(0, points_per_line - 1, stations_per_line).astype(np.int64),
+            'station_names': [f'站{i}_{j}' for j in range(stations_per_line)]
+        })
+    return records
+
+
+def render_per_artist(records, alpha=0.8):
+    """逐条线路、逐个车站调用 ax.plot 的旧版绘制方式，用于基准对比"""
+    fig, ax = plt.subplots(1, 1, figsize=(16, 10))
+    for record in records:
+        coords = record['coords']
+        ax.plot(coords[:, 0], coords[:, 1], color=record['colour'], linewidth=4,
+                solid_capstyle='round', alpha=alpha, zorder=1)
+        for index in record['station_indices']:
+            ax.plot(coords[index, 0], coords[index, 1], 'o', color='white', markersize=3,
+                    markeredgecolor=record['colour'], markeredgewidth=0, zorder=1)
+        xlim, ylim = ax.get_xlim(), ax.get_ylim()
+        ax.set_xlim(min(coords[:, 0].min(), xlim[0]), max(coords[:, 0].max(), xlim[1]))
+        ax.set_ylim(min(coords[:, 1].min(), ylim[0]), max(coords[:, 1].max(), ylim[1]))
+    return fig, ax
+
+
+def benchmark_render(line_counts=(5, 10, 20, 40, 80)):
+    """对比逐个 artist 绘制与 render_lines 批量绘制的耗时（含一次完整渲染）"""
+    plotter = MetroLinePlotter(cache=False)
+
+    def draw(render, records):
+        fig, _ = render(records)
+        fig.canvas.draw()
+        plt.close(fig)
+
+    print(f"{'线路数':>8} {'逐个(s)':>10} {'批量(s)':>10} {'加速比':>8}")
+    for count in line_counts:
+        records = generate_synthetic_records(count)
+        _, artist_time = time_call(draw, render_per_artist, records)
+        _, batch_time = time_call(draw, plotter.render_lines, records)
+        print(f"{count:>8} {artist_time:>10.3f} {batch_time:>10.3f} {artist_time / batch_time:>8.1f}")
+
+
+
+def benchmark_viewport(line_count=80, zoom=10, frames=20):
+    """放大到 1/zoom 的范围后连续平移，对比完整路径、按整体范围简化的静态绘制与交互模式（视野裁剪 + 按缩放切换简化级别）每帧的耗时与绘制的点数"""
+    plotter = MetroLinePlotter(cache=False)
+    records = generate_synthetic_records(line_count)
+    for record in records:
+        record['parts'] = np.array([0], dtype=np.int64)
+        add_levels_of_detail(record)
+
+    modes = [('完整', {'use_lod': False}), ('静态简化', {}), ('交互', {'interactive': True})]
+    print(f"{'模式':>8} {'每帧(ms)':>10} {'绘制点数':>10}")
+    for name, options in modes:
+        fig, ax = plotter.render_lines(records, **options)
+        fig.canvas.draw()
+        xlim, ylim = ax.get_xlim(), ax.get_ylim()
+        width, height = (xlim[1] - xlim[0]) / zoom, (ylim[1] - ylim[0]) / zoom
+        ax.set_ylim(ylim[0] + height * (zoom // 2), ylim[0] + height * (zoom // 2 + 1))
+
+        def pan():
+            for frame in range(frames):
+                left = xlim[0] + (xlim[1] - xlim[0] - width) * frame / max(frames - 1, 1)
+                ax.set_xlim(left, left + width)
+                fig.canvas.draw()
+
+        _, seconds = time_call(pan)
+        points = sum(len(segment) for segment in ax.collections[0].get_segments())
+        print(f"{name:>8} {seconds / frames * 1000:>10.1f} {points:>10}")
+        plt.close(fig)
+
+
+def generate_synthetic_relation(way_count, station_count=30, points_per_way=20, gap_ratio=0.1,
+                                branch_count=2, relation_id=1, seed=0):
+    """生成与 Overpass "out geom" 输出格式一致的合成线路数据，可完全离线使用
+
+    主线由 way_count 个首尾相接的way组成，way顺序打乱、约一半反向；
+    gap_ratio 比例的连接处留出 20~60 米的缺口（仍在合并距离内），
+    另有 branch_count 条位于主线中部旁、不与主线相接的支线（合并后应剩下这些way）。
+    车站大多在轨道 0~80 米内，少数远离轨道，用于覆盖吸附、插入与跳过三种情况。
+
+    Returns:
+        {'elements': [...]}，元素顺序为节点、way、关系
+    """
+    rng = random.Random(seed)
+    step = 1e-4  # 约 10 米
+    lon, lat = 120.1, 30.2
+    track = [[lon, lat]]
+    for _ in range(way_count * (points_per_way - 1)):
+        lon += step + rng.uniform(-step / 5, step / 5)
+        lat += rng.uniform(-step / 2, step / 2)
+        track.append([lon, lat])
+
+    way_coords = []
+    for i in range(way_count):
+        coords = [list(c) for c in track[i * (points_per_way - 1):(i + 1) * (points_per_way - 1) + 1]]
+        if i > 0 and rng.random() < gap_ratio:
+            # 去掉开头的点并整体平移，与上一个way之间留出缺口
+            shift = rng.uniform(2e-4, 6e-4)
+            coords = [[c[0], c[1] + shift] for c in coords[1:]]
+        way_coords.append(coords)
+    for _ in range(branch_count):
+        origin = track[rng.randrange(len(track) // 4, 3 * len(track) // 4)]
+        # 支线起点离开主线约 170 米，超出合并距离，不会被并入主线
+        way_coords.append([[origin[0] + j * step / 2, origin[1] + 1.5e-3 + j * step] for j in range(points_per_way)])
+
+    elements = []
+    ways = []
+    node_id = 1
+    for i, coords in enumerate(way_coords):
+        if rng.random() < 0.5:
+            coords = coords[::-1]
+        node_ids = list(range(node_id, node_id + len(coords)))
+        node_id += len(coords)
+        elements.extend({'type': 'node', 'id': n, 'lat': c[1], 'lon': c[0]} for n, c in zip(node_ids, coords))
+        ways.append({'type': 'way', 'id': i + 1, 'nodes': node_ids, 'tags': {'railway': 'subway'},
+                     'geometry': [{'lat': c[1], 'lon': c[0]} for c in coords]})
+    rng.shuffle(ways)
+
+    stations = []
+    for i in range(station_count):
+        c = track[int(i * (len(track) - 1) / max(station_count - 1, 1))]
+        offset = rng.uniform(0, 8e-4) if rng.random() < 0.9 else rng.uniform(6e-3, 1e-2)
+        stations.append({'type': 'node', 'id': node_id + i, 'lat': c[1] + offset, 'lon': c[0],
+                         'tags': {'railway': 'stop', 'name': f'站{i}'}})
+    elements.extend(stations)
+
+    members = ([{'type': 'node', 'ref': station['id'], 'role': 'stop'} for station in stations] +
+               [{'type': 'way', 'ref': way['id'], 'role': ''} for way in ways])
+    relation = {'type': 'relation', 'id': relation_id, 'version': 1, 'timestamp': '2025-01-01T00:00:00Z',
+                'members': members, 'tags': {'name': f'合成线路{relation_id}', 'colour': '#ff0000'}}
+    return {'elements': elements + ways + [relation]}
+
+
+def generate_synthetic_response(way_count, points_per_way=20, station_count=30, relation_id=1):
+    """生成合成的 Overpass 响应（JSON 字节串）"""
+    data = generate_synthetic_relation(way_count, station_count, points_per_way, relation_id=relation_id)
+    return json.dumps({'version': 0.6, 'generator': 'benchmark', **data}).encode('utf-8')
+
+
+def measure_peak(func, *args):
+    """执行函数并返回 (耗时秒数, Python 内存分配峰值字节数)，屏蔽函数内部的日志输出"""
+    tracemalloc.start()
+    try:
+        _, elapsed = time_call(func, *args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return elapsed, peak
+
+
+def parse_response_file(plotter, filename, stream):
+    """读取响应文件并提取线路数据，stream 为 False 时先用 json.load 解析完整响应"""
+    with open(filename, 'rb') as f:
+        if stream:
+            return plotter.extract_lines_data(iter_elements(iter_chunks(f)), [1])
+        data = json.load(f)
+    return plotter.extract_lines_data(data['elements'], [1])
+
+
+def peak_rss():
+    """当前进程的峰值 RSS（字节）
+
+    Linux 上读取 /proc/self/status 中的 VmHWM：ru_maxrss 在 exec 后保留父进程的峰值，
+    子进程中测得的值可能来自启动它的进程。其他系统使用 ru_maxrss（macOS 上以字节为单位）。
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def parse_peak_rss(filename, stream):
+    """在子进程中执行：解析响应文件，输出解析前后进程的峰值 RSS（字节，JSON）"""
+    plotter = MetroLinePlotter(cache=False, quiet=True)
+    before = peak_rss()
+    with silenced():
+        parse_response_file(plotter, filename, stream)
+    print(json.dumps({'before': before, 'after': peak_rss()}))
+
+
+def measure_rss(filename, stream):
+    """在新的 Python 进程中解析响应文件，返回 (峰值 RSS, 解析造成的峰值增量)，单位字节"""
+    code = f"import benchmark; benchmark.parse_peak_rss({filename!r}, {stream!r})"
+    output = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    return result['after'], result['after'] - result['before']
+
+
+def benchmark_parse(way_counts=(500, 2000, 8000)):
+    """对比完整解析响应（json.load）与流式解析时提取线路数据的耗时与进程峰值 RSS
+
+    耗时在当前进程中测量（不开启 tracemalloc）；峰值 RSS 在各自新启动的子进程中测量，
+    增量为解析前后峰值 RSS 之差，不含解释器与模块导入本身的内存。
+    """
+    plotter = MetroLinePlotter(cache=False)
+
+    print(f"{'way数':>8} {'响应(MB)':>10} {'完整(s)':>10} {'流式(s)':>10} "
+          f"{'完整RSS(MB)':>12} {'流式RSS(MB)':>12} {'完整增量(MB)':>13} {'流式增量(MB)':>13}")
+    for count in way_counts:
+        content = generate_synthetic_response(count)
+        with tempfile.NamedTemporaryFile(suffix='.json') as f:
+            f.write(content)
+            f.flush()
+            _, full_time = time_call(parse_response_file, plotter, f.name, False)
+            _, stream_time = time_call(parse_response_file, plotter, f.name, True)
+            full_rss, full_growth = measure_rss(f.name, False)
+            stream_rss, stream_growth = measure_rss(f.name, True)
+        print(f"{count:>8} {len(content) / 2**20:>10.1f} {full_time:>10.3f} {stream_time:>10.3f} "
+              f"{full_rss / 2**20:>12.1f} {stream_rss / 2**20:>12.1f} "
+              f"{full_growth / 2**20:>13.1f} {stream_growth / 2**20:>13.1f}")
+
+
+# 流水线基准的默认规模（每条线路的way数）与基线文件
+PIPELINE_SIZES = (100, 400, 1600)
+BASELINE_FILE = 'benchmark_baseline.json'
+# 耗时低于该值（秒）、内存峰值低于该值（字节）的差异视为测量噪声，不判定为退化
+NOISE_FLOOR = 0.01
+MEMORY_NOISE_FLOOR = 1024 * 1024
+
+
+def run_stage(func, *args, repeat=5):
+    """执行一个步骤，返回 (结果, 最短耗时秒数, 内存分配峰值字节数)
+
+    耗时取 repeat 次中的最小值（不开启 tracemalloc），内存峰值另外单独测量一次。
+    """
+    elapsed = float('inf')
+    for _ in range(repeat):
+        result, seconds = time_call(func, *args)
+        elapsed = min(elapsed, seconds)
+    _, peak = measure_peak(func, *args)
+    return result, elapsed, peak
+
+
+def benchmark_pipeline(sizes=PIPELINE_SIZES, station_count=None):
+    """按线路规模逐步测量处理流水线各步骤的耗时与内存峰值
+
+    步骤: extract（extract_lines_data）、merge、snap（insert_stations_into_path）、
+    save_json、load_json、save_npz、load_npz、plot（plot_multiple_lines 并完成一次渲染）。
+    全部使用合成数据，不访问网络。
+
+    Returns:
+        {步骤: {规模: {'seconds', 'peak'}}}
+    """
+    plotter = MetroLinePlotter(cache=False, quiet=True)
+    results = {}
+
+    def record(stage, size, seconds, peak):
+        results.setdefault(stage, {})[str(size)] = {'seconds': seconds, 'peak': peak}
+
+    def plot(filenames):
+        fig, _ = plotter.plot_multiple_lines(filenames, show_plot=False)
+        fig.canvas.draw()
+        plt.close(fig)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            data = generate_synthetic_relation(size, station_count or max(10, size // 10), seed=size)
+            json_filename = os.path.join(directory, f'line_{size}.json')
+            npz_filename = os.path.join(directory, f'line_{size}.npz')
+
+            lines_data, seconds, peak = run_stage(plotter.extract_lines_data, data['elements'], [size])
+            record('extract', size, seconds, peak)
+            relation_info, stations, ways_info = (lines_data[size][key]
+                                                  for key in ('relation_info', 'stations', 'ways_info'))
+            merged_coords, seconds, peak = run_stage(plotter.merge_ways, ways_info)
+            record('merge', size, seconds, peak)
+            path_points, seconds, peak = run_stage(plotter.insert_stations_into_path, merged_coords, stations)
+            record('snap', size, seconds, peak)
+            _, seconds, peak = run_stage(plotter.save_to_json, path_points, size, relation_info, json_filename)
+            record('save_json', size, seconds, peak)
+            _, seconds, peak = run_stage(load_record, json_filename)
+            record('load_json', size, seconds, peak)
+            _, seconds, peak = run_stage(plotter.save_to_npz, path_points, size, relation_info, npz_filename)
+            record('save_npz', size, seconds, peak)
+            _, seconds, peak = run_stage(load_record, npz_filename)
+            record('load_npz', size, seconds, peak)
+            _, seconds, peak = run_stage(plot, [npz_filename])
+            record('plot', size, seconds, peak)
+
+    print(f"{'步骤':<10} " + ' '.join(f"{f'{size}way(s)':>12}" for size in sizes) +
+          f" {'增长指数':>8} {'峰值(MB)':>10}")
+    for stage, by_size in results.items():
+        times = [by_size[str(size)]['seconds'] for size in sizes]
+        # 规模与耗时在对数坐标下的斜率，约等于复杂度的幂次
+        exponent = (math.log(max(times[-1], 1e-9) / max(times[0], 1e-9)) / math.log(sizes[-1] / sizes[0])
+                    if len(sizes) > 1 else float('nan'))
+        peak = max(by_size[str(size)]['peak'] for size in sizes)
+        print(f"{stage:<10} " + ' '.join(f"{t:>12.4f}" for t in times) +
+              f" {exponent:>8.2f} {peak / 2**20:>10.1f}")
+    return results
+
+
+def benchmark_projection(sizes=PIPELINE_SIZES, pair_count=5000):
+    """对比经纬度（haversine）与局部平面投影（欧氏距离）两种坐标下合并与插入车站的耗时与结果误差，
+    以及 float64、float32、int32 三种坐标存储方式的文件大小与坐标误差"""
+    plotter = MetroLinePlotter(cache=False, quiet=True)
+    rng = np.random.default_rng(0)
+
+    def build(ways_info, stations):
+        components = plotter.merge_way_components(ways_info)
+        return plotter.insert_stations_into_parts(components, stations)
+
+    def build_projected(ways_info, stations):
+        projection = LocalProjection.around(np.concatenate([way['coordinates'] for way in ways_info]))
+        ways_info = [{'id': way['id'], 'coordinates': projection.forward(way['coordinates']).tolist()}
+                     for way in ways_info]
+        points = projection.forward([[station['lon'], station['lat']] for station in stations])
+        stations = [dict(station, lon=x, lat=y) for station, (x, y) in zip(stations, points.tolist())]
+        plotter.metric = 'euclidean'
+        try:
+            path_points = build(ways_info, stations)
+        finally:
+            plotter.metric = 'haversine'
+        coords = projection.inverse([[point['lon'], point['lat']] for point in path_points])
+        for point, (lon, lat) in zip(path_points, coords.tolist()):
+            point['lon'], point['lat'] = lon, lat
+        return path_points
+
+    print(f"{'way数':>8} {'经纬度(s)':>10} {'投影(s)':>10} {'加速比':>8} {'点数一致':>8} "
+          f"{'最大偏差(m)':>12} {'距离相对误差':>12}")
+    records = []
+    for size in sizes:
+        data = generate_synthetic_relation(size, max(10, size // 10), seed=size)
+        (stations, ways_info), _ = time_call(plotter.extract_line_geometry, data)
+        geographic, geographic_time = time_call(build, ways_info, stations)
+        projected, projected_time = time_call(build_projected, ways_info, stations)
+
+        geographic_coords = np.array([[p['lon'], p['lat']] for p in geographic])
+        projected_coords = np.array([[p['lon'], p['lat']] for p in projected])
+        same = len(geographic_coords) == len(projected_coords)
+        # 长度几乎相同的部分在两种距离下可能排序不同，按坐标排序后逐点比较
+        geographic_coords = geographic_coords[np.lexsort(geographic_coords.T)]
+        projected_coords = projected_coords[np.lexsort(projected_coords.T)]
+        deviation = (float(np.max(haversine_one_to_many(geographic_coords[:, 1], geographic_coords[:, 0],
+                                                         projected_coords[:, 1], projected_coords[:, 0])))
+                     if same else float('nan'))
+
+        # 随机点对的投影距离与 haversine 距离的最大相对误差
+        pairs = rng.integers(0, len(geographic_coords), size=(pair_count, 2))
+        first, second = geographic_coords[pairs[:, 0]], geographic_coords[pairs[:, 1]]
+        exact = haversine_one_to_many(first[:, 1], first[:, 0], second[:, 1], second[:, 0])
+        projection = LocalProjection.around(geographic_coords)
+        planar = np.hypot(*(projection.forward(first) - projection.forward(second)).T)
+        mask = exact > 1
+        relative_error = float(np.max(np.abs(planar[mask] - exact[mask]) / exact[mask])) if mask.any() else 0.0
+
+        print(f"{size:>8} {geographic_time:>10.3f} {projected_time:>10.3f} "
+              f"{geographic_time / projected_time:>8.1f} {str(same):>8} {deviation:>12.4f} {relative_error:>12.2e}")
+        records.append(path_points_to_record(geographic, size, {'name': f'合成线路{size}', 'colour': '#ff0000'}))
+
+    print(f"\n{'存储':>8} {'文件(KB)':>10} {'最大坐标误差(m)':>16}")
+    with tempfile.TemporaryDirectory() as directory:
+        for storage in ('float64', 'float32', 'int32'):
+            total_size = 0
+            max_error = 0.0
+            for record in records:
+                filename = os.path.join(directory, f"line_{record['relation_id']}_{storage}.npz")
+                save_record_npz(record, filename, storage)
+                total_size += os.path.getsize(filename)
+                coords = np.asarray(load_record(filename)['coords'])
+                original = record['coords']
+                max_error = max(max_error, float(np.max(haversine_one_to_many(
+                    original[:, 1], original[:, 0], coords[:, 1], coords[:, 0]))))
+            print(f"{storage:>8} {total_size / 1024:>10.1f} {max_error:>16.4f}")
+
+
+def save_baseline(results, filename=BASELINE_FILE):
+    """将基准结果保存为基线"""
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"基线已保存到 {filename}")
+
+
+def check_baseline(results, filename=BASELINE_FILE, tolerance=1.0, memory_tolerance=0.5):
+    """与基线比较，返回退化的 (步骤, 规模, 指标, 基线值, 当前值) 列表，指标为 'seconds' 或 'peak'
+
+    当前耗时超过基线的 (1 + tolerance) 倍且差值大于 NOISE_FLOOR，
+    或内存峰值超过基线的 (1 + memory_tolerance) 倍且差值大于 MEMORY_NOISE_FLOOR 时视为退化。
+    """
+    with open(filename, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    limits = {'seconds': (tolerance, NOISE_FLOOR), 'peak': (memory_tolerance, MEMORY_NOISE_FLOOR)}
+    regressions = []
+    for stage, by_size in baseline.items():
+        for size, expected in by_size.items():
+            current = results.get(stage, {}).get(size)
+            if current is None:
+                continue
+            for metric, (metric_tolerance, noise_floor) in limits.items():
+                if metric not in expected:
+                    continue
+                if (current[metric] > expected[metric] * (1 + metric_tolerance) and
+                        current[metric] - expected[metric] > noise_floor):
+                    regressions.append((stage, size, metric, expected[metric], current[metric]))
+
+    for stage, size, metric, expected, current in regressions:
+        if metric == 'seconds':
+            print(f"退化: {stage} ({size} 个way) 耗时 {expected:.4f}s -> {current:.4f}s")
+        else:
+            print(f"退化: {stage} ({size} 个way) 内存峰值 {expected / 2**20:.1f}MB -> {current / 2**20:.1f}MB")
+    if not regressions:
+        print(f"与基线 {filename} 相比没有退化 (耗时容差 {tolerance:.0%}, 内存容差 {memory_tolerance:.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='离线性能基准')
+    parser.add_argument('suites', nargs='*', default=['merge', 'render', 'parse', 'pipeline'],
+                        choices=['merge', 'render', 'parse', 'pipeline', 'projection', 'viewport'], help='要运行的基准')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(PIPELINE_SIZES),
+                        help='流水线基准的线路规模（way数）')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='基线文件')
+    parser.add_argument('--save-baseline', action='store_true', help='将本次流水线结果保存为基线')
+    parser.add_argument('--tolerance', type=float, default=1.0, help='允许的耗时增长比例')
+    parser.add_argument('--memory-tolerance', type=float, default=0.5, help='允许的内存峰值增长比例')
+    args = parser.parse_args(argv)
+
+    # 基线与机器有关，不随代码提交；没有基线时直接失败，提示先用 --save-baseline 生成
+    if 'pipeline' in args.suites and not args.save_baseline and not os.path.exists(args.baseline):
+        print(f"基线文件 {args.baseline} 不存在，无法检查退化；请先在当前机器上运行 "
+              f"python benchmark.py pipeline --save-baseline 生成基线")
+        return 2
+
+    # 合并结果不一致属于正确性问题，与性能退化一样以失败状态退出
+    failed = False
+    if 'merge' in args.suites:
+        failed = benchmark_merge() > 0
+    if 'render' in args.suites:
+        benchmark_render()
+    if 'parse' in args.suites:
+        benchmark_parse()
+    if 'viewport' in args.suites:
+        benchmark_viewport()
+    if 'projection' in args.suites:
+        benchmark_projection(args.sizes)
+    if 'pipeline' in args.suites:
+        results = benchmark_pipeline(args.sizes)
+        if args.save_baseline:
+            save_baseline(results, args.baseline)
+        elif check_baseline(results, args.baseline, args.tolerance, args.memory_tolerance):
+            failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+import hashlib
+import os
+import tempfile
+import time
+
+
+class ResponseCache:
+    """按查询内容哈希存储 Overpass 原始响应（或其他可由查询字符串标识的数据）的磁盘缓存
+
+    每个查询对应缓存目录下的一个文件，文件修改时间记录下载时间（用于判断过期），
+    访问时间记录最近一次读取（用于LRU淘汰）。缓存总大小超过上限时，
+    先删除过期的响应，再按最近最少使用的顺序删除，直到低于上限。
+    """
+
+    def __init__(self, cache_dir, ttl=None, max_size=None, suffix='.json'):
+        """
+        Args:
+            cache_dir: 缓存目录
+            ttl: 响应有效期（秒），None 表示永不过期
+            max_size: 缓存总大小上限（字节），None 表示不限制
+            suffix: 缓存文件后缀
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_size = max_size
+        self.suffix = suffix
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, query):
+        """计算查询的缓存键，忽略缩进和空行的差异"""
+        normalized = '\n'.join(line.strip() for line in query.strip().splitlines() if line.strip())
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    def path(self, query):
+        """查询对应的缓存文件路径"""
+        return os.path.join(self.cache_dir, f"{self.key(query)}{self.suffix}")
+
+    def get(self, query, ignore_ttl=False):
+        """读取缓存的原始响应，不存在或已过期时返回 None
+
+        Args:
+            ignore_ttl: 为 True 时忽略有效期，用于离线重新处理
+        """
+        path = self.path(query)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        if not ignore_ttl and self.ttl is not None and time.time() - stat.st_mtime > self.ttl:
+            return None
+
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+            # 更新访问时间，保留修改时间（下载时间）
+            os.utime(path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            return None
+        return content
+
+    def open(self, query, ignore_ttl=False):
+        """以二进制只读方式打开缓存的原始响应，不存在或已过期时返回 None，用于流式读取"""
+        path = self.path(query)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        if not ignore_ttl and self.ttl is not None and time.time() - stat.st_mtime > self.ttl:
+            return None
+
+        try:
+            f = open(path, 'rb')
+            os.utime(path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            return None
+        return f
+
+    def put_file(self, query, filename):
+        """将已写好的文件移入缓存（需与缓存目录在同一文件系统），写入后按大小上限淘汰旧响应"""
+        os.replace(filename, self.path(query))
+        self.evict()
+
+    def put(self, query, content):
+        """写入原始响应，写入后按大小上限淘汰旧响应"""
+        path = self.path(query)
+        # 先写临时文件再替换，避免并发读取到不完整的文件
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def entries(self):
+        """返回缓存中所有响应的 (路径, 大小, 访问时间, 修改时间) 列表"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_size, stat.st_atime, stat.st_mtime))
+        return entries
+
+    def evict(self):
+        """缓存超过大小上限时删除过期和最近最少使用的响应，返回删除的文件数"""
+        if self.max_size is None:
+            return 0
+
+        entries = self.entries()
+        total_size = sum(entry[1] for entry in entries)
+        if total_size <= self.max_size:
+            return 0
+
+        now = time.time()
+        # 过期的排在最前，其余按访问时间从旧到新
+        entries.sort(key=lambda entry: (
+            not (self.ttl is not None and now - entry[3] > self.ttl),
+            entry[2]
+        ))
+
+        removed = 0
+        for path, size, _, _ in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        """清空缓存"""
+        for path, _, _, _ in self.entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
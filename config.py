@@ -88,4 +88,86 @@ METRO_LINES = [
 
 # 反向映射
 LINE_NAME_TO_INDEX = {line['name']: i for i, line in enumerate(METRO_LINES)}
-LINE_NAME_TO_RELATION_ID = {line['name']: line['relation_id'] for line in METRO_LINES}
\ No newline at end of file
+LINE_NAME_TO_RELATION_ID = {line['name']: line['relation_id'] for line in METRO_LINES}
+
+# 处理参数（米）: way端点在此距离内视为相连；车站在此距离内吸附到路径，
+# 其中距离最近路径点不超过 STATION_MERGE_DISTANCE 时直接标记该点，否则插入新点
+MERGE_JOIN_DISTANCE = 100
+STATION_SNAP_DISTANCE = 500
+STATION_MERGE_DISTANCE = 50
+
+# 合并方式: 'ordered' 按关系成员顺序依次连接way，发现缺口（相邻way端点超出 MERGE_JOIN_DISTANCE）
+# 或成员顺序混乱时退回 'greedy'；'greedy' 按端点距离贪心连接，不依赖成员顺序
+MERGE_MODE = 'ordered'
+
+# 合并一条线路中互不相连的各部分（支线、断开的区段）时使用的进程数，1 表示在当前进程中依次合并；
+# 多条线路已在进程池中并行处理，只在单独处理分支很多的大型线路时才需要调大
+COMPONENT_WORKERS = 1
+
+# 处理线路时的坐标: 'geographic' 直接使用经纬度与 haversine 距离；'projected' 先将每条线路一次投影到
+# 以线路中心为原点的局部平面坐标（米），合并与插入车站只需欧氏距离，城市尺度内距离误差不超过约 0.3%
+COORDINATE_MODE = 'geographic'
+
+# 线路文件中坐标的存储方式: 'float64'；'float32' 或 'int32'（1e-7 度量化）保存相对线路原点的偏移，
+# 文件约小一半，坐标误差不超过约 1 厘米
+COORD_STORAGE = 'float64'
+
+# 保存前对轨道做 Douglas-Peucker 简化的容差（米），0 表示保留全部顶点；车站点始终保留
+SIMPLIFY_TOLERANCE = 0
+# 额外保存的多级简化容差（米），绘图时按当前视野每像素对应的距离选择
+LOD_TOLERANCES = (5, 20, 80)
+# 允许的简化误差（像素），不超过该误差的最粗一级用于绘图
+LOD_PIXEL_TOLERANCE = 1.0
+# 交互模式下线路切成的小段的最大点数（至少为 2），缩放、平移时只绘制与视野相交的小段
+VIEWPORT_CHUNK_POINTS = 256
+
+# 处理后线路文件的格式: 'npz'（列式二进制，默认）或 'json'
+OUTPUT_FORMAT = 'npz'
+
+# 内存中最多保留的已加载线路数与总内存上限（字节）
+LINE_STORE_MAX_LINES = 64
+LINE_STORE_MAX_BYTES = 256 * 1024 * 1024
+
+# Overpass API 地址，可改为镜像或本地测试服务
+OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+
+# 请求超时（秒）与连接池大小
+REQUEST_TIMEOUT = 180
+HTTP_POOL_SIZE = 8
+
+# force_update 时是否先比较关系版本，只更新上游有变化的线路
+FRESHNESS_CHECK = True
+
+# Overpass 原始响应缓存目录（None 表示不缓存）、有效期（秒）与总大小上限（字节）
+CACHE_DIR = "overpass_cache"
+CACHE_TTL = 7 * 24 * 3600
+CACHE_MAX_SIZE = 500 * 1024 * 1024
+
+# 线网底图的栅格缓存目录（None 表示不缓存）与总大小上限（字节）
+BASEMAP_CACHE_DIR = "basemap_cache"
+BASEMAP_CACHE_MAX_SIZE = 200 * 1024 * 1024
+
+# 是否边下载边解析 Overpass 响应（不在内存中保留完整响应），以及每次读取的块大小（字节）
+STREAM_RESPONSES = True
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# 从本地 OSM 提取文件读取全部线路时收集的 route 类型
+OSM_ROUTE_TYPES = ('subway', 'light_rail')
+
+# batch_query 模式下每次查询合并的关系数
+OVERPASS_BATCH_SIZE = 20
+
+# 遇到以下 HTTP 状态码时重试，等待时间为 RETRY_BACKOFF * 2^重试次数（秒）
+RETRY_STATUS_CODES = (429, 504)
+MAX_RETRIES = 3
+RETRY_BACKOFF = 2
+
+# 线网图缓存文件与换乘代价（米），换乘代价用于避免在共线区段上频繁换乘
+NETWORK_CACHE_FILE = "metro_network.json"
+TRANSFER_PENALTY = 500
+
+# 安静模式：不输出逐个way、车站的处理细节
+QUIET = False
+# 运行统计（各步骤耗时与计数）的 JSON 报告文件与 cProfile 分析结果文件，None 表示不保存
+REPORT_FILE = None
+PROFILE_FILE = None
@@ -0,0 +1,302 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS = 6371000  # 地球半径（米）
+
+
+def haversine_one_to_many(lat, lon, lats, lons):
+    """计算一个点到多个点的距离（米）
+
+    Args:
+        lat, lon: 单个点的纬度和经度
+        lats, lons: 多个点的纬度和经度数组
+
+    Returns:
+        与 lats 形状相同的距离数组
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    lat1_rad = np.radians(lat)
+    lat2_rad = np.radians(lats)
+    delta_lat = np.radians(lats - lat)
+    delta_lon = np.radians(lons - lon)
+
+    a = (np.sin(delta_lat / 2) ** 2 +
+         np.cos(lat1_rad) * np.cos(lat2_rad) *
+         np.sin(delta_lon / 2) ** 2)
+    a = np.clip(a, 0.0, 1.0)
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return EARTH_RADIUS * c
+
+
+def haversine_matrix(lats1, lons1, lats2, lons2):
+    """计算两组点之间的距离矩阵（米）
+
+    Returns:
+        形状为 (len(lats1), len(lats2)) 的距离矩阵
+    """
+    lats1 = np.asarray(lats1, dtype=np.float64)[:, np.newaxis]
+    lons1 = np.asarray(lons1, dtype=np.float64)[:, np.newaxis]
+    lats2 = np.asarray(lats2, dtype=np.float64)[np.newaxis, :]
+    lons2 = np.asarray(lons2, dtype=np.float64)[np.newaxis, :]
+
+    lat1_rad = np.radians(lats1)
+    lat2_rad = np.radians(lats2)
+    delta_lat = lat2_rad - lat1_rad
+    delta_lon = np.radians(lons2 - lons1)
+
+    a = (np.sin(delta_lat / 2) ** 2 +
+         np.cos(lat1_rad) * np.cos(lat2_rad) *
+         np.sin(delta_lon / 2) ** 2)
+    a = np.clip(a, 0.0, 1.0)
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return EARTH_RADIUS * c
+
+
+def euclidean_one_to_many(y, x, ys, xs):
+    """计算平面坐标（米）中一个点到多个点的距离，参数顺序与 haversine_one_to_many 一致"""
+    return np.hypot(np.asarray(xs, dtype=np.float64) - x, np.asarray(ys, dtype=np.float64) - y)
+
+
+def euclidean_matrix(ys1, xs1, ys2, xs2):
+    """计算平面坐标（米）中两组点之间的距离矩阵，参数顺序与 haversine_matrix 一致"""
+    ys1 = np.asarray(ys1, dtype=np.float64)[:, np.newaxis]
+    xs1 = np.asarray(xs1, dtype=np.float64)[:, np.newaxis]
+    return np.hypot(np.asarray(xs2, dtype=np.float64)[np.newaxis, :] - xs1,
+                    np.asarray(ys2, dtype=np.float64)[np.newaxis, :] - ys1)
+
+
+class LocalProjection:
+    """以线路原点为中心的局部东-北（ENU）平面坐标，单位为米
+
+    x = R·cos(φ0)·(λ - λ0)，y = R·(φ - φ0)，即原点处切平面上的等距圆柱投影。
+    投影后的距离与 haversine 距离的相对误差约为 |tan(φ0)|·|φ - φ0|（纬度差以弧度计）
+    加上二阶小量：在纬度 30° 附近、距原点南北 30 公里以内时不超过 0.3%，
+    对 100 米、500 米这类阈值的影响不超过 0.3 米、1.5 米；纯南北方向的距离没有误差。
+    """
+
+    def __init__(self, origin_lon, origin_lat):
+        self.origin_lon = float(origin_lon)
+        self.origin_lat = float(origin_lat)
+        self.scale_x = EARTH_RADIUS * math.cos(math.radians(self.origin_lat))
+
+    @classmethod
+    def around(cls, coords):
+        """以 [lon, lat] 坐标范围的中心为原点创建投影"""
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        if not len(coords):
+            return cls(0.0, 0.0)
+        center = (coords.min(axis=0) + coords.max(axis=0)) / 2
+        return cls(center[0], center[1])
+
+    def forward(self, coords):
+        """[lon, lat] -> [x, y]（米）"""
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        return np.column_stack([np.radians(coords[:, 0] - self.origin_lon) * self.scale_x,
+                                np.radians(coords[:, 1] - self.origin_lat) * EARTH_RADIUS])
+
+    def inverse(self, points):
+        """[x, y]（米） -> [lon, lat]"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        return np.column_stack([self.origin_lon + np.degrees(points[:, 0] / self.scale_x),
+                                self.origin_lat + np.degrees(points[:, 1] / EARTH_RADIUS)])
+
+
+def cumulative_distance(coords, breaks=None):
+    """计算路径上每个点距起点的累计距离（米）
+
+    Args:
+        coords: (N, 2) 数组，每行为 [lon, lat]
+        breaks: 路径断开处（各部分的起点）的索引，前一部分末点到这些点的距离不计入
+
+    Returns:
+        长度为 N 的数组，第一个元素为 0
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if len(coords) == 0:
+        return np.empty(0, dtype=np.float64)
+    steps = haversine_one_to_many(coords[:-1, 1], coords[:-1, 0], coords[1:, 1], coords[1:, 0])
+    if breaks is not None and len(breaks):
+        breaks = np.asarray(breaks, dtype=np.int64)
+        steps[breaks[breaks > 0] - 1] = 0.0
+    return np.concatenate([[0.0], np.cumsum(steps)])
+
+
+class GridIndex:
+    """基于网格哈希的空间索引
+
+    将经纬度点以等距圆柱投影映射到平面坐标（米），按固定大小的网格分桶，
+    用于快速取出某点附近的候选点。候选点需再用 haversine 精确筛选。
+    metric 为 'euclidean' 时点已是平面坐标（米，见 LocalProjection），
+    lats、lons 分别传入 y、x，直接分桶并按欧氏距离筛选。
+    """
+
+    def __init__(self, lats, lons, cell_size=100, metric='haversine'):
+        """
+        Args:
+            lats, lons: 点的纬度和经度数组（euclidean 时为 y、x 数组）
+            cell_size: 网格边长（米）
+            metric: 'haversine' 或 'euclidean'
+        """
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.cell_size = float(cell_size)
+        self.metric = metric
+        if metric == 'euclidean':
+            self.ref_lat = 0.0
+            self.cos_ref = 1.0
+            self.scale = 1.0
+            self.distances = euclidean_one_to_many
+        else:
+            self.ref_lat = float(np.mean(self.lats)) if len(self.lats) else 0.0
+            self.cos_ref = math.cos(math.radians(self.ref_lat))
+            self.scale = EARTH_RADIUS * math.pi / 180
+            self.distances = haversine_one_to_many
+
+        self.cells = {}
+        xs, ys = self._cell_coords(self.lats, self.lons)
+        for i, key in enumerate(zip(xs.tolist(), ys.tolist())):
+            self.cells.setdefault(key, []).append(i)
+
+    def _cell_coords(self, lats, lons):
+        """计算点所在的网格坐标"""
+        x = self.scale * np.asarray(lons) * self.cos_ref
+        y = self.scale * np.asarray(lats)
+        return (np.floor(x / self.cell_size).astype(np.int64),
+                np.floor(y / self.cell_size).astype(np.int64))
+
+    def query_cells(self, lat, lon, radius):
+        """返回距离 (lat, lon) 不超过 radius 米的点可能落入的网格中的所有点索引"""
+        cx = math.floor(self.scale * lon * self.cos_ref / self.cell_size)
+        cy = math.floor(self.scale * lat / self.cell_size)
+        # 投影在城市尺度内的比例误差很小，多留5%余量
+        reach = int(np.ceil(radius * 1.05 / self.cell_size))
+
+        indices = []
+        for dx in range(-reach, reach + 1):
+            for dy in range(-reach, reach + 1):
+                bucket = self.cells.get((cx + dx, cy + dy))
+                if bucket:
+                    indices.extend(bucket)
+        return np.array(indices, dtype=np.int64)
+
+    def query_radius(self, lat, lon, radius):
+        """返回距离 (lat, lon) 不超过 radius 米的点索引及对应距离"""
+        indices = self.query_cells(lat, lon, radius)
+        if len(indices) == 0:
+            return indices, np.empty(0, dtype=np.float64)
+        distances = self.distances(lat, lon, self.lats[indices], self.lons[indices])
+        mask = distances < radius
+        return indices[mask], distances[mask]
+
+    def nearest(self, lat, lon, max_distance):
+        """返回距离 (lat, lon) 最近的点索引及距离
+
+        从所在网格开始逐圈向外搜索，找到的最近距离小于下一圈可能的最小距离时停止。
+        max_distance 米内没有点时返回 (-1, inf)。
+        """
+        cx = math.floor(self.scale * lon * self.cos_ref / self.cell_size)
+        cy = math.floor(self.scale * lat / self.cell_size)
+        # 与 query_cells 相同，按5%余量估计投影误差
+        max_ring = int(np.ceil(max_distance * 1.05 / self.cell_size))
+
+        best_index = -1
+        best_distance = float('inf')
+        for ring in range(max_ring + 1):
+            # 第 ring 圈中的点距离不小于 (ring - 1) 个网格边长
+            if (ring - 1) * self.cell_size * 0.95 > min(best_distance, max_distance):
+                break
+            indices = []
+            for dx in range(-ring, ring + 1):
+                for dy in range(-ring, ring + 1):
+                    if max(abs(dx), abs(dy)) != ring:
+                        continue
+                    bucket = self.cells.get((cx + dx, cy + dy))
+                    if bucket:
+                        indices.extend(bucket)
+            if not indices:
+                continue
+            indices = np.array(indices, dtype=np.int64)
+            distances = self.distances(lat, lon, self.lats[indices], self.lons[indices])
+            # 距离相同时取索引较小的点
+            order = np.lexsort((indices, distances))
+            candidate = order[0]
+            if distances[candidate] < best_distance or (
+                    distances[candidate] == best_distance and indices[candidate] < best_index):
+                best_index = int(indices[candidate])
+                best_distance = float(distances[candidate])
+
+        if best_distance >= max_distance:
+            return -1, float('inf')
+        return best_index, best_distance
+
+
+def project_local(coords, ref_lat=None):
+    """以等距圆柱投影将 [lon, lat] 坐标转换为平面坐标（米），适用于城市尺度
+
+    Args:
+        coords: (N, 2) 数组，每行为 [lon, lat]
+        ref_lat: 投影参考纬度，默认为所有点的平均纬度
+
+    Returns:
+        (N, 2) 数组，每行为 [x, y]
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if ref_lat is None:
+        ref_lat = float(np.mean(coords[:, 1])) if len(coords) else 0.0
+    x = EARTH_RADIUS * np.radians(coords[:, 0]) * math.cos(math.radians(ref_lat))
+    y = EARTH_RADIUS * np.radians(coords[:, 1])
+    return np.column_stack([x, y])
+
+
+def point_segment_distances(points, start, end):
+    """计算多个平面点到线段 start-end 的距离"""
+    direction = end - start
+    length_sq = float(direction @ direction)
+    if length_sq == 0.0:
+        return np.hypot(*(points - start).T)
+    t = np.clip((points - start) @ direction / length_sq, 0.0, 1.0)
+    nearest = start + t[:, np.newaxis] * direction
+    return np.hypot(*(points - nearest).T)
+
+
+def simplify_indices(coords, tolerance, keep_indices=None):
+    """用 Douglas-Peucker 算法简化路径，返回保留的点索引（升序）
+
+    路径先在 keep_indices 处切开，各段分别简化，因此这些点一定会保留。
+    每次对一段内的所有点向量化计算到端点连线的距离。
+
+    Args:
+        coords: (N, 2) 数组，每行为 [lon, lat]
+        tolerance: 容差（米），偏离简化后路径不超过该值的点被移除
+        keep_indices: 必须保留的点索引，例如车站
+    """
+    n = len(coords)
+    if n <= 2 or tolerance <= 0:
+        return np.arange(n, dtype=np.int64)
+
+    points = project_local(coords)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+    if keep_indices is not None and len(keep_indices):
+        keep[np.asarray(keep_indices, dtype=np.int64)] = True
+
+    anchors = np.flatnonzero(keep)
+    stack = [(int(a), int(b)) for a, b in zip(anchors[:-1], anchors[1:]) if b - a > 1]
+    while stack:
+        first, last = stack.pop()
+        distances = point_segment_distances(points[first + 1:last], points[first], points[last])
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            if split - first > 1:
+                stack.append((first, split))
+            if last - split > 1:
+                stack.append((split, last))
+
+    return np.flatnonzero(keep)
@@ -0,0 +1,130 @@
+import contextlib
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+
+# 逐个元素（way、车站）的处理细节以 DEBUG 级别输出，安静模式下不输出
+logger = logging.getLogger('metro')
+if not logger.handlers:
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+
+
+def set_quiet(quiet):
+    """设置安静模式，为 True 时不输出逐个元素的处理细节"""
+    logger.setLevel(logging.INFO if quiet else logging.DEBUG)
+
+
+@contextlib.contextmanager
+def silenced():
+    """暂时关闭 logger 的全部输出，例如基准测试计时期间"""
+    disabled = logger.disabled
+    logger.disabled = True
+    try:
+        yield
+    finally:
+        logger.disabled = disabled
+
+
+class RunStats:
+    """一次运行中各处理步骤的耗时与计数
+
+    耗时按步骤名累计（fetch、parse、merge、snap、simplify、save、render 等），
+    计数按名称累加（合并的way数、插入的车站数、下载的字节数等）。可在多个线程中共用；
+    进程池中各进程的统计通过 to_dict / merge 汇总。
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """统计一段代码的耗时，计入步骤 name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds, calls=1):
+        """为步骤累加耗时（秒）与调用次数"""
+        with self.lock:
+            timing = self.timings.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            timing['calls'] += calls
+            timing['seconds'] += seconds
+
+    def count(self, name, value=1):
+        """累加计数"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge(self, other):
+        """合并另一份统计（to_dict 的结果）"""
+        for name, timing in other.get('timings', {}).items():
+            self.add_time(name, timing['seconds'], timing['calls'])
+        for name, value in other.get('counters', {}).items():
+            self.count(name, value)
+
+    def to_dict(self):
+        """返回可序列化为 JSON 的统计结果"""
+        with self.lock:
+            return {
+                'started': self.started,
+                'elapsed': time.time() - self.started,
+                'timings': {name: dict(timing) for name, timing in self.timings.items()},
+                'counters': dict(self.counters)
+            }
+
+    def log_summary(self):
+        """输出各步骤耗时与计数的汇总"""
+        report = self.to_dict()
+        logger.info("运行统计 (总耗时 %.2fs):", report['elapsed'])
+        for name, timing in sorted(report['timings'].items(), key=lambda item: -item[1]['seconds']):
+            logger.info("  %-10s %8.3fs  %d 次", name, timing['seconds'], timing['calls'])
+        for name, value in sorted(report['counters'].items()):
+            logger.info("  %-20s %d", name, value)
+
+    def save_report(self, filename):
+        """将统计结果保存为 JSON 文件"""
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        logger.info("运行统计已保存到 %s", filename)
+
+
+@contextlib.contextmanager
+def profile(filename=None, sort='cumulative', limit=30):
+    """用 cProfile 分析一段代码
+
+    Args:
+        filename: 保存 pstats 数据的文件（可用 snakeviz 等工具查看），None 时不保存
+        sort, limit: 结束时输出的排序方式与条目数，limit 为 0 时不输出
+
+    注意只能分析当前进程，进程池中执行的步骤不会计入。
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if filename:
+            if os.path.dirname(filename):
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+            profiler.dump_stats(filename)
+            logger.info("性能分析数据已保存到 %s", filename)
+        if limit:
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats(sort).print_stats(limit)
+            logger.info(output.getvalue())
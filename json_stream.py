@@ -0,0 +1,97 @@
+import codecs
+import json
+import re
+
+# Overpass 响应中 elements 数组的开头
+ELEMENTS_PATTERN = re.compile(r'"elements"\s*:\s*\[')
+WHITESPACE = ' \t\n\r'
+# 元素之间的空白与逗号
+SEPARATOR_PATTERN = re.compile(r'[ \t\n\r,]*')
+
+
+def iter_chunks(fileobj, chunk_size=64 * 1024):
+    """按块读取文件对象的内容"""
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def iter_elements(chunks, pattern=ELEMENTS_PATTERN):
+    """从分块的 JSON 字节流中逐个解析 elements 数组中的元素
+
+    只在内存中保留尚未解析的部分和当前元素，不构建整个响应的对象树。
+    pattern 匹配数组的开头（默认为 Overpass 响应顶层的 "elements": [），
+    数组之前的内容（版本、版权说明等）被跳过，数组之后的内容不再读取。
+
+    Args:
+        chunks: 字节块的可迭代对象，例如 response.iter_content() 或 iter_chunks(f)
+
+    Yields:
+        elements 数组中的元素（已解析的字典）
+
+    Raises:
+        ValueError: 数据在数组结束前中断或格式错误
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    exhausted = False
+
+    def read_more():
+        nonlocal buffer, exhausted
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            exhausted = True
+            buffer += text_decoder.decode(b'', final=True)
+            return False
+        buffer += text_decoder.decode(chunk)
+        return True
+
+    # 定位数组开头，保留末尾一小段以免模式被块边界切开
+    while True:
+        match = pattern.search(buffer)
+        if match:
+            buffer = buffer[match.end():]
+            break
+        buffer = buffer[-64:]
+        if not read_more():
+            return
+
+    position = 0
+    while True:
+        # 跳过空白与逗号
+        position = SEPARATOR_PATTERN.match(buffer, position).end()
+        if position >= len(buffer):
+            buffer, position = '', 0
+            if not read_more():
+                raise ValueError("JSON 数据在 elements 数组结束前中断")
+            continue
+        if buffer[position] == ']':
+            return
+
+        try:
+            element, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # 当前元素不完整，读取更多数据后重新解析
+            buffer, position = buffer[position:], 0
+            if exhausted or not read_more():
+                raise
+            continue
+
+        # 数字等标量没有结束符，可能被块边界截断（如 2.5 只读到 2.），
+        # 后面不是逗号或数组结尾时读取更多数据再解析
+        if not exhausted and not isinstance(element, (dict, list, str)) \
+                and buffer[end:].lstrip(WHITESPACE)[:1] not in (',', ']'):
+            buffer, position = buffer[position:], 0
+            read_more()
+            continue
+
+        yield element
+        position = end
+        # 已解析的部分较多时丢弃，避免缓冲区无限增长
+        if position > 1024 * 1024:
+            buffer, position = buffer[position:], 0
@@ -0,0 +1,449 @@
+import glob
+import json
+import os
+import struct
+import sys
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+
+from config import LOD_TOLERANCES
+from geo import cumulative_distance, simplify_indices
+from instrument import logger
+
+# 列式文件格式版本
+FORMAT_VERSION = 6
+
+# int32 存储时坐标的量化单位（度），与 OpenStreetMap 数据本身的精度相同，约 1.1 厘米
+COORD_QUANTUM = 1e-7
+
+
+def path_points_to_record(path_points, relation_id, relation_info, fingerprint=None):
+    """将路径点列表转换为列式线路记录
+
+    Returns:
+        线路记录字典:
+            relation_id, name, colour: 线路基本信息
+            coords: (N, 2) float64 数组，每行为 [lon, lat]
+            station_indices: 车站在 coords 中的索引
+            station_names: 与 station_indices 对应的车站名
+            osm_version, osm_timestamp: 生成时关系在 OpenStreetMap 上的版本
+            inserted_indices: 插入路径的车站点索引，其余点为合并得到的轨道点
+            fingerprint: 生成该文件的输入数据哈希与各处理步骤参数，旧文件为 None
+            parts: 各连通部分（主线、支线等互不相连的路径）在 coords 中的起始索引，第一个为 0；
+                第 i 部分为 coords[parts[i]:parts[i + 1]]
+            distances: 每个路径点距线路起点的累计沿线距离（米），与 coords 对应，
+                不同部分之间的间隔不计入，只有同一部分内的距离差有意义
+            station_lookup: 车站名 -> 该站在车站表中的位置列表（环线上同名车站可出现多次）
+            station_distances: 各车站距线路起点的沿线距离（米），与 station_indices 对应
+            lod_tolerances: 各级简化的容差（米），从细到粗
+            lod_indices, lod_offsets: 各级简化保留的点索引，第 i 级为
+                lod_indices[lod_offsets[i]:lod_offsets[i + 1]]
+    """
+    coords = np.array([[p['lon'], p['lat']] for p in path_points], dtype=np.float64).reshape(-1, 2)
+    station_indices = [i for i, p in enumerate(path_points) if p['is_station']]
+    station_names = [path_points[i]['station_name'] for i in station_indices]
+    inserted_indices = [i for i, p in enumerate(path_points) if p.get('inserted')]
+    parts = [0] + [i for i, p in enumerate(path_points) if i > 0 and p.get('part_start')]
+
+    return add_levels_of_detail(add_station_index({
+        'relation_id': relation_id,
+        'name': relation_info['name'],
+        'colour': relation_info['colour'],
+        'osm_version': relation_info.get('version'),
+        'osm_timestamp': relation_info.get('timestamp'),
+        'coords': coords,
+        'station_indices': np.array(station_indices, dtype=np.int64),
+        'station_names': station_names,
+        'inserted_indices': np.array(inserted_indices, dtype=np.int64),
+        'fingerprint': fingerprint,
+        'parts': np.array(parts, dtype=np.int64)
+    }))
+
+
+def build_station_lookup(station_names):
+    """建立车站名到车站表位置的索引"""
+    lookup = {}
+    for position, name in enumerate(station_names):
+        lookup.setdefault(name, []).append(position)
+    return lookup
+
+
+def add_station_index(record):
+    """为线路记录补全分段（parts）、累计距离（distances）、车站索引（station_lookup）
+    与车站沿线距离（station_distances）"""
+    if record.get('parts') is None:
+        record['parts'] = np.zeros(1, dtype=np.int64)
+    if record.get('distances') is None:
+        record['distances'] = cumulative_distance(record['coords'], record['parts'])
+    if record.get('station_lookup') is None:
+        record['station_lookup'] = build_station_lookup(record['station_names'])
+    if record.get('station_distances') is None:
+        record['station_distances'] = record['distances'][record['station_indices']]
+    return record
+
+
+def part_bounds(record):
+    """返回各部分的 (起始索引, 结束索引) 列表，结束索引不包含在该部分内"""
+    ends = list(record['parts'][1:].tolist()) + [len(record['coords'])]
+    return list(zip(record['parts'].tolist(), ends))
+
+
+def station_parts(record):
+    """返回各车站所在的部分编号，与 station_indices 对应；没有 parts 的记录全部为 0"""
+    parts = record.get('parts')
+    if parts is None:
+        return np.zeros(len(record['station_indices']), dtype=np.int64)
+    return np.searchsorted(parts, record['station_indices'], side='right') - 1
+
+
+def add_levels_of_detail(record, tolerances=LOD_TOLERANCES):
+    """为线路记录补全多级简化索引，车站点与各部分的首尾点在每一级中都保留"""
+    if record.get('lod_indices') is not None:
+        return record
+
+    part_ends = [end - 1 for _, end in part_bounds(record) if end > 0]
+    keep_indices = np.concatenate([record['station_indices'], record['parts'], part_ends]).astype(np.int64)
+    levels = [simplify_indices(record['coords'], tolerance, keep_indices)
+              for tolerance in tolerances]
+    record['lod_tolerances'] = np.array(tolerances, dtype=np.float64)
+    record['lod_offsets'] = np.cumsum([0] + [len(level) for level in levels]).astype(np.int64)
+    record['lod_indices'] = (np.concatenate(levels).astype(np.int64) if levels
+                             else np.empty(0, dtype=np.int64))
+    return record
+
+
+def split_parts(record, indices=None):
+    """按部分拆分线路坐标，返回每部分一个 (n, 2) 数组的列表
+
+    Args:
+        indices: 只取这些点（升序的点索引，例如某一级简化，需包含各部分的起点），None 表示所有点
+
+    没有 parts 的记录（如区间记录）视为只有一部分。
+    """
+    coords = np.asarray(record['coords'])
+    if indices is not None:
+        coords = coords[indices]
+    parts = record.get('parts')
+    if parts is None or len(parts) <= 1:
+        return [coords]
+    if indices is None:
+        return np.split(coords, parts[1:])
+    return np.split(coords, np.searchsorted(indices, parts[1:]))
+
+
+def lod_parts(record, max_tolerance):
+    """返回容差不超过 max_tolerance 的最粗一级简化坐标（按部分拆分），没有合适级别时返回完整坐标"""
+    tolerances = record.get('lod_tolerances')
+    if tolerances is None or not len(tolerances):
+        return split_parts(record)
+
+    level = int(np.searchsorted(tolerances, max_tolerance, side='right')) - 1
+    if level < 0:
+        return split_parts(record)
+    offsets = record['lod_offsets']
+    return split_parts(record, record['lod_indices'][offsets[level]:offsets[level + 1]])
+
+
+def track_parts(record):
+    """返回线路记录中合并得到的各部分轨道坐标（去掉插入的车站点），即车站插入前的路径"""
+    track = np.ones(len(record['coords']), dtype=bool)
+    track[record['inserted_indices']] = False
+    return [coords[track[start:end]] for coords, (start, end) in zip(split_parts(record), part_bounds(record))]
+
+
+def record_to_path_points(record):
+    """将列式线路记录还原为路径点列表"""
+    path_points = [{
+        'lat': float(lat),
+        'lon': float(lon),
+        'is_station': False,
+        'station_name': None,
+        'inserted': False
+    } for lon, lat in record['coords'].tolist()]
+
+    for index in record['parts'][1:].tolist():
+        path_points[index]['part_start'] = True
+    for index, name in zip(record['station_indices'].tolist(), record['station_names']):
+        path_points[index]['is_station'] = True
+        path_points[index]['station_name'] = name
+    for index in record['inserted_indices'].tolist():
+        path_points[index]['inserted'] = True
+
+    return path_points
+
+
+def encode_coords(coords, storage):
+    """按存储方式编码坐标，返回 {数组名: 数组}
+
+    float64 直接保存经纬度；float32、int32 保存相对线路原点（coords_origin）的偏移。
+    每个坐标分量的误差: float32 在距原点 2 度以内不超过 6e-8 度（约 7 毫米），
+    int32 按 COORD_QUANTUM 量化，不超过半个单位 5e-8 度（约 6 毫米）；点的位置误差均不超过约 1 厘米。
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if storage == 'float64':
+        return {'coords': np.ascontiguousarray(coords)}
+    origin = (coords.min(axis=0) + coords.max(axis=0)) / 2 if len(coords) else np.zeros(2)
+    offsets = coords - origin
+    if storage == 'float32':
+        offsets = offsets.astype(np.float32)
+    elif storage == 'int32':
+        offsets = np.round(offsets / COORD_QUANTUM).astype(np.int32)
+    else:
+        raise ValueError(f"未知的坐标存储方式: {storage}")
+    return {'coords_origin': origin, 'coords_offsets': np.ascontiguousarray(offsets)}
+
+
+def decode_coords(arrays):
+    """由 encode_coords 保存的数组还原 (N, 2) float64 经纬度坐标"""
+    if 'coords' in arrays:
+        return arrays['coords']
+    offsets = np.asarray(arrays['coords_offsets'], dtype=np.float64)
+    if arrays['coords_offsets'].dtype == np.int32:
+        offsets *= COORD_QUANTUM
+    return np.asarray(arrays['coords_origin'], dtype=np.float64) + offsets
+
+
+def save_record_npz(record, filename, storage='float64'):
+    """以未压缩的 npz 格式保存线路记录，各数组可在读取时直接内存映射
+
+    Args:
+        storage: 坐标存储方式（见 encode_coords），float32、int32 时累计距离也以 float32 保存
+            （10 万米内舍入误差不超过 4 毫米），文件约为 float64 的一半
+    """
+    distance_dtype = np.float64 if storage == 'float64' else np.float32
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'relation_id': record['relation_id'],
+        'name': record['name'],
+        'colour': record['colour'],
+        'osm_version': record.get('osm_version'),
+        'osm_timestamp': record.get('osm_timestamp'),
+        'fingerprint': record.get('fingerprint'),
+        'station_lookup': record['station_lookup']
+    }
+    # 先写入临时文件再替换：np.savez 写入文件对象时不会补全 .npz 后缀，中途失败也不会留下不完整的文件。
+    # POSIX 上替换不影响仍在内存映射旧文件的读取方；Windows 上仍被映射的文件无法替换，
+    # 调用方需先释放对旧文件的映射（如从 LineStore 中移除），或以 mmap=False 读取将被重写的文件
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, 'wb') as f:
+        np.savez(
+            f,
+            meta=np.array(json.dumps(meta, ensure_ascii=False)),
+            **encode_coords(record['coords'], storage),
+            station_indices=np.asarray(record['station_indices'], dtype=np.int64),
+            station_names=np.array(record['station_names'], dtype=str).reshape(-1),
+            inserted_indices=np.asarray(record['inserted_indices'], dtype=np.int64),
+            parts=np.asarray(record['parts'], dtype=np.int64),
+            distances=np.asarray(record['distances'], dtype=distance_dtype),
+            station_distances=np.asarray(record['station_distances'], dtype=distance_dtype),
+            lod_tolerances=np.asarray(record['lod_tolerances'], dtype=np.float64),
+            lod_offsets=np.asarray(record['lod_offsets'], dtype=np.int64),
+            lod_indices=np.asarray(record['lod_indices'], dtype=np.int64)
+        )
+    os.replace(tmp_filename, filename)
+
+
+def _mmap_npz_member(filename, info):
+    """内存映射 npz 中未压缩的数组，无法映射时返回 None"""
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+
+    with open(filename, 'rb') as f:
+        # 跳过 zip 本地文件头，定位到 .npy 数据
+        f.seek(info.header_offset)
+        local_header = f.read(30)
+        name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    if dtype.hasobject:
+        return None
+    if int(np.prod(shape)) == 0:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset,
+                     shape=shape, order='F' if fortran_order else 'C')
+
+
+def load_record_npz(filename, mmap=True):
+    """读取 npz 格式的线路记录
+
+    Args:
+        mmap: 为 True 时坐标等数组以只读内存映射方式读取，不复制数据
+    """
+    arrays = {}
+    if mmap:
+        with zipfile.ZipFile(filename) as zf:
+            for info in zf.infolist():
+                array = _mmap_npz_member(filename, info)
+                if array is not None:
+                    arrays[info.filename[:-len('.npy')]] = array
+
+    # 压缩或无法映射的数组按常规方式读取
+    with np.load(filename, allow_pickle=False) as data:
+        for key in data.files:
+            if key not in arrays:
+                arrays[key] = data[key]
+
+    meta = json.loads(str(arrays['meta'][()]))
+    return add_levels_of_detail(add_station_index({
+        'relation_id': meta['relation_id'],
+        'name': meta['name'],
+        'colour': meta['colour'],
+        'osm_version': meta.get('osm_version'),
+        'osm_timestamp': meta.get('osm_timestamp'),
+        'coords': decode_coords(arrays),
+        'station_indices': arrays['station_indices'],
+        'station_names': arrays['station_names'].tolist(),
+        'inserted_indices': arrays.get('inserted_indices', np.empty(0, dtype=np.int64)),
+        'fingerprint': meta.get('fingerprint'),
+        'parts': arrays.get('parts'),
+        'distances': arrays.get('distances'),
+        'station_lookup': meta.get('station_lookup'),
+        'station_distances': arrays.get('station_distances'),
+        'lod_tolerances': arrays.get('lod_tolerances'),
+        'lod_offsets': arrays.get('lod_offsets'),
+        'lod_indices': arrays.get('lod_indices')
+    }))
+
+
+def load_record_json(filename):
+    """读取 JSON 格式的线路文件并转换为列式线路记录"""
+    with open(filename, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    relation_info = {
+        'name': data.get('name', '地铁线路'),
+        'colour': data.get('colour', '#000000'),
+        'version': data.get('osm_version'),
+        'timestamp': data.get('osm_timestamp')
+    }
+    return path_points_to_record(data.get('path_points', []), data.get('relation_id'), relation_info,
+                                 data.get('fingerprint'))
+
+
+def load_record(filename, mmap=True):
+    """按文件后缀读取线路记录，支持 .npz 与 JSON"""
+    if filename.endswith('.npz'):
+        return load_record_npz(filename, mmap=mmap)
+    return load_record_json(filename)
+
+
+def record_nbytes(record):
+    """估算线路记录占用的内存（字节）"""
+    return sum(value.nbytes for value in record.values() if isinstance(value, np.ndarray))
+
+
+class LineStore:
+    """已加载线路记录的内存缓存
+
+    每个线路文件只读取一次，之后的绘图和区间查询直接使用内存中的记录。
+    文件的修改时间或大小变化时自动重新读取；记录数或总内存超过上限时
+    按最近最少使用的顺序移除。
+    """
+
+    def __init__(self, max_lines=None, max_bytes=None):
+        """
+        Args:
+            max_lines: 最多保留的记录数，None 表示不限制
+            max_bytes: 记录总内存上限（字节），None 表示不限制
+        """
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+    def get(self, filename):
+        """返回文件对应的线路记录，未加载或文件已变化时读取文件
+
+        返回的记录在多次调用之间共享，调用方不应修改其中的数据。
+        """
+        key = os.path.abspath(filename)
+        stat = os.stat(key)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        entry = self.entries.get(key)
+        if entry is not None and entry['signature'] == signature:
+            self.entries.move_to_end(key)
+            return entry['record']
+
+        record = load_record(key)
+        self.put(key, record, signature)
+        return record
+
+    def put(self, key, record, signature):
+        """加入一条记录，并按上限移除最近最少使用的记录"""
+        self.invalidate(key)
+        nbytes = record_nbytes(record)
+        self.entries[key] = {'record': record, 'signature': signature, 'nbytes': nbytes}
+        self.total_bytes += nbytes
+
+        # 至少保留刚加入的记录
+        while len(self.entries) > 1 and (
+                (self.max_lines is not None and len(self.entries) > self.max_lines) or
+                (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= evicted['nbytes']
+
+    def invalidate(self, filename):
+        """移除文件对应的记录"""
+        entry = self.entries.pop(os.path.abspath(filename), None)
+        if entry is not None:
+            self.total_bytes -= entry['nbytes']
+
+    def clear(self):
+        """清空所有记录"""
+        self.entries.clear()
+        self.total_bytes = 0
+
+
+def migrate_json_file(json_filename, npz_filename=None):
+    """将 JSON 格式的线路文件转换为 npz 格式，返回新文件名"""
+    if npz_filename is None:
+        npz_filename = os.path.splitext(json_filename)[0] + '.npz'
+
+    record = load_record_json(json_filename)
+    if len(record['coords']) == 0:
+        logger.warning("文件 %s 中没有路径数据，跳过", json_filename)
+        return None
+
+    save_record_npz(record, npz_filename)
+    logger.info("已转换 %s -> %s", json_filename, npz_filename)
+    return npz_filename
+
+
+def migrate_json_cache(directory='.', remove_json=False):
+    """将目录下所有 metro_line_*.json 缓存转换为 npz 格式
+
+    Args:
+        directory: 缓存所在目录
+        remove_json: 转换成功后是否删除原 JSON 文件
+
+    Returns:
+        转换得到的 npz 文件名列表
+    """
+    npz_filenames = []
+    for json_filename in sorted(glob.glob(os.path.join(directory, 'metro_line_*.json'))):
+        try:
+            npz_filename = migrate_json_file(json_filename)
+        except Exception as e:
+            logger.warning("转换 %s 失败: %s", json_filename, e)
+            continue
+        if npz_filename:
+            npz_filenames.append(npz_filename)
+            if remove_json:
+                os.remove(json_filename)
+    logger.info("共转换 %d 个文件", len(npz_filenames))
+    return npz_filenames
+
+
+# 转换工具: python line_data.py [目录]
+if __name__ == "__main__":
+    migrate_json_cache(sys.argv[1] if len(sys.argv) > 1 else '.')
@@ -1,39 +1,324 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import matplotlib
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
 import numpy as np
+import contextlib
+import hashlib
+import io
 import math
 import os
-from config import METRO_LINES, LINE_NAME_TO_INDEX, LINE_NAME_TO_RELATION_ID
+import struct
+import tempfile
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from config import (METRO_LINES, LINE_NAME_TO_INDEX, LINE_NAME_TO_RELATION_ID, OUTPUT_FORMAT,
+                    OVERPASS_URL, OVERPASS_BATCH_SIZE, MAX_RETRIES, RETRY_BACKOFF, RETRY_STATUS_CODES,
+                    REQUEST_TIMEOUT, HTTP_POOL_SIZE, FRESHNESS_CHECK, CACHE_DIR, CACHE_TTL, CACHE_MAX_SIZE,
+                    MERGE_JOIN_DISTANCE, MERGE_MODE, COMPONENT_WORKERS, COORDINATE_MODE, COORD_STORAGE,
+                    STATION_SNAP_DISTANCE, STATION_MERGE_DISTANCE,
+                    LINE_STORE_MAX_LINES, LINE_STORE_MAX_BYTES, NETWORK_CACHE_FILE, TRANSFER_PENALTY,
+                    SIMPLIFY_TOLERANCE, LOD_TOLERANCES, LOD_PIXEL_TOLERANCE,
+                    BASEMAP_CACHE_DIR, BASEMAP_CACHE_MAX_SIZE, STREAM_RESPONSES, STREAM_CHUNK_SIZE,
+                    QUIET, REPORT_FILE, PROFILE_FILE, OSM_ROUTE_TYPES)
+from cache import ResponseCache
+from network import MetroNetwork, file_signatures
+from instrument import logger, RunStats, set_quiet, profile
+from json_stream import iter_chunks, iter_elements
+from osm_extract import read_extract
+from viewport import ViewportRenderer
+from geo import (EARTH_RADIUS, haversine_one_to_many, haversine_matrix, euclidean_one_to_many,
+                 euclidean_matrix, LocalProjection, GridIndex, simplify_indices)
+from line_data import (path_points_to_record, track_parts, lod_parts, split_parts, station_parts,
+                       load_record, save_record_npz, migrate_json_file, LineStore)
+
+# 各处理步骤的算法版本，修改算法时递增对应版本，已生成的线路文件会在下次处理时自动更新
+ALGORITHM_VERSIONS = {
+    'merge': 3,
+    'snap': 1,
+    'simplify': 1
+}
+
+# 关系成员中表示车站（停车位置、站台）的角色，其余成员way视为轨道
+STATION_ROLES = ('stop', 'stop_entry_only', 'stop_exit_only',
+                 'platform', 'platform_entry_only', 'platform_exit_only')
 
 class MetroLinePlotter:
-    def __init__(self):
-        self.overpass_url = "https://overpass-api.de/api/interpreter"
+    def __init__(self, overpass_url=None, timeout=None, session=None, cache=None, offline=False, quiet=None,
+                 basemap_cache=None):
+        """
+        Args:
+            overpass_url: Overpass API 地址，默认使用 config.OVERPASS_URL，
+                可指向镜像或本地测试服务
+            timeout: 请求超时（秒），默认使用 config.REQUEST_TIMEOUT
+            session: 自定义的 requests.Session，默认创建带连接池的会话
+            cache: 原始响应缓存（ResponseCache），默认按 config.CACHE_DIR 创建，
+                传入 False 或 CACHE_DIR 为 None 时不缓存
+            offline: 离线模式，只使用缓存中的响应（忽略有效期），不发送网络请求
+            quiet: 安静模式，不输出逐个way、车站的处理细节，默认使用 config.QUIET
+            basemap_cache: 底图的栅格缓存（ResponseCache），默认按 config.BASEMAP_CACHE_DIR 创建，
+                传入 False 或 BASEMAP_CACHE_DIR 为 None 时不缓存；未指定且 cache 为 False 时也不缓存
+        """
+        self.overpass_url = overpass_url or OVERPASS_URL
+        self.timeout = timeout or REQUEST_TIMEOUT
+        self.session = session or self.create_session()
+        if cache is None and CACHE_DIR:
+            cache = ResponseCache(CACHE_DIR, ttl=CACHE_TTL, max_size=CACHE_MAX_SIZE)
+        self.cache = cache or None
+        # 线网底图的栅格缓存
+        if basemap_cache is None and cache is not False and BASEMAP_CACHE_DIR:
+            basemap_cache = ResponseCache(BASEMAP_CACHE_DIR, max_size=BASEMAP_CACHE_MAX_SIZE, suffix='.npz')
+        self.basemap_cache = basemap_cache or None
+        self.offline = offline
+        self.quiet = QUIET if quiet is None else quiet
+        set_quiet(self.quiet)
+        # 距离计算方式: 'haversine'（经纬度）或 'euclidean'（投影模式下处理线路时的平面坐标，米）
+        self.metric = 'haversine'
+        # 各处理步骤的耗时与计数
+        self.stats = RunStats()
+        # 已加载的线路记录，绘图与区间查询共用
+        self.line_store = LineStore(max_lines=LINE_STORE_MAX_LINES, max_bytes=LINE_STORE_MAX_BYTES)
+        setup_fonts()
 
-    def get_metro_line_data(self, relation_id):
-        """获取地铁线路数据"""
-        query = f"""
+    def create_session(self):
+        """创建复用长连接的HTTP会话，请求gzip压缩的响应"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update({
+            'Accept-Encoding': 'gzip, deflate',
+            'User-Agent': 'osm-metro-line-plotter'
+        })
+        return session
+
+    def post_overpass(self, query, use_cache=True, refresh=False):
+        """发送 Overpass 查询并返回解析后的数据
+        
+        缓存中有未过期的响应时直接使用；离线模式下忽略有效期，缓存中没有时抛出异常。
+        遇到 HTTP 429/504 时按指数退避重试，最多重试 config.MAX_RETRIES 次；
+        服务器返回 Retry-After 时取两者中较长的等待时间。
+        
+        Args:
+            use_cache: 是否读写原始响应缓存
+            refresh: 为 True 时不读取缓存，重新请求并更新缓存（离线模式下无效）
+        """
+        if use_cache and self.cache is not None and (not refresh or self.offline):
+            content = self.cache.get(query, ignore_ttl=self.offline)
+            if content is not None:
+                logger.info("使用缓存的响应")
+                self.stats.count('cache_hits')
+                self.stats.count('bytes_fetched', len(content))
+                return json.loads(content)
+        
+        if self.offline:
+            raise RuntimeError("离线模式下缓存中没有该查询的响应")
+        
+        response = self.request_overpass(query)
+        self.stats.count('bytes_fetched', len(response.content))
+        data = response.json()
+        if use_cache and self.cache is not None:
+            self.cache.put(query, response.content)
+        return data
+
+    def request_overpass(self, query, stream=False):
+        """发送 Overpass 查询并返回响应，遇到 HTTP 429/504 时按指数退避重试
+        
+        Args:
+            stream: 为 True 时不立即下载响应内容，由调用方逐块读取
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            response = self.session.post(self.overpass_url, data=query, timeout=self.timeout, stream=stream)
+            self.stats.count('requests')
+            if response.status_code in RETRY_STATUS_CODES and attempt < MAX_RETRIES:
+                wait = RETRY_BACKOFF * (2 ** attempt)
+                retry_after = response.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    wait = max(wait, int(retry_after))
+                logger.warning("服务器繁忙 (HTTP %s)，%.0f 秒后重试...", response.status_code, wait)
+                self.stats.count('retries')
+                response.close()
+                time.sleep(wait)
+                continue
+            response.raise_for_status()
+            return response
+
+    def stream_overpass(self, query, refresh=False):
+        """发送 Overpass 查询并逐块返回原始响应，缓存规则与 post_overpass 相同
+        
+        从服务器下载时边读取边写入临时文件，完整读取后才存入缓存；
+        调用方中途停止读取时不会缓存不完整的响应。
+        
+        Yields:
+            响应内容的字节块
+        """
+        if self.cache is not None and (not refresh or self.offline):
+            f = self.cache.open(query, ignore_ttl=self.offline)
+            if f is not None:
+                logger.info("使用缓存的响应")
+                self.stats.count('cache_hits')
+                with f:
+                    yield from iter_chunks(f, STREAM_CHUNK_SIZE)
+                return
+        
+        if self.offline:
+            raise RuntimeError("离线模式下缓存中没有该查询的响应")
+        
+        response = self.request_overpass(query, stream=True)
+        with response:
+            if self.cache is None:
+                yield from response.iter_content(STREAM_CHUNK_SIZE)
+                return
+            
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache.cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                        f.write(chunk)
+                        yield chunk
+                self.cache.put_file(query, tmp_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def timed_chunks(self, chunks, timing):
+        """逐块转发数据，读取每块的耗时累加到 timing['seconds']，字节数计入 bytes_fetched"""
+        chunks = iter(chunks)
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            timing['seconds'] += time.perf_counter() - start
+            if chunk is None:
+                return
+            self.stats.count('bytes_fetched', len(chunk))
+            yield chunk
+
+    def routes_query(self, relation_ids):
+        """生成获取线路数据的 Overpass 查询，关系本身只输出标签、成员与版本信息，成员way和节点输出几何"""
+        if len(relation_ids) == 1:
+            return f"""
         [out:json][timeout:25];
-        (
-          relation({relation_id});
-        );
-        (._;>;);
+        relation({relation_ids[0]})->.routes;
+        .routes out meta;
+        .routes >;
         out geom;
         """
         
+        ids = ','.join(str(relation_id) for relation_id in relation_ids)
+        return f"""
+        [out:json][timeout:{min(25 * len(relation_ids), 180)}];
+        relation(id:{ids})->.routes;
+        .routes out meta;
+        .routes >;
+        out geom;
+        """
+
+    def fetch_lines_data(self, relation_ids, refresh=False, stream=None):
+        """获取一条或多条线路的数据，并在一次遍历中提取各线路的基本信息与几何
+        
+        流式模式下边下载边解析，只保留提取结果，不在内存中保留完整响应。
+        
+        Args:
+            relation_ids: OSM关系ID列表，多个关系合并为一次查询
+            refresh: 为 True 时跳过响应缓存，从服务器重新获取
+            stream: 是否流式解析，默认使用 config.STREAM_RESPONSES
+        
+        Returns:
+            {relation_id: line_data} 字典，line_data 格式见 extract_lines_data；
+            请求失败或响应中缺少某条关系时对应 None
+        """
+        if stream is None:
+            stream = STREAM_RESPONSES
+        query = self.routes_query(relation_ids)
+        
         try:
-            print(f"正在请求关系 {relation_id} 的数据...")
-            response = requests.post(self.overpass_url, data=query)
-            response.raise_for_status()
-            data = response.json()
-            print(f"成功获取数据，包含 {len(data.get('elements', []))} 个元素")
-            return data
+            logger.info("正在请求关系 %s 的数据...", ', '.join(str(relation_id) for relation_id in relation_ids))
+            if stream:
+                # 下载与解析交替进行，读取数据块的耗时计入 fetch，其余计入 parse
+                fetch_time = {'seconds': 0.0}
+                chunks = self.timed_chunks(self.stream_overpass(query, refresh=refresh), fetch_time)
+                start = time.perf_counter()
+                lines_data = self.extract_lines_data(iter_elements(chunks), relation_ids)
+                # 读完数组之后的剩余内容，使完整的响应写入缓存
+                for _ in chunks:
+                    pass
+                self.stats.add_time('fetch', fetch_time['seconds'])
+                self.stats.add_time('parse', time.perf_counter() - start - fetch_time['seconds'])
+            else:
+                with self.stats.stage('fetch'):
+                    data = self.post_overpass(query, refresh=refresh)
+                with self.stats.stage('parse'):
+                    lines_data = self.extract_lines_data(data.get('elements', []), relation_ids)
         except Exception as e:
-            print(f"获取数据失败: {e}")
+            logger.warning("获取数据失败: %s", e)
+            return {relation_id: None for relation_id in relation_ids}
+        
+        return lines_data
+
+    def get_relation_versions(self, relation_ids):
+        """查询关系在 OpenStreetMap 上的当前版本
+        
+        只请求关系本身的元数据，不含成员几何，开销很小。
+        
+        Returns:
+            {relation_id: (version, timestamp)} 字典，请求失败时返回 None
+        """
+        ids = ','.join(str(relation_id) for relation_id in relation_ids)
+        query = f"""
+        [out:json][timeout:25];
+        relation(id:{ids});
+        out meta;
+        """
+        
+        try:
+            data = self.post_overpass(query, use_cache=False)
+        except Exception as e:
+            logger.warning("查询关系版本失败: %s", e)
             return None
+        
+        return {element['id']: (element.get('version'), element.get('timestamp'))
+                for element in data.get('elements', []) if element['type'] == 'relation'}
+
+    def find_changed_relations(self, relation_ids):
+        """对比本地线路文件与 OpenStreetMap 上的关系版本，返回需要更新的关系ID列表
+        
+        本地文件不存在、未记录版本或版本查询失败的关系都视为需要更新。
+        注意关系版本只在标签或成员列表变化时增加，仅移动成员way的节点不会改变关系版本。
+        """
+        local_versions = {}
+        for relation_id in relation_ids:
+            filename = f"metro_line_{relation_id}.{OUTPUT_FORMAT}"
+            record = self.load_line(filename) if os.path.exists(filename) else None
+            if record is not None and record.get('osm_version') is not None:
+                local_versions[relation_id] = (record['osm_version'], record['osm_timestamp'])
+        
+        # 离线模式无法查询上游版本
+        if not local_versions or self.offline:
+            return list(relation_ids)
+        
+        remote_versions = self.get_relation_versions(list(local_versions))
+        if remote_versions is None:
+            return list(relation_ids)
+        
+        changed_ids = []
+        for relation_id in relation_ids:
+            local = local_versions.get(relation_id)
+            if local is None or remote_versions.get(relation_id) != local:
+                changed_ids.append(relation_id)
+            else:
+                logger.info("关系 %s 未变化 (版本 %s)，跳过更新", relation_id, local[0])
+        return changed_ids
 
     def calculate_distance(self, lat1, lon1, lat2, lon2):
-        """计算两点间距离（米）"""
+        """计算两点间距离（米），平面坐标时 lat、lon 分别为 y、x"""
+        if self.metric == 'euclidean':
+            return math.hypot(lon2 - lon1, lat2 - lat1)
         R = 6371000  # 地球半径（米）
         lat1_rad = math.radians(lat1)
         lat2_rad = math.radians(lat2)
@@ -47,12 +332,32 @@ class MetroLinePlotter:
         
         return R * c
 
-    def merge_ways(self, ways_info):
-        """合并所有way为一条连续路径"""
+    def calculate_distances(self, lat, lon, lats, lons):
+        """计算一个点到多个点的距离（米），返回numpy数组"""
+        if self.metric == 'euclidean':
+            return euclidean_one_to_many(lat, lon, lats, lons)
+        return haversine_one_to_many(lat, lon, lats, lons)
+
+    def calculate_distance_matrix(self, lats1, lons1, lats2, lons2):
+        """计算两组点之间的距离矩阵（米），形状为 (len(lats1), len(lats2))"""
+        if self.metric == 'euclidean':
+            return euclidean_matrix(lats1, lons1, lats2, lons2)
+        return haversine_matrix(lats1, lons1, lats2, lons2)
+
+    def merge_ways(self, ways_info, leftover=None):
+        """合并所有way为一条连续路径
+        
+        以网格索引记录所有way的端点，每次连接只检查当前路径两端 MERGE_JOIN_DISTANCE 米（默认100米）内的候选way，
+        连接规则与 merge_ways_scan 一致：取原顺序中第一个可连接的way，并按
+        end_to_start、end_to_end、start_to_start、start_to_end 的顺序选择最近的连接方式。
+        
+        Args:
+            leftover: 传入列表时，未能连接的way（原格式）追加到其中，由调用方继续处理，不再输出警告
+        """
         if not ways_info:
             return []
         
-        print(f"开始合并 {len(ways_info)} 个way...")
+        logger.info("开始合并 %d 个way...", len(ways_info))
         
         # 创建way坐标副本
         remaining_ways = []
@@ -63,76 +368,309 @@ class MetroLinePlotter:
                 'used': False
             })
         
+        # 端点索引: 第 i 个way的起点为 2*i，终点为 2*i+1
+        way_count = len(remaining_ways)
+        endpoints = np.empty((way_count * 2, 2), dtype=np.float64)
+        endpoints[0::2] = [way['coordinates'][0] for way in remaining_ways]
+        endpoints[1::2] = [way['coordinates'][-1] for way in remaining_ways]
+        endpoint_index = GridIndex(endpoints[:, 1], endpoints[:, 0], cell_size=MERGE_JOIN_DISTANCE, metric=self.metric)
+        used = np.zeros(way_count, dtype=bool)
+        
+        # 选择第一个way作为起点，使用双端队列使在开头添加way的开销与way长度成正比
+        merged_coords = deque(remaining_ways[0]['coordinates'])
+        remaining_ways[0]['used'] = True
+        used[0] = True
+        logger.info("起始way %s 包含 %d 个点", remaining_ways[0]['id'], len(merged_coords))
+        
+        # 逐个连接其他way
+        while True:
+            current_start = merged_coords[0]
+            current_end = merged_coords[-1]
+            
+            # 从索引中取出两端连接距离内的端点，换算为way编号
+            near_end, _ = endpoint_index.query_radius(current_end[1], current_end[0], MERGE_JOIN_DISTANCE)
+            near_start, _ = endpoint_index.query_radius(current_start[1], current_start[0], MERGE_JOIN_DISTANCE)
+            candidates = np.unique(np.concatenate([near_end, near_start]) // 2)
+            candidates = candidates[~used[candidates]]
+            
+            if len(candidates) == 0:
+                break
+            
+            # 候选way中原顺序最靠前的一个
+            index = int(candidates[0])
+            way = remaining_ways[index]
+            way_start = way['coordinates'][0]
+            way_end = way['coordinates'][-1]
+            
+            # 计算各种连接可能性
+            connections = [
+                ('end_to_start', self.calculate_distance(current_end[1], current_end[0], way_start[1], way_start[0])),
+                ('end_to_end', self.calculate_distance(current_end[1], current_end[0], way_end[1], way_end[0])),
+                ('start_to_start', self.calculate_distance(current_start[1], current_start[0], way_start[1], way_start[0])),
+                ('start_to_end', self.calculate_distance(current_start[1], current_start[0], way_end[1], way_end[0]))
+            ]
+            
+            # 找到最近的连接
+            connection_type, distance = min(connections, key=lambda x: x[1])
+            
+            if connection_type == 'end_to_start':
+                # 在末尾添加way（去掉重复点）
+                merged_coords.extend(way['coordinates'][1:])
+            elif connection_type == 'end_to_end':
+                # 在末尾添加反向way（去掉重复点）
+                merged_coords.extend(way['coordinates'][-2::-1])
+            elif connection_type == 'start_to_start':
+                # 在开头添加反向way（去掉重复点）
+                merged_coords.extendleft(way['coordinates'][1:])
+            elif connection_type == 'start_to_end':
+                # 在开头添加way（去掉重复点）
+                merged_coords.extendleft(way['coordinates'][-2::-1])
+            
+            way['used'] = True
+            used[index] = True
+            logger.debug("连接way %s (%s), 距离: %.1fm", way['id'], connection_type, distance)
+        
+        # 检查未使用的way
+        unused_ways = [way for way in remaining_ways if not way['used']]
+        self.stats.count('ways_merged', len(remaining_ways) - len(unused_ways))
+        if leftover is not None:
+            leftover.extend(ways_info[i] for i in np.flatnonzero(~used).tolist())
+        elif unused_ways:
+            self.stats.count('ways_unconnected', len(unused_ways))
+            logger.warning("警告: %d 个way未能连接:", len(unused_ways))
+            for way in unused_ways:
+                logger.debug("  - way %s", way['id'])
+        
+        merged_coords = list(merged_coords)
+        logger.info("合并完成，总共 %d 个坐标点", len(merged_coords))
+        return merged_coords
+
+    def merge_ways_ordered(self, ways_info):
+        """按给定顺序（关系成员顺序）一次遍历合并way为一条连续路径
+        
+        只需确定每个way的方向：第一个way朝向第二个way，之后每个way取与当前路径末端较近的一端相接。
+        相邻way端点距离超过 MERGE_JOIN_DISTANCE 时说明成员顺序有缺口或不可靠，返回 None，
+        由调用方改用 merge_ways 贪心合并。
+        """
+        if not ways_info:
+            return []
+        
+        logger.info("按成员顺序合并 %d 个way...", len(ways_info))
+        
+        first = ways_info[0]['coordinates']
+        if len(ways_info) > 1:
+            second = ways_info[1]['coordinates']
+            end_distance = min(self.calculate_distance(first[-1][1], first[-1][0], second[0][1], second[0][0]),
+                               self.calculate_distance(first[-1][1], first[-1][0], second[-1][1], second[-1][0]))
+            start_distance = min(self.calculate_distance(first[0][1], first[0][0], second[0][1], second[0][0]),
+                                 self.calculate_distance(first[0][1], first[0][0], second[-1][1], second[-1][0]))
+            if start_distance < end_distance:
+                first = first[::-1]
+        merged_coords = [list(coord) for coord in first]
+        
+        for previous, way in zip(ways_info, ways_info[1:]):
+            coordinates = way['coordinates']
+            current_end = merged_coords[-1]
+            forward = self.calculate_distance(current_end[1], current_end[0], coordinates[0][1], coordinates[0][0])
+            backward = self.calculate_distance(current_end[1], current_end[0], coordinates[-1][1], coordinates[-1][0])
+            distance = min(forward, backward)
+            if distance > MERGE_JOIN_DISTANCE:
+                logger.warning("way %s 与 way %s 之间有 %.0fm 的缺口，改用贪心合并", previous['id'], way['id'], distance)
+                self.stats.count('merge_fallbacks')
+                return None
+            if forward <= backward:
+                # 在末尾添加way（去掉重复点）
+                merged_coords.extend(coordinates[1:])
+            else:
+                # 在末尾添加反向way（去掉重复点）
+                merged_coords.extend(coordinates[-2::-1])
+            logger.debug("连接way %s, 距离: %.1fm", way['id'], distance)
+        
+        self.stats.count('ways_merged', len(ways_info))
+        logger.info("合并完成，总共 %d 个坐标点", len(merged_coords))
+        return merged_coords
+
+    def group_connected_ways(self, ways_info):
+        """按端点是否相连（距离在 MERGE_JOIN_DISTANCE 内）将way分为若干连通组
+        
+        Returns:
+            way列表的列表，组内保持原顺序，各组按其第一个way在原列表中的位置排列
+        """
+        way_count = len(ways_info)
+        endpoints = np.empty((way_count * 2, 2), dtype=np.float64)
+        endpoints[0::2] = [way['coordinates'][0] for way in ways_info]
+        endpoints[1::2] = [way['coordinates'][-1] for way in ways_info]
+        endpoint_index = GridIndex(endpoints[:, 1], endpoints[:, 0], cell_size=MERGE_JOIN_DISTANCE, metric=self.metric)
+        
+        # 并查集
+        roots = list(range(way_count))
+        
+        def find(index):
+            while roots[index] != index:
+                roots[index] = roots[roots[index]]
+                index = roots[index]
+            return index
+        
+        for point_index, (lon, lat) in enumerate(endpoints.tolist()):
+            near, _ = endpoint_index.query_radius(lat, lon, MERGE_JOIN_DISTANCE)
+            root = find(point_index // 2)
+            for other in np.unique(near // 2).tolist():
+                other_root = find(other)
+                if other_root != root:
+                    roots[other_root] = root
+        
+        groups = {}
+        for index, way in enumerate(ways_info):
+            groups.setdefault(find(index), []).append(way)
+        return list(groups.values())
+
+    def merge_way_component(self, ways_info):
+        """将一组相连的way合并为若干条路径：先合并出最长可连成的一条，剩余的way（支线等）依次再合并"""
+        polylines = []
+        remaining = ways_info
+        while remaining:
+            leftover = []
+            polylines.append(self.merge_ways(remaining, leftover))
+            remaining = leftover
+        return polylines
+
+    def merge_way_components(self, ways_info, process_workers=None):
+        """合并所有way，返回各连通部分的路径列表，最长的部分在前
+        
+        能按成员顺序合并时（见 merge_ways_ordered）只有一个部分；否则按端点连通关系分组，
+        各组互不影响，process_workers 大于 1 且有多个组时在进程池中并行合并。
+        未能连接到主线的支线、断开的区段都作为单独的部分保留，而不是丢弃。
+        
+        Args:
+            process_workers: 合并各组的进程数，默认在当前进程中依次合并
+        """
+        if not ways_info:
+            return []
+        
+        if MERGE_MODE == 'ordered':
+            merged_coords = self.merge_ways_ordered(ways_info)
+            if merged_coords is not None:
+                return [merged_coords]
+        
+        groups = self.group_connected_ways(ways_info)
+        components = []
+        if process_workers and process_workers > 1 and len(groups) > 1:
+            with ProcessPoolExecutor(max_workers=process_workers) as process_pool:
+                for polylines, stats in process_pool.map(merge_way_component, groups,
+                                                         [self.quiet] * len(groups), [self.metric] * len(groups)):
+                    components.extend(polylines)
+                    self.stats.merge(stats)
+        else:
+            for group in groups:
+                components.extend(self.merge_way_component(group))
+        
+        components = [polyline for polyline in components if polyline]
+        components.sort(key=lambda polyline: -self.path_length(polyline))
+        if len(components) > 1:
+            logger.info("线路包含 %d 个互不相连的部分", len(components))
+        return components
+
+    def path_length(self, coords):
+        """路径的总长度（米）"""
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        if len(coords) < 2:
+            return 0.0
+        return float(np.sum(self.calculate_distances(coords[:-1, 1], coords[:-1, 0], coords[1:, 1], coords[1:, 0])))
+
+    def merge_ways_scan(self, ways_info):
+        """合并所有way为一条连续路径（逐轮扫描全部way的旧版实现，保留用于基准对比）"""
+        if not ways_info:
+            return []
+        
+        logger.info("开始合并 %d 个way...", len(ways_info))
+        
+        # 创建way坐标副本
+        remaining_ways = []
+        for way in ways_info:
+            remaining_ways.append({
+                'id': way['id'],
+                'coordinates': way['coordinates'].copy(),
+                'used': False
+            })
+        
+        # 所有way的端点坐标 (lon, lat)
+        way_starts = np.array([way['coordinates'][0] for way in remaining_ways], dtype=np.float64)
+        way_ends = np.array([way['coordinates'][-1] for way in remaining_ways], dtype=np.float64)
+        used = np.zeros(len(remaining_ways), dtype=bool)
+        connection_types = ['end_to_start', 'end_to_end', 'start_to_start', 'start_to_end']
+        
         # 选择第一个way作为起点
         merged_coords = remaining_ways[0]['coordinates'].copy()
         remaining_ways[0]['used'] = True
-        print(f"起始way {remaining_ways[0]['id']} 包含 {len(merged_coords)} 个点")
+        used[0] = True
+        logger.info("起始way %s 包含 %d 个点", remaining_ways[0]['id'], len(merged_coords))
         
         # 逐个连接其他way
         while True:
-            found_connection = False
+            # 检查与当前合并路径的连接
+            current_start = merged_coords[0]
+            current_end = merged_coords[-1]
             
-            for way in remaining_ways:
-                if way['used']:
-                    continue
-                
-                # 检查与当前合并路径的连接
-                current_start = merged_coords[0]
-                current_end = merged_coords[-1]
-                way_start = way['coordinates'][0]
-                way_end = way['coordinates'][-1]
-                
-                # 计算各种连接可能性
-                connections = [
-                    ('end_to_start', self.calculate_distance(current_end[1], current_end[0], way_start[1], way_start[0])),
-                    ('end_to_end', self.calculate_distance(current_end[1], current_end[0], way_end[1], way_end[0])),
-                    ('start_to_start', self.calculate_distance(current_start[1], current_start[0], way_start[1], way_start[0])),
-                    ('start_to_end', self.calculate_distance(current_start[1], current_start[0], way_end[1], way_end[0]))
-                ]
-                
-                # 找到最近的连接
-                best_connection = min(connections, key=lambda x: x[1])
-                
-                if best_connection[1] < 100:  # 100米内认为是连接的
-                    connection_type = best_connection[0]
-                    
-                    if connection_type == 'end_to_start':
-                        # 在末尾添加way（去掉重复点）
-                        merged_coords.extend(way['coordinates'][1:])
-                    elif connection_type == 'end_to_end':
-                        # 在末尾添加反向way（去掉重复点）
-                        merged_coords.extend(way['coordinates'][-2::-1])
-                    elif connection_type == 'start_to_start':
-                        # 在开头添加反向way（去掉重复点）
-                        merged_coords = way['coordinates'][-1:0:-1] + merged_coords
-                    elif connection_type == 'start_to_end':
-                        # 在开头添加way（去掉重复点）
-                        merged_coords = way['coordinates'][:-1] + merged_coords
-                    
-                    way['used'] = True
-                    found_connection = True
-                    print(f"连接way {way['id']} ({connection_type}), 距离: {best_connection[1]:.1f}m")
-                    break
+            # 批量计算各种连接可能性，行顺序与 connection_types 一致
+            distances = np.vstack([
+                self.calculate_distances(current_end[1], current_end[0], way_starts[:, 1], way_starts[:, 0]),
+                self.calculate_distances(current_end[1], current_end[0], way_ends[:, 1], way_ends[:, 0]),
+                self.calculate_distances(current_start[1], current_start[0], way_starts[:, 1], way_starts[:, 0]),
+                self.calculate_distances(current_start[1], current_start[0], way_ends[:, 1], way_ends[:, 0])
+            ])
+            
+            # 找到每个way最近的连接
+            best_types = np.argmin(distances, axis=0)
+            best_distances = distances[best_types, np.arange(len(remaining_ways))]
             
-            if not found_connection:
+            # 按原有顺序取第一个连接距离内的way
+            candidates = np.flatnonzero(~used & (best_distances < MERGE_JOIN_DISTANCE))
+            if len(candidates) == 0:
                 break
+            
+            index = candidates[0]
+            way = remaining_ways[index]
+            connection_type = connection_types[best_types[index]]
+            
+            if connection_type == 'end_to_start':
+                # 在末尾添加way（去掉重复点）
+                merged_coords.extend(way['coordinates'][1:])
+            elif connection_type == 'end_to_end':
+                # 在末尾添加反向way（去掉重复点）
+                merged_coords.extend(way['coordinates'][-2::-1])
+            elif connection_type == 'start_to_start':
+                # 在开头添加反向way（去掉重复点）
+                merged_coords = way['coordinates'][-1:0:-1] + merged_coords
+            elif connection_type == 'start_to_end':
+                # 在开头添加way（去掉重复点）
+                merged_coords = way['coordinates'][:-1] + merged_coords
+            
+            way['used'] = True
+            used[index] = True
+            logger.debug("连接way %s (%s), 距离: %.1fm", way['id'], connection_type, best_distances[index])
         
         # 检查未使用的way
         unused_ways = [way for way in remaining_ways if not way['used']]
+        self.stats.count('ways_merged', len(remaining_ways) - len(unused_ways))
+        self.stats.count('ways_unconnected', len(unused_ways))
         if unused_ways:
-            print(f"警告: {len(unused_ways)} 个way未能连接:")
+            logger.warning("警告: %d 个way未能连接:", len(unused_ways))
             for way in unused_ways:
-                print(f"  - way {way['id']}")
+                logger.debug("  - way %s", way['id'])
         
-        print(f"合并完成，总共 {len(merged_coords)} 个坐标点")
+        logger.info("合并完成，总共 %d 个坐标点", len(merged_coords))
         return merged_coords
 
     def insert_stations_into_path(self, merged_coords, stations):
-        """将车站信息插入到合并后的路径中"""
+        """将车站信息插入到合并后的路径中
+        
+        先用网格索引为每个车站找到最近的路径点，记录需要更新或插入的位置，
+        最后一次性生成带车站的路径点列表。
+        """
         if not merged_coords or not stations:
             return []
         
-        print(f"开始将 {len(stations)} 个车站插入路径...")
+        logger.info("开始将 %d 个车站插入路径...", len(stations))
         
         # 创建路径点列表
         path_points = []
@@ -141,32 +679,35 @@ class MetroLinePlotter:
                 'lat': coord[1],
                 'lon': coord[0],
                 'is_station': False,
-                'station_name': None
+                'station_name': None,
+                'inserted': False
             })
         
+        path_lats = np.array([coord[1] for coord in merged_coords], dtype=np.float64)
+        path_lons = np.array([coord[0] for coord in merged_coords], dtype=np.float64)
+        path_index = GridIndex(path_lats, path_lons, cell_size=100, metric=self.metric)
+        
+        # 插入位置 -> 待插入的车站点列表，位置以原路径点索引表示
+        insertions = {}
+        
         # 为每个车站找到最近的路径点
         for station in stations:
-            min_distance = float('inf')
-            best_index = 0
+            best_index, min_distance = path_index.nearest(station['lat'], station['lon'], STATION_SNAP_DISTANCE)
             
-            # 找到距离车站最近的路径点
-            for i, point in enumerate(path_points):
-                distance = self.calculate_distance(
-                    station['lat'], station['lon'],
-                    point['lat'], point['lon']
-                )
-                if distance < min_distance:
-                    min_distance = distance
-                    best_index = i
+            if best_index == -1:  # 500米内没有路径点，不是有效的车站位置
+                self.stats.count('stations_skipped')
+                logger.debug("车站 %s 的 %gm 内没有路径点，跳过", station['name'], STATION_SNAP_DISTANCE)
+                continue
             
-            print(f"车站 {station['name']} 最近点距离: {min_distance:.1f}m")
+            logger.debug("车站 %s 最近点距离: %.1fm", station['name'], min_distance)
             
-            if min_distance < 500:  # 500米内认为是有效的车站位置
+            if min_distance < STATION_SNAP_DISTANCE:
                 # 检查是否应该插入新点还是更新现有点
-                if min_distance < 50:  # 50米内直接更新现有点
+                if min_distance < STATION_MERGE_DISTANCE:  # 50米内直接更新现有点
                     path_points[best_index]['is_station'] = True
                     path_points[best_index]['station_name'] = station['name']
-                    print(f"  -> 更新现有点为车站")
+                    self.stats.count('stations_snapped')
+                    logger.debug("  -> 更新现有点为车站")
                 else:
                     # 插入新的车站点
                     # 判断插入位置（前面还是后面）
@@ -194,19 +735,93 @@ class MetroLinePlotter:
                         'lat': station['lat'],
                         'lon': station['lon'],
                         'is_station': True,
-                        'station_name': station['name']
+                        'station_name': station['name'],
+                        'inserted': True
                     }
-                    path_points.insert(insert_index, station_point)
-                    print(f"  -> 在索引 {insert_index} 插入新车站点")
+                    insertions.setdefault(insert_index, []).append(station_point)
+                    self.stats.count('stations_inserted')
+                    logger.debug("  -> 在索引 %d 插入新车站点", insert_index)
             else:
-                print(f"  -> 车站距离过远，跳过")
+                self.stats.count('stations_skipped')
+                logger.debug("  -> 车站距离过远，跳过")
+        
+        # 一次性合并插入的车站点
+        if insertions:
+            merged_points = []
+            for i in range(len(path_points) + 1):
+                if i in insertions:
+                    new_points = insertions[i]
+                    # 同一位置插入多个车站时，按与前一个路径点的距离排序
+                    if len(new_points) > 1 and i > 0:
+                        prev_point = path_points[i - 1]
+                        new_points.sort(key=lambda p: self.calculate_distance(
+                            prev_point['lat'], prev_point['lon'], p['lat'], p['lon']))
+                    merged_points.extend(new_points)
+                if i < len(path_points):
+                    merged_points.append(path_points[i])
+            path_points = merged_points
+        
+        logger.info("路径处理完成，总共 %d 个点", len(path_points))
+        return path_points
+
+    def insert_stations_into_parts(self, components, stations):
+        """将车站插入由多个部分组成的路径（见 merge_way_components）
         
-        print(f"路径处理完成，总共 {len(path_points)} 个点")
+        每个车站归入离它最近的部分，各部分分别调用 insert_stations_into_path；
+        没有车站的部分保留原有轨道点。除第一部分外，各部分的第一个路径点标记 part_start。
+        """
+        if len(components) <= 1:
+            return self.insert_stations_into_path(components[0] if components else [], stations)
+        if not stations:
+            return []
+        
+        part_labels = np.concatenate([np.full(len(polyline), part) for part, polyline in enumerate(components)])
+        points = np.array([coord for polyline in components for coord in polyline], dtype=np.float64)
+        point_index = GridIndex(points[:, 1], points[:, 0], cell_size=100, metric=self.metric)
+        part_stations = [[] for _ in components]
+        for station in stations:
+            nearest_index, _ = point_index.nearest(station['lat'], station['lon'], STATION_SNAP_DISTANCE)
+            # 有效范围内没有路径点的车站交给第一部分，在其中计为跳过
+            part_stations[part_labels[nearest_index] if nearest_index != -1 else 0].append(station)
+        
+        path_points = []
+        for polyline, part_station_list in zip(components, part_stations):
+            if part_station_list:
+                part_points = self.insert_stations_into_path(polyline, part_station_list)
+            else:
+                part_points = [{
+                    'lat': coord[1],
+                    'lon': coord[0],
+                    'is_station': False,
+                    'station_name': None,
+                    'inserted': False
+                } for coord in polyline]
+            if path_points:
+                part_points[0]['part_start'] = True
+            path_points.extend(part_points)
         return path_points
 
+    def simplify_path(self, path_points, tolerance):
+        """用 Douglas-Peucker 算法简化路径，车站点与各部分的首尾点始终保留
+        
+        Args:
+            tolerance: 容差（米），0 表示不简化
+        """
+        if tolerance <= 0 or len(path_points) <= 2:
+            return path_points
+        
+        coords = np.array([[p['lon'], p['lat']] for p in path_points], dtype=np.float64)
+        keep_indices = [i for i, p in enumerate(path_points)
+                        if p['is_station'] or (i > 0 and p.get('part_start'))]
+        keep_indices += [i - 1 for i, p in enumerate(path_points) if i > 0 and p.get('part_start')]
+        kept = simplify_indices(coords, tolerance, keep_indices)
+        
+        logger.info("简化路径: %d -> %d 个点 (容差 %s 米)", len(path_points), len(kept), tolerance)
+        return [path_points[i] for i in kept.tolist()]
+
     def extract_line_info(self, data):
         """提取线路基本信息（名称、颜色等）"""
-        relation_info = {'name': '未知线路', 'colour': '#000000'}
+        relation_info = {'name': '未知线路', 'colour': '#000000', 'version': None, 'timestamp': None}
         
         for element in data.get('elements', []):
             if element['type'] == 'relation' and 'tags' in element:
@@ -217,278 +832,935 @@ class MetroLinePlotter:
                                                        tags.get('name:en', '未知线路')))
                 # 提取线路颜色
                 relation_info['colour'] = tags.get('colour', '#000000')
-                print(f"线路信息: {relation_info['name']}, 颜色: {relation_info['colour']}")
+                # 记录关系版本，用于判断是否需要更新
+                relation_info['version'] = element.get('version')
+                relation_info['timestamp'] = element.get('timestamp')
+                logger.info("线路信息: %s, 颜色: %s", relation_info['name'], relation_info['colour'])
                 break
         
         return relation_info
 
     def extract_line_geometry(self, data):
-        """从JSON数据中提取几何信息"""
-        stations = []
-        ways_info = []
-        
+        """从JSON数据中提取几何信息，返回 (车站列表, 按关系成员顺序排列的way列表)，见 extract_lines_data"""
         elements = data.get('elements', [])
-        print(f"调试信息: 元素数量: {len(elements)}")
+        relation_id = next((element['id'] for element in elements if element['type'] == 'relation'), 0)
+        line_data = self.extract_lines_data(elements, [relation_id])[relation_id]
+        if line_data is None:
+            return [], []
+        return line_data['stations'], line_data['ways_info']
+
+    def order_track_ways(self, ways_info, members):
+        """按关系成员顺序排列way，去掉车站角色（STATION_ROLES）的way
+        
+        同一way在成员中出现多次时只取第一次；不在成员列表中的way保持原顺序排在最后。
+        """
+        positions = {}
+        station_ways = set()
+        for member in members:
+            if member['type'] != 'way':
+                continue
+            if member.get('role', '') in STATION_ROLES:
+                station_ways.add(member['ref'])
+            elif member['ref'] not in positions:
+                positions[member['ref']] = len(positions)
+        
+        track_ways = [way for way in ways_info if way['id'] not in station_ways or way['id'] in positions]
+        return sorted(track_ways, key=lambda way: positions.get(way['id'], len(positions)))
+
+    def extract_lines_data(self, elements, relation_ids):
+        """单次遍历 Overpass 元素，提取各线路的基本信息、车站、way坐标与输入数据哈希
+        
+        elements 可以是列表，也可以是流式解析得到的迭代器，每个元素只处理一次、不保留。
+        只查询一个关系时所有元素都属于该关系；查询多个关系时按关系成员及成员way的节点
+        归属，共用的车站和way分别计入每个引用它们的关系。
+        
+        Returns:
+            {relation_id: line_data} 字典，line_data 为
+            {'relation_info', 'stations', 'ways_info', 'input_hash'}，
+            前三项格式与 extract_line_info、extract_line_geometry 的结果一致，
+            input_hash 由各元素的 element_digest 经 combine_digests 得到，与元素顺序无关；
+            响应中缺少的关系对应 None
+        """
+        single = len(relation_ids) == 1
+        wanted_ids = set(relation_ids)
+        relation_infos = {}
+        members = {}
+        member_lists = {}
+        stations = []
+        ways = []
+        way_nodes = {}
+        digests = {}
         
-        # 提取车站节点
         for element in elements:
-            if element['type'] == 'node' and 'tags' in element:
+            element_type = element['type']
+            key = (element_type, element['id'])
+            digests[key] = self.element_digest(element)
+            
+            if element_type == 'relation':
+                relation_id = element['id']
+                if (single and relation_infos) or (not single and relation_id not in wanted_ids):
+                    continue
+                if single:
+                    relation_id = relation_ids[0]
+                members[relation_id] = {(member['type'], member['ref']) for member in element.get('members', [])}
+                member_lists[relation_id] = element.get('members', [])
+                relation_infos[relation_id] = self.extract_line_info({'elements': [element]})
+            
+            elif element_type == 'node' and 'tags' in element:
                 tags = element['tags']
-                if (tags.get('railway') == 'stop' or 
-                    tags.get('railway') == 'station'):
-                    
-                    station_name = tags.get('name', 
-                                          tags.get('name:zh', 
-                                                  tags.get('name:en', f'站点{element["id"]}')))
+                if tags.get('railway') == 'stop' or tags.get('railway') == 'station':
+                    station_name = tags.get('name',
+                                            tags.get('name:zh',
+                                                     tags.get('name:en', f'站点{element["id"]}')))
                     stations.append({
                         'name': station_name,
                         'lat': float(element['lat']),
                         'lon': float(element['lon']),
                         'id': element['id']
                     })
-                    print(f"找到车站: {station_name}")
-        
-        # 提取每个way的坐标信息
-        for element in elements:
-            if element['type'] == 'way' and 'geometry' in element:
-                way_coords = []
-                for point in element['geometry']:
-                    coord = [float(point['lon']), float(point['lat'])]
-                    way_coords.append(coord)
-                
-                # 保存way信息
-                way_info = {
+            
+            elif element_type == 'way' and 'geometry' in element:
+                ways.append({
                     'id': element['id'],
-                    'coordinates': way_coords.copy()
-                }
-                ways_info.append(way_info)
-                print(f"从way {element['id']} 添加了 {len(way_coords)} 个坐标点")
+                    'coordinates': [[float(point['lon']), float(point['lat'])] for point in element['geometry']]
+                })
+                if not single:
+                    way_nodes[element['id']] = element.get('nodes', [])
+        
+        # 只查询一个关系时，即使响应中没有关系元素也照常使用其中的几何
+        if single and not relation_infos and ways:
+            relation_infos[relation_ids[0]] = self.extract_line_info({'elements': []})
+        
+        lines_data = {}
+        for relation_id in relation_ids:
+            if relation_id not in relation_infos:
+                logger.warning("响应中缺少关系 %s", relation_id)
+                lines_data[relation_id] = None
+                continue
+            
+            if single:
+                owned = digests
+                line_stations, line_ways = stations, ways
+            else:
+                # 关系自身、成员以及成员way上的节点属于该关系
+                owned_keys = set(members[relation_id]) | {('relation', relation_id)}
+                for element_type, ref in members[relation_id]:
+                    if element_type == 'way':
+                        owned_keys.update(('node', node_id) for node_id in way_nodes.get(ref, []))
+                owned = {key: digest for key, digest in digests.items() if key in owned_keys}
+                line_stations = [station for station in stations if ('node', station['id']) in owned_keys]
+                line_ways = [way for way in ways if ('way', way['id']) in owned_keys]
+            if relation_id in member_lists:
+                line_ways = self.order_track_ways(line_ways, member_lists[relation_id])
+            
+            logger.info("关系 %s: 提取到 %d 个车站, %d 个ways", relation_id, len(line_stations), len(line_ways))
+            lines_data[relation_id] = {
+                'relation_info': relation_infos[relation_id],
+                'stations': line_stations,
+                'ways_info': line_ways,
+                'input_hash': self.combine_digests(owned)
+            }
+        return lines_data
+
+    def share_trunk_ways(self, lines_data):
+        """多条线路（如同一线路的不同支线）共用的轨道way只合并一次
+        
+        按way所属的线路集合分组，每组共用的way先合并为路径，再以一个合成way（负数ID）
+        替换各线路中的这些way，放在其中第一个way的位置。之后各线路只需把共用路径与
+        各自的支线连接起来。就地修改 lines_data 中的 ways_info。
         
-        print(f"最终提取到 {len(stations)} 个车站, {len(ways_info)} 个ways")
-        return stations, ways_info
+        合并结果与同一批中有哪些线路有关，与之共用轨道的其他线路ID记录在 line_data['shared_trunk'] 中，
+        计入线路文件的指纹（见 build_line_file）。
+        
+        Args:
+            lines_data: {relation_id: line_data}，见 extract_lines_data
+        """
+        owners = {}
+        ways_by_id = {}
+        for relation_id, line_data in lines_data.items():
+            if not line_data:
+                continue
+            for way in line_data['ways_info']:
+                owners.setdefault(way['id'], []).append(relation_id)
+                ways_by_id[way['id']] = way
+        
+        groups = {}
+        for way_id, relation_ids in owners.items():
+            if len(relation_ids) > 1:
+                groups.setdefault(tuple(relation_ids), []).append(way_id)
+        if not groups:
+            return lines_data
+        
+        trunk_ways = {}
+        next_id = -1
+        for relation_ids, way_ids in groups.items():
+            logger.info("线路 %s 共用 %d 个way，合并一次", ', '.join(map(str, relation_ids)), len(way_ids))
+            with self.stats.stage('merge'):
+                components = self.merge_way_components([ways_by_id[way_id] for way_id in way_ids])
+            trunk = []
+            for polyline in components:
+                trunk.append({'id': next_id, 'coordinates': polyline})
+                next_id -= 1
+            for way_id in way_ids:
+                trunk_ways[way_id] = trunk
+            self.stats.count('trunk_ways_shared', len(way_ids) * (len(relation_ids) - 1))
+        
+        for relation_id, line_data in lines_data.items():
+            if not line_data:
+                continue
+            shared_with = {other for group in groups if relation_id in group for other in group}
+            shared_with.discard(relation_id)
+            if shared_with:
+                line_data['shared_trunk'] = sorted(shared_with)
+            ways_info = []
+            added = set()
+            for way in line_data['ways_info']:
+                trunk = trunk_ways.get(way['id'])
+                if trunk is None:
+                    ways_info.append(way)
+                elif trunk[0]['id'] not in added:
+                    added.add(trunk[0]['id'])
+                    ways_info.extend(trunk)
+            line_data['ways_info'] = ways_info
+        return lines_data
 
-    def save_to_json(self, path_points, relation_id, relation_info, filename=None):
-        """保存路径数据到JSON文件"""
+    def save_to_json(self, path_points, relation_id, relation_info, filename=None, fingerprint=None):
+        """保存路径数据到JSON文件，config.COORD_STORAGE 不是 float64 时坐标保留7位小数（约1厘米）"""
         if filename is None:
             filename = f"metro_line_{relation_id}.json"
         
+        if COORD_STORAGE != 'float64':
+            path_points = [dict(point, lat=round(point['lat'], 7), lon=round(point['lon'], 7))
+                           for point in path_points]
+        
         output_data = {
             'relation_id': relation_id,
             'name': relation_info['name'],
             'colour': relation_info['colour'],
+            'osm_version': relation_info.get('version'),
+            'osm_timestamp': relation_info.get('timestamp'),
             'total_points': len(path_points),
             'station_count': len([p for p in path_points if p['is_station']]),
+            'fingerprint': fingerprint,
             'path_points': path_points
         }
         
         try:
+            self.line_store.invalidate(filename)
             with open(filename, 'w', encoding='utf-8') as f:
                 json.dump(output_data, f, ensure_ascii=False, indent=2)
-            print(f"数据已保存到 {filename}")
-            print(f"线路: {output_data['name']}")
-            print(f"颜色: {output_data['colour']}")
-            print(f"总点数: {output_data['total_points']}")
-            print(f"车站数: {output_data['station_count']}")
+            logger.info("数据已保存到 %s", filename)
+            logger.info("线路: %s", output_data['name'])
+            logger.info("颜色: %s", output_data['colour'])
+            logger.info("总点数: %s", output_data['total_points'])
+            logger.info("车站数: %s", output_data['station_count'])
             return filename
         except Exception as e:
-            print(f"保存文件失败: {e}")
+            logger.warning("保存文件失败: %s", e)
             return None
 
-    def process_metro_line(self, relation_id, force_update=False):
-        """处理地铁线路数据并生成JSON
+    def save_to_npz(self, path_points, relation_id, relation_info, filename=None, fingerprint=None):
+        """保存路径数据到列式npz文件（坐标数组 + 车站索引表）"""
+        if filename is None:
+            filename = f"metro_line_{relation_id}.npz"
         
-        Args:
-            relation_id: OSM关系ID
-            force_update: 是否强制更新，默认False
+        record = path_points_to_record(path_points, relation_id, relation_info, fingerprint)
+        
+        try:
+            # 先释放旧文件的内存映射：Windows 上仍被映射的文件无法替换
+            self.line_store.invalidate(filename)
+            save_record_npz(record, filename, COORD_STORAGE)
+            logger.info("数据已保存到 %s", filename)
+            logger.info("线路: %s", record['name'])
+            logger.info("颜色: %s", record['colour'])
+            logger.info("总点数: %d", len(record['coords']))
+            logger.info("车站数: %d", len(record['station_indices']))
+            return filename
+        except Exception as e:
+            logger.warning("保存文件失败: %s", e)
+            return None
+
+    def load_line(self, filename):
+        """读取线路文件（npz 或 JSON），返回列式线路记录，失败时返回 None
+        
+        每个文件只在首次使用或内容变化后读取，返回的记录为共享数据，不应修改。
+        """
+        try:
+            return self.line_store.get(filename)
+        except Exception as e:
+            logger.warning("读取线路文件失败: %s", e)
+            return None
+
+    def stage_fingerprints(self):
+        """当前各处理步骤的算法版本与参数，任一项变化时对应步骤及其后续步骤需要重新处理"""
+        return {
+            'merge': {
+                'version': ALGORITHM_VERSIONS['merge'],
+                'join_distance': MERGE_JOIN_DISTANCE,
+                'mode': MERGE_MODE,
+                'coordinate_mode': COORDINATE_MODE
+            },
+            'snap': {
+                'version': ALGORITHM_VERSIONS['snap'],
+                'snap_distance': STATION_SNAP_DISTANCE,
+                'merge_distance': STATION_MERGE_DISTANCE,
+                'coordinate_mode': COORDINATE_MODE
+            },
+            'simplify': {
+                'version': ALGORITHM_VERSIONS['simplify'],
+                'tolerance': SIMPLIFY_TOLERANCE,
+                'lod_tolerances': list(LOD_TOLERANCES)
+            }
+        }
+
+    def element_digest(self, element):
+        """计算单个 Overpass 元素的哈希
+        
+        节点与way数量多，只把影响处理结果的字段（ID、坐标、节点列表、几何）按二进制打包后计算，
+        标签按排序后的键值对计入，不做完整的 JSON 序列化；数量很少的关系仍按排序键后的完整 JSON 计算。
         """
+        element_type = element['type']
+        if element_type == 'node':
+            digest = hashlib.sha256(struct.pack('<qdd', element['id'], element.get('lat', 0.0), element.get('lon', 0.0)))
+        elif element_type == 'way':
+            digest = hashlib.sha256(struct.pack('<q', element['id']))
+            digest.update(array('q', element.get('nodes', ())).tobytes())
+            digest.update(array('d', [value for point in element.get('geometry', ())
+                                      for value in (point['lat'], point['lon'])]).tobytes())
+        else:
+            return hashlib.sha256(json.dumps(element, sort_keys=True, ensure_ascii=False,
+                                             separators=(',', ':')).encode('utf-8')).digest()
+        tags = element.get('tags')
+        if tags:
+            digest.update(repr(sorted(tags.items())).encode('utf-8'))
+        return digest.digest()
+
+    def combine_digests(self, digests):
+        """由 {(类型, id): 元素哈希} 计算整体哈希，与元素顺序无关"""
+        combined = hashlib.sha256()
+        for key in sorted(digests):
+            combined.update(digests[key])
+        return combined.hexdigest()
+
+    def find_stale_stages(self, record):
+        """返回线路记录中参数已过时的处理步骤列表
+        
+        没有记录指纹的旧文件无法判断，视为有效。
+        """
+        fingerprint = record.get('fingerprint')
+        if not fingerprint:
+            return []
+        
+        stale_stages = []
+        for stage, params in self.stage_fingerprints().items():
+            # 前一步骤过时后，后续步骤也需要重新处理
+            if stale_stages or fingerprint.get('stages', {}).get(stage) != params:
+                stale_stages.append(stage)
+        return stale_stages
+
+    def check_existing_file(self, relation_id):
+        """检查关系对应的线路文件是否已存在、有效且处理参数未变化，满足时返回文件名，否则返回 None"""
         # 生成文件名
-        filename = f"metro_line_{relation_id}.json"
-        # 如果文件已存在且不强制更新，直接返回现有文件
-        if os.path.exists(filename) and not force_update:
-            print(f"文件 {filename} 已存在，直接使用现有文件")
+        filename = f"metro_line_{relation_id}.{OUTPUT_FORMAT}"
+        # 如果文件已存在，验证后直接返回现有文件
+        if os.path.exists(filename):
             # 验证文件是否有效
+            record = self.load_line(filename)
+            if record is not None and len(record['coords']):
+                stale_stages = self.find_stale_stages(record)
+                if stale_stages:
+                    logger.info("文件 %s 的处理参数已变化 (%s)，将重新处理", filename, ', '.join(stale_stages))
+                    self.line_store.invalidate(filename)
+                    return None
+                logger.info("文件 %s 已存在，直接使用现有文件", filename)
+                logger.info("验证通过: %s", record['name'])
+                logger.info("总点数: %d", len(record['coords']))
+                logger.info("车站数: %d", len(record['station_indices']))
+                return filename
+            else:
+                logger.warning("文件 %s 格式无效，将重新生成", filename)
+            # 文件将被转换或重新生成，不再保留对它的内存映射
+            self.line_store.invalidate(filename)
+        
+        # 已有旧版JSON缓存时直接转换，无需重新请求
+        legacy_filename = f"metro_line_{relation_id}.json"
+        if OUTPUT_FORMAT == 'npz' and os.path.exists(legacy_filename):
             try:
-                with open(filename, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                if data.get('path_points'):
-                    print(f"验证通过: {data.get('name', '未知线路')}")
-                    print(f"总点数: {data.get('total_points', 0)}")
-                    print(f"车站数: {data.get('station_count', 0)}")
-                    return filename
-                else:
-                    print(f"文件 {filename} 格式无效，将重新生成")
+                converted = migrate_json_file(legacy_filename, filename)
+                if converted:
+                    return converted
             except Exception as e:
-                print(f"文件 {filename} 读取失败: {e}，将重新生成")
-
-            # 如果文件不存在或无效，重新获取数据
-        print(f"正在处理关系 {relation_id} 的数据...")
-        data = self.get_metro_line_data(relation_id)
+                logger.warning("文件 %s 转换失败: %s，将重新生成", legacy_filename, e)
         
-        if not data:
-            print("无法获取数据")
-            return None
+        return None
+
+    def build_line_file(self, relation_id, line_data):
+        """由提取得到的线路数据（见 extract_lines_data）生成线路文件（合并、插入车站、保存），返回文件名
         
-        # 提取线路基本信息
-        relation_info = self.extract_line_info(data)
+        已有线路文件的输入数据哈希与合并参数都未变化、且其轨道未经简化时，
+        直接复用其中的合并路径，只重新插入车站。
         
-        # 提取几何信息
-        stations, ways_info = self.extract_line_geometry(data)
+        config.COORDINATE_MODE 为 'projected' 时，way与车站坐标先一次投影到以线路中心为原点的
+        平面坐标（LocalProjection），合并与插入车站使用欧氏距离，完成后再转换回经纬度保存。
+        """
+        filename = f"metro_line_{relation_id}.{OUTPUT_FORMAT}"
+        stages = self.stage_fingerprints()
+        fingerprint = {
+            'input_hash': line_data['input_hash'],
+            'stages': stages
+        }
+        # 与其他线路共用的轨道已预先合并，合并结果与共用的线路有关
+        if line_data.get('shared_trunk'):
+            fingerprint['shared_trunk'] = line_data['shared_trunk']
+        relation_info = line_data['relation_info']
+        stations = line_data['stations']
+        ways_info = line_data['ways_info']
         
         if not ways_info:
-            print("未找到线路坐标数据")
+            logger.warning("未找到线路坐标数据")
             return None
         
-        # 步骤1: 合并所有way为一条连续路径
-        merged_coords = self.merge_ways(ways_info)
+        # 步骤1: 合并所有way为路径，互不相连的部分分别保留（输入与参数未变化时复用）
+        components = None
+        # 不经过 LineStore 且不使用内存映射读取：该文件随后会被替换
+        self.line_store.invalidate(filename)
+        previous = None
+        if os.path.exists(filename):
+            try:
+                previous = load_record(filename, mmap=False)
+            except Exception as e:
+                logger.warning("读取线路文件失败: %s", e)
+        previous_fingerprint = previous.get('fingerprint') if previous is not None else None
+        if (previous_fingerprint
+                and previous_fingerprint.get('input_hash') == fingerprint['input_hash']
+                and previous_fingerprint.get('shared_trunk') == fingerprint.get('shared_trunk')
+                and previous_fingerprint.get('stages', {}).get('merge') == stages['merge']
+                and not (previous_fingerprint['stages'].get('simplify') or {}).get('tolerance')):
+            components = [coords.tolist() for coords in track_parts(previous)]
+            self.stats.count('merges_reused')
+            logger.info("输入数据与合并参数未变化，复用 %s 中的合并路径", filename)
+        
+        # 投影模式: 后续步骤在平面坐标中进行，lon、lat 字段中存放 x、y（米）
+        projection = None
+        if COORDINATE_MODE == 'projected':
+            with self.stats.stage('project'):
+                projection = LocalProjection.around(np.concatenate([way['coordinates'] for way in ways_info]))
+                ways_info = [{'id': way['id'], 'coordinates': projection.forward(way['coordinates']).tolist()}
+                             for way in ways_info]
+                station_points = projection.forward([[station['lon'], station['lat']] for station in stations])
+                stations = [dict(station, lon=x, lat=y) for station, (x, y) in zip(stations, station_points.tolist())]
+                if components is not None:
+                    components = [projection.forward(polyline).tolist() for polyline in components]
+            self.metric = 'euclidean'
+        
+        try:
+            if components is None:
+                with self.stats.stage('merge'):
+                    components = self.merge_way_components(ways_info, COMPONENT_WORKERS)
+            
+            if not components:
+                logger.warning("无法合并way数据")
+                return None
+            self.stats.count('path_parts', len(components))
+            
+            # 步骤2: 将车站信息插入路径
+            with self.stats.stage('snap'):
+                path_points = self.insert_stations_into_parts(components, stations)
+        finally:
+            self.metric = 'haversine'
+        
+        if projection is not None and path_points:
+            with self.stats.stage('project'):
+                coords = projection.inverse([[point['lon'], point['lat']] for point in path_points])
+                for point, (lon, lat) in zip(path_points, coords.tolist()):
+                    point['lon'], point['lat'] = lon, lat
+        
+        # 步骤3: 简化轨道（保留车站点）
+        with self.stats.stage('simplify'):
+            path_points = self.simplify_path(path_points, SIMPLIFY_TOLERANCE)
+        
+        # 步骤4: 保存到文件
+        with self.stats.stage('save'):
+            if OUTPUT_FORMAT == 'npz':
+                filename = self.save_to_npz(path_points, relation_id, relation_info, filename, fingerprint)
+            else:
+                filename = self.save_to_json(path_points, relation_id, relation_info, filename, fingerprint)
+        
+        if filename:
+            self.stats.count('lines_processed')
+        return filename
+
+    def process_metro_line(self, relation_id, force_update=False, check_freshness=None):
+        """处理地铁线路数据并生成线路文件（格式由 config.OUTPUT_FORMAT 决定）
         
-        if not merged_coords:
-            print("无法合并way数据")
+        Args:
+            relation_id: OSM关系ID
+            force_update: 是否强制更新，默认False
+            check_freshness: 强制更新前是否先比较关系版本，仅在上游有变化时更新，
+                默认使用 config.FRESHNESS_CHECK
+        """
+        if check_freshness is None:
+            check_freshness = FRESHNESS_CHECK
+        
+        # 强制更新时，上游未变化的线路仍使用现有文件
+        if force_update and check_freshness and not self.find_changed_relations([relation_id]):
+            force_update = False
+        
+        # 如果文件已存在且不强制更新，直接返回现有文件
+        if not force_update:
+            filename = self.check_existing_file(relation_id)
+            if filename:
+                return filename
+        
+        # 如果文件不存在或无效，重新获取数据
+        logger.info("正在处理关系 %s 的数据...", relation_id)
+        line_data = self.fetch_lines_data([relation_id], refresh=force_update)[relation_id]
+        
+        if not line_data:
+            logger.warning("无法获取数据")
             return None
         
-        # 步骤2: 将车站信息插入路径
-        path_points = self.insert_stations_into_path(merged_coords, stations)
+        return self.build_line_file(relation_id, line_data)
+
+    def process_metro_lines(self, relation_ids, max_workers=4, process_workers=None, force_update=False,
+                            batch_query=False, check_freshness=None):
+        """并发处理多条地铁线路
         
-        # 步骤3: 保存到JSON文件
-        filename = self.save_to_json(path_points, relation_id, relation_info, filename)
+        网络请求（及流式解析）在线程池中并发执行（最多 max_workers 个同时进行的请求），
+        合并与插入车站等计算密集的步骤在进程池中执行。同一批查询中多条线路共用的轨道只合并一次（见 share_trunk_ways），
+        共用轨道的合并同样在进程池中进行，不阻塞后续批次的提交。
         
-        return filename
+        Args:
+            relation_ids: OSM关系ID列表
+            max_workers: 同时进行的 Overpass 请求数上限
+            process_workers: 处理进程数，默认为CPU核数
+            force_update: 是否强制更新，默认False
+            batch_query: 为 True 时每 config.OVERPASS_BATCH_SIZE 个关系合并为一次查询，
+                共用的车站和轨道只下载一次
+            check_freshness: 强制更新时是否只更新上游有变化的线路，默认使用 config.FRESHNESS_CHECK
+        
+        Returns:
+            与 relation_ids 顺序一致的文件名列表，处理失败的线路对应 None
+        """
+        if check_freshness is None:
+            check_freshness = FRESHNESS_CHECK
+        
+        # 强制更新时只刷新上游有变化的线路
+        changed_ids = set(relation_ids)
+        if force_update and check_freshness:
+            changed_ids = set(self.find_changed_relations(relation_ids))
+        
+        results = {}
+        pending_ids = []
+        for relation_id in relation_ids:
+            filename = None if force_update and relation_id in changed_ids else self.check_existing_file(relation_id)
+            if filename:
+                results[relation_id] = filename
+            else:
+                pending_ids.append(relation_id)
+                # 文件将由处理进程重写，先释放本进程对它的内存映射
+                self.line_store.invalidate(f"metro_line_{relation_id}.{OUTPUT_FORMAT}")
+        
+        if pending_ids:
+            chunk_size = OVERPASS_BATCH_SIZE if batch_query else 1
+            chunks = [pending_ids[i:i + chunk_size] for i in range(0, len(pending_ids), chunk_size)]
+            logger.info("开始并发获取 %d 条线路的数据，共 %d 次请求...", len(pending_ids), len(chunks))
+            with ThreadPoolExecutor(max_workers=max_workers) as fetch_pool, \
+                    ProcessPoolExecutor(max_workers=process_workers) as process_pool:
+                fetch_futures = {fetch_pool.submit(self.fetch_lines_data, chunk, force_update)
+                                 for chunk in chunks}
+                trunk_futures = {}
+                process_futures = {}
+                
+                def submit_lines(lines_data):
+                    for relation_id, line_data in lines_data.items():
+                        if not line_data:
+                            logger.warning("无法获取关系 %s 的数据", relation_id)
+                            results[relation_id] = None
+                            continue
+                        process_futures[process_pool.submit(build_line_file, relation_id, line_data,
+                                                            self.quiet)] = relation_id
+                
+                # 每获取到一批线路的数据就提交处理；一批中有多条线路时先在进程池中合并共用的轨道
+                pending_futures = set(fetch_futures)
+                while pending_futures:
+                    done, pending_futures = wait(pending_futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future in fetch_futures:
+                            lines_data = future.result()
+                            if sum(1 for line_data in lines_data.values() if line_data) > 1:
+                                trunk_future = process_pool.submit(share_trunk_ways, lines_data, self.quiet)
+                                trunk_futures[trunk_future] = lines_data
+                                pending_futures.add(trunk_future)
+                            else:
+                                submit_lines(lines_data)
+                        else:
+                            try:
+                                lines_data, stats = future.result()
+                                self.stats.merge(stats)
+                            except Exception as e:
+                                # 共用轨道合并失败时各线路分别完整合并
+                                logger.warning("合并共用轨道失败: %s", e)
+                                lines_data = trunk_futures[future]
+                            submit_lines(lines_data)
+                
+                for future in as_completed(process_futures):
+                    relation_id = process_futures[future]
+                    try:
+                        results[relation_id], stats = future.result()
+                        self.stats.merge(stats)
+                    except Exception as e:
+                        logger.warning("处理关系 %s 失败: %s", relation_id, e)
+                        results[relation_id] = None
+        
+        return [results.get(relation_id) for relation_id in relation_ids]
 
-    def plot_from_json(self, json_filename, fig=None, ax=None, alpha = 0.8, show_plot=True):
-        """从JSON文件读取数据并绘制地铁线路图"""
-        try:
-            with open(json_filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-        except Exception as e:
-            print(f"读取JSON文件失败: {e}")
-            return None, None
+    def process_extract(self, extract_filename, relation_ids=None, all_routes=False, process_workers=None,
+                        force_update=False):
+        """从本地 OSM 提取文件（.osm.pbf 或 .osm）处理线路，无需访问 Overpass
         
-        path_points = data.get('path_points', [])
-        line_name = data.get('name', '地铁线路')
-        line_color = data.get('colour', '#000000')
+        一次遍历文件取出所有需要的线路关系及其way和节点，之后与在线获取的数据一样
+        提取、合并、插入车站，各线路在进程池中并行处理，
+        多条线路共用的轨道只合并一次。
         
-        if not path_points:
-            print("JSON文件中没有路径数据")
-            return None, None
+        Args:
+            extract_filename: OSM 提取文件，.pbf 需要安装 osmium
+            relation_ids: 需要处理的关系ID，默认为 config.METRO_LINES 中的所有线路
+            all_routes: 为 True 时忽略 relation_ids，处理文件中所有 route 为
+                config.OSM_ROUTE_TYPES 之一的线路
+            process_workers: 处理进程数，默认为CPU核数
+            force_update: 是否强制重新生成已存在的线路文件
+        
+        Returns:
+            {relation_id: 文件名} 字典，处理失败或文件中缺少的线路对应 None
+        """
+        if all_routes:
+            relation_ids = None
+        elif relation_ids is None:
+            relation_ids = [line['relation_id'] for line in METRO_LINES]
+        
+        results = {}
+        if relation_ids is not None and not force_update:
+            for relation_id in relation_ids:
+                results[relation_id] = self.check_existing_file(relation_id)
+            relation_ids = [relation_id for relation_id in relation_ids if not results[relation_id]]
+            if not relation_ids:
+                return results
+        
+        with self.stats.stage('read_extract'):
+            relations_data = read_extract(extract_filename, relation_ids, OSM_ROUTE_TYPES)
+        
+        pending = {}
+        for relation_id in (relation_ids if relation_ids is not None else relations_data):
+            data = relations_data.get(relation_id)
+            if data is None:
+                logger.warning("提取文件中缺少关系 %s", relation_id)
+                results[relation_id] = None
+                continue
+            if relation_ids is None and not force_update:
+                filename = self.check_existing_file(relation_id)
+                if filename:
+                    results[relation_id] = filename
+                    continue
+            with self.stats.stage('parse'):
+                pending[relation_id] = self.extract_lines_data(data['elements'], [relation_id])[relation_id]
+            # 文件将由处理进程重写，先释放本进程对它的内存映射
+            self.line_store.invalidate(f"metro_line_{relation_id}.{OUTPUT_FORMAT}")
+        
+        if pending:
+            self.share_trunk_ways(pending)
+            logger.info("开始处理 %d 条线路...", len(pending))
+            with ProcessPoolExecutor(max_workers=process_workers) as process_pool:
+                futures = {process_pool.submit(build_line_file, relation_id, line_data, self.quiet): relation_id
+                           for relation_id, line_data in pending.items() if line_data}
+                for relation_id, line_data in pending.items():
+                    if not line_data:
+                        results[relation_id] = None
+                for future in as_completed(futures):
+                    relation_id = futures[future]
+                    try:
+                        results[relation_id], stats = future.result()
+                        self.stats.merge(stats)
+                    except Exception as e:
+                        logger.warning("处理关系 %s 失败: %s", relation_id, e)
+                        results[relation_id] = None
+        
+        return results
+
+    def create_figure(self, figsize=(16, 10)):
+        """创建绘图用的图形和坐标轴（白色背景、等比例、无坐标轴）"""
+        fig, ax = plt.subplots(1, 1, figsize=figsize)
+        ax.set_facecolor('white')
+        fig.patch.set_facecolor('white')
+        # 设置图形属性（仅在创建新图时设置）
+        ax.set_aspect('equal', adjustable='box')
+        # 移除网格、坐标轴标签和刻度
+        ax.grid(False)
+        ax.set_xticks([])
+        ax.set_yticks([])
+        ax.set_xlabel('')
+        ax.set_ylabel('')
+        # 移除坐标轴边框
+        ax.spines['top'].set_visible(False)
+        ax.spines['right'].set_visible(False)
+        ax.spines['bottom'].set_visible(False)
+        ax.spines['left'].set_visible(False)
+        return fig, ax
+
+    def update_axis_limits(self, ax, min_lon, max_lon, min_lat, max_lat):
+        """更新坐标轴范围以包含新绘制的线路，只在范围扩展的方向上留出边距"""
+        # 获取当前坐标轴范围
+        ax.autoscale_view()
+        current_xlim = ax.get_xlim()
+        current_ylim = ax.get_ylim()
+
+        # 计算新的范围
+        new_min_lon = min(min_lon, current_xlim[0])
+        new_max_lon = max(max_lon, current_xlim[1])
+        new_min_lat = min(min_lat, current_ylim[0])
+        new_max_lat = max(max_lat, current_ylim[1])
+
+        # 检查各个方向的扩展情况
+        lon_extended_left = new_min_lon < current_xlim[0]
+        lon_extended_right = new_max_lon > current_xlim[1]
+        lat_extended_bottom = new_min_lat < current_ylim[0]
+        lat_extended_top = new_max_lat > current_ylim[1]
+
+        # 计算基础边距
+        base_lon_margin = (new_max_lon - new_min_lon) * 0.05
+        base_lat_margin = (new_max_lat - new_min_lat) * 0.05
+
+        # 根据扩展情况决定各方向的边距
+        left_margin = base_lon_margin if lon_extended_left else 0
+        right_margin = base_lon_margin if lon_extended_right else 0
+        bottom_margin = base_lat_margin if lat_extended_bottom else 0
+        top_margin = base_lat_margin if lat_extended_top else 0
+
+        ax.set_xlim(new_min_lon - left_margin, new_max_lon + right_margin)
+        ax.set_ylim(new_min_lat - bottom_margin, new_max_lat + top_margin)
+
+    def lod_tolerance(self, fig, ax, min_lon, max_lon, min_lat, max_lat):
+        """估算绘制后视野内每像素对应的距离（米），乘以 LOD_PIXEL_TOLERANCE 作为可接受的简化容差"""
+        if ax.has_data():
+            xlim, ylim = ax.get_xlim(), ax.get_ylim()
+            min_lon, max_lon = min(min_lon, xlim[0]), max(max_lon, xlim[1])
+            min_lat, max_lat = min(min_lat, ylim[0]), max(max_lat, ylim[1])
+        
+        # 经纬度跨度换算为米，等比例显示时由跨度较大的方向决定比例尺
+        metres_per_degree = math.pi * EARTH_RADIUS / 180
+        width = (max_lon - min_lon) * metres_per_degree * math.cos(math.radians((min_lat + max_lat) / 2))
+        height = (max_lat - min_lat) * metres_per_degree
+        width_px, height_px = fig.get_figwidth() * fig.dpi, fig.get_figheight() * fig.dpi
+        return max(width / width_px, height / height_px) * LOD_PIXEL_TOLERANCE
+
+    def render_lines(self, records, fig=None, ax=None, alpha=0.8, use_lod=True, interactive=False):
+        """批量绘制多条线路（或区间）
         
-        # 设置中文字体支持
-        plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
-        plt.rcParams['axes.unicode_minus'] = False
+        所有线路合并为一个 LineCollection，所有车站合并为一次 scatter 调用，
+        坐标轴范围在最后统一计算一次。
+        
+        Args:
+            records: 线路记录列表（见 line_data.path_points_to_record），
+                每条记录至少包含 coords、station_indices 与 colour
+            use_lod: 为 True 时按视野范围选用记录中简化程度合适的路径（车站位置不变）
+            interactive: 为 True 时由 ViewportRenderer 绘制线路，缩放、平移后自动切换简化级别
+                并只绘制视野内的部分，适合在 plt.show() 的窗口中浏览整个线网
+        """
+        start = time.perf_counter()
         
         # 如果没有提供fig和ax，创建新的
         if fig is None or ax is None:
-            fig, ax = plt.subplots(1, 1, figsize=(16, 10))
-            ax.set_facecolor('white')
-            fig.patch.set_facecolor('white')
-            # 设置图形属性（仅在创建新图时设置）
-            ax.set_aspect('equal', adjustable='box')
-            # 移除网格、坐标轴标签和刻度
-            ax.grid(False)
-            ax.set_xticks([])
-            ax.set_yticks([])
-            ax.set_xlabel('')
-            ax.set_ylabel('')
-            # 移除坐标轴边框
-            ax.spines['top'].set_visible(False)
-            ax.spines['right'].set_visible(False)
-            ax.spines['bottom'].set_visible(False)
-            ax.spines['left'].set_visible(False)
-        
-        # 分离线路点和车站点
-        line_points = []
-        stations = []
+            fig, ax = self.create_figure()
         
-        for point in path_points:
-            line_points.append([point['lon'], point['lat']])
-            if point['is_station']:
-                stations.append({
-                    'name': point['station_name'],
-                    'lon': point['lon'],
-                    'lat': point['lat']
-                })
+        records = [record for record in records if len(record['coords'])]
+        if not records:
+            return fig, ax
         
-        # 绘制线路
-        if line_points:
-            coords_array = np.array(line_points)
-            ax.plot(coords_array[:, 0], coords_array[:, 1], 
-                color=line_color, linewidth=4, solid_capstyle='round',
-                alpha=alpha, zorder=1)
+        segments = [np.asarray(record['coords']) for record in records]
+        min_lon = min(segment[:, 0].min() for segment in segments)
+        max_lon = max(segment[:, 0].max() for segment in segments)
+        min_lat = min(segment[:, 1].min() for segment in segments)
+        max_lat = max(segment[:, 1].max() for segment in segments)
+        
+        # 绘制线路，互不相连的各部分分别作为一条折线
+        viewport = None
+        if interactive:
+            viewport = ViewportRenderer(ax, records, alpha=alpha)
+        elif use_lod:
+            tolerance = self.lod_tolerance(fig, ax, min_lon, max_lon, min_lat, max_lat)
+            records_parts = [lod_parts(record, tolerance) for record in records]
+        else:
+            records_parts = [split_parts(record) for record in records]
+        if viewport is None:
+            lines_coords = [coords for parts in records_parts for coords in parts]
+            line_colors = [record['colour'] for record, parts in zip(records, records_parts) for _ in parts]
+            lines = LineCollection(lines_coords, colors=line_colors,
+                                   linewidths=4, capstyle='round', joinstyle='round',
+                                   alpha=alpha, zorder=1)
+            ax.add_collection(lines)
         
         # 绘制车站
-        for station in stations:
-            ax.plot(station['lon'], station['lat'], 'o', 
-                color='white', markersize=3, markeredgecolor=line_color, 
-                markeredgewidth=0, zorder=1)
-            
-            # 添加车站名称标签
-            # ax.annotate(station['name'], 
-            #         (station['lon'], station['lat']),
-            #         xytext=(0, -10), textcoords='offset points',
-            #         fontsize=8, ha='center', va='center')
+        station_coords = [segment[record['station_indices']] for segment, record in zip(segments, records)]
+        station_colors = [record['colour'] for record in records
+                          for _ in range(len(record['station_indices']))]
+        if station_colors:
+            station_coords = np.concatenate(station_coords)
+            ax.scatter(station_coords[:, 0], station_coords[:, 1], s=9, c='white',
+                       edgecolors=station_colors, linewidths=0, zorder=1)
+        
+        # 添加车站名称标签
+        # for record in records:
+        #     for name, index in zip(record['station_names'], record['station_indices']):
+        #         ax.annotate(name, tuple(record['coords'][index]),
+        #                 xytext=(0, -10), textcoords='offset points',
+        #                 fontsize=8, ha='center', va='center')
         
         # 更新坐标轴范围以包含新线路
-        all_lons = [p[0] for p in line_points]
-        all_lats = [p[1] for p in line_points]
-        
-        if all_lons and all_lats:
-            # 获取当前坐标轴范围
-            current_xlim = ax.get_xlim()
-            current_ylim = ax.get_ylim()
-
-            # 计算新的范围
-            new_min_lon = min(min(all_lons), current_xlim[0])
-            new_max_lon = max(max(all_lons), current_xlim[1])
-            new_min_lat = min(min(all_lats), current_ylim[0])
-            new_max_lat = max(max(all_lats), current_ylim[1])
-
-            # 检查各个方向的扩展情况
-            lon_extended_left = new_min_lon < current_xlim[0]
-            lon_extended_right = new_max_lon > current_xlim[1]
-            lat_extended_bottom = new_min_lat < current_ylim[0]
-            lat_extended_top = new_max_lat > current_ylim[1]
-
-            # 计算基础边距
-            base_lon_margin = (new_max_lon - new_min_lon) * 0.05
-            base_lat_margin = (new_max_lat - new_min_lat) * 0.05
-
-            # 根据扩展情况决定各方向的边距
-            left_margin = base_lon_margin if lon_extended_left else 0
-            right_margin = base_lon_margin if lon_extended_right else 0
-            bottom_margin = base_lat_margin if lat_extended_bottom else 0
-            top_margin = base_lat_margin if lat_extended_top else 0
-
-            ax.set_xlim(new_min_lon - left_margin, new_max_lon + right_margin)
-            ax.set_ylim(new_min_lat - bottom_margin, new_max_lat + top_margin)
+        self.update_axis_limits(ax, min_lon, max_lon, min_lat, max_lat)
+        if viewport is not None:
+            viewport.update(force=True)
+        
+        self.stats.add_time('render', time.perf_counter() - start)
+        return fig, ax
+
+    def rasterize_lines(self, records, extent, width_px, height_px, dpi, alpha):
+        """在离屏的 Agg 画布上绘制线路，返回 (height_px, width_px, 4) 的 RGBA 图像（背景透明）"""
+        fig = Figure(figsize=(width_px / dpi, height_px / dpi), dpi=dpi)
+        FigureCanvasAgg(fig)
+        fig.patch.set_alpha(0)
+        ax = fig.add_axes([0, 0, 1, 1])
+        ax.set_axis_off()
+        
+        self.render_lines(records, fig, ax, alpha=alpha)
+        ax.set_xlim(extent[0], extent[1])
+        ax.set_ylim(extent[2], extent[3])
+        
+        fig.canvas.draw()
+        return np.asarray(fig.canvas.buffer_rgba()).copy()
+
+    def render_basemap(self, json_filenames, fig=None, ax=None, alpha=0.1, extent=None, dpi=None):
+        """以栅格图像绘制线网底图，用于在其上叠加高亮的区间
+        
+        底图按线路文件、范围、尺寸与样式缓存在 config.BASEMAP_CACHE_DIR 中，
+        相同的底图只绘制一次，之后直接以 imshow 显示；任一线路文件变化后自动重新绘制。
+        
+        Args:
+            json_filenames: 线路文件列表
+            alpha: 线路的不透明度
+            extent: 底图范围 (min_lon, max_lon, min_lat, max_lat)，默认为所有线路的范围外加5%边距
+            dpi: 底图分辨率，默认与图形相同
+        """
+        if fig is None or ax is None:
+            fig, ax = self.create_figure()
+        
+        json_filenames = [f for f in json_filenames if f]
+        if not json_filenames:
+            return fig, ax
+        dpi = dpi or fig.dpi
+        
+        records = None
+        if extent is None:
+            records = [record for record in (self.load_line(f) for f in json_filenames)
+                       if record is not None and len(record['coords'])]
+            if not records:
+                return fig, ax
+            min_lon = min(float(record['coords'][:, 0].min()) for record in records)
+            max_lon = max(float(record['coords'][:, 0].max()) for record in records)
+            min_lat = min(float(record['coords'][:, 1].min()) for record in records)
+            max_lat = max(float(record['coords'][:, 1].max()) for record in records)
+            lon_margin = (max_lon - min_lon) * 0.05
+            lat_margin = (max_lat - min_lat) * 0.05
+            extent = (min_lon - lon_margin, max_lon + lon_margin, min_lat - lat_margin, max_lat + lat_margin)
+        extent = tuple(float(value) for value in extent)
+        
+        # 宽度与图形一致，高度按等比例显示的经纬度跨度计算
+        width_px = int(round(fig.get_figwidth() * dpi))
+        height_px = max(1, int(round(width_px * (extent[3] - extent[2]) / (extent[1] - extent[0]))))
+        
+        cache_query = json.dumps({
+            'files': file_signatures(json_filenames),
+            'extent': extent,
+            'size': [width_px, height_px],
+            'dpi': dpi,
+            'alpha': alpha,
+            'lod': [list(LOD_TOLERANCES), LOD_PIXEL_TOLERANCE]
+        })
+        content = self.basemap_cache.get(cache_query) if self.basemap_cache else None
+        
+        if content is not None:
+            with np.load(io.BytesIO(content)) as data:
+                image = data['image']
+            logger.info("使用缓存的底图: %sx%s", width_px, height_px)
+        else:
+            if records is None:
+                records = [record for record in (self.load_line(f) for f in json_filenames)
+                           if record is not None and len(record['coords'])]
+            image = self.rasterize_lines(records, extent, width_px, height_px, dpi, alpha)
+            if self.basemap_cache:
+                buffer = io.BytesIO()
+                np.savez_compressed(buffer, image=image)
+                self.basemap_cache.put(cache_query, buffer.getvalue())
+            logger.info("已绘制底图: %d 条线路, %sx%s", len(records), width_px, height_px)
+        
+        ax.imshow(image, extent=extent, origin='upper', interpolation='antialiased', zorder=0)
+        self.update_axis_limits(ax, *extent)
+        
+        return fig, ax
 
+    def plot_from_json(self, json_filename, fig=None, ax=None, alpha = 0.8, show_plot=True):
+        """从线路文件（npz 或 JSON）读取数据并绘制地铁线路图"""
+        record = self.load_line(json_filename)
+        if record is None:
+            return None, None
+        
+        if not len(record['coords']):
+            logger.warning("线路文件中没有路径数据")
+            return None, None
+        
+        fig, ax = self.render_lines([record], fig, ax, alpha=alpha)
+        
         # 只有在show_plot为True时才显示图形
         if show_plot:
             plt.tight_layout()
             plt.show()
         
-        print(f"绘制完成: {line_name}")
-        print(f"总点数: {len(path_points)}")
-        print(f"车站数: {len(stations)}")
+        logger.info("绘制完成: %s", record['name'])
+        logger.info("总点数: %d", len(record['coords']))
+        logger.info("车站数: %d", len(record['station_indices']))
         
         return fig, ax
         
-    def plot_multiple_lines(self, json_filenames, fig=None, ax=None, alpha=0.8, show_plot=True):
+    def plot_multiple_lines(self, json_filenames, fig=None, ax=None, alpha=0.8, show_plot=True, interactive=False):
         """一次性绘制多条线路
         Args:
-            json_filenames: 线路信息 json 文件名列表
+            json_filenames: 线路文件名列表（npz 或 JSON）
             alpha: 不透明度
             show_plot: 是否显示图形
+            interactive: 交互模式，缩放、平移时只绘制视野内的线路并切换简化级别（见 render_lines）
         """
         if not json_filenames:
-            print("没有提供JSON文件")
+            logger.warning("没有提供JSON文件")
             return fig, ax
         
-        for i, filename in enumerate(json_filenames):
-            # 最后一条线路时显示图形
-            show = show_plot and (i == len(json_filenames) - 1)
-            fig, ax = self.plot_from_json(filename, fig, ax, alpha=alpha, show_plot=show)
-            
-            if fig is None or ax is None:
-                print(f"绘制 {filename} 失败")
+        records = []
+        for filename in json_filenames:
+            record = self.load_line(filename)
+            if record is None or not len(record['coords']):
+                logger.warning("绘制 %s 失败", filename)
                 continue
+            records.append(record)
+        
+        if not records:
+            return fig, ax
+        
+        fig, ax = self.render_lines(records, fig, ax, alpha=alpha, interactive=interactive)
+        
+        # 只有在show_plot为True时才显示图形
+        if show_plot:
+            plt.tight_layout()
+            plt.show()
+        
+        logger.info("绘制完成: %d 条线路", len(records))
         
         return fig, ax
 
@@ -505,147 +1777,166 @@ class MetroLinePlotter:
         end_index = self.find_station_index(path_points, end_station)
         
         if start_index == -1:
-            print(f"未找到起始车站: {start_station}")
+            logger.warning("未找到起始车站: %s", start_station)
             return []
         
         if end_index == -1:
-            print(f"未找到终点车站: {end_station}")
+            logger.warning("未找到终点车站: %s", end_station)
             return []
         
         # 确保start_index小于end_index
         if start_index > end_index:
             start_index, end_index = end_index, start_index
-            print(f"已调整顺序: {end_station} -> {start_station}")
+            logger.info("已调整顺序: %s -> %s", end_station, start_station)
         
         # 提取区间内的所有点
         segment_points = path_points[start_index:end_index + 1]
         
-        print(f"提取区间: {start_station} -> {end_station}")
-        print(f"区间包含 {len(segment_points)} 个点")
+        logger.info("提取区间: %s -> %s", start_station, end_station)
+        logger.info("区间包含 %d 个点", len(segment_points))
         
         return segment_points
 
-    def plot_segment_from_json(self, json_filename, start_station, end_station, fig=None, ax=None, alpha=0.8, show_plot=True):
-        """从JSON文件读取数据并绘制指定区间的地铁线路图"""
-        try:
-            with open(json_filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-        except Exception as e:
-            print(f"读取JSON文件失败: {e}")
-            return None, None
+    def find_station_positions(self, record, start_station, end_station):
+        """在线路记录的车站表中查找区间两端车站的位置
         
-        path_points = data.get('path_points', [])
-        line_name = data.get('name', '地铁线路')
-        line_color = data.get('colour', '#000000')
+        通过预先建立的车站索引查找，不扫描路径点。环线上同名车站出现多次时，
+        选取沿线距离最短的一对。
         
-        if not path_points:
-            print("JSON文件中没有路径数据")
+        Returns:
+            (起点位置, 终点位置)，未找到的车站对应 None；两站位于互不相连的部分时都为 None
+        """
+        lookup = record['station_lookup']
+        start_positions = lookup.get(start_station)
+        end_positions = lookup.get(end_station)
+        
+        if not start_positions or not end_positions:
+            return (start_positions[0] if start_positions else None,
+                    end_positions[0] if end_positions else None)
+        
+        # 只有同一部分内的车站之间才有连续的路径
+        distances = record['station_distances']
+        parts = station_parts(record)
+        pairs = [(s, e) for s in start_positions for e in end_positions if parts[s] == parts[e]]
+        if not pairs:
+            logger.warning("车站 %s 与 %s 位于线路互不相连的部分", start_station, end_station)
             return None, None
+        return min(pairs, key=lambda pair: abs(distances[pair[1]] - distances[pair[0]]))
+
+    def extract_segment_record(self, record, start_station, end_station):
+        """从线路记录中提取两个车站之间的区间，返回同样格式的区间记录，失败时返回 None"""
+        start_position, end_position = self.find_station_positions(record, start_station, end_station)
         
-        # 提取指定区间的路径段
-        segment_points = self.extract_segment(path_points, start_station, end_station)
+        if start_position is None:
+            logger.warning("未找到起始车站: %s", start_station)
+            return None
         
-        if not segment_points:
-            print("无法提取指定区间")
-            return None, None
+        if end_position is None:
+            logger.warning("未找到终点车站: %s", end_station)
+            return None
         
-        # 设置中文字体支持
-        plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
-        plt.rcParams['axes.unicode_minus'] = False
+        # 确保起点在前
+        if start_position > end_position:
+            start_position, end_position = end_position, start_position
+            logger.info("已调整顺序: %s -> %s", end_station, start_station)
+        
+        # 车站表按路径顺序排列，区间内的车站即车站表中两端之间的部分
+        station_indices = record['station_indices']
+        start_index = int(station_indices[start_position])
+        end_index = int(station_indices[end_position])
+        segment = {
+            'relation_id': record['relation_id'],
+            'name': record['name'],
+            'colour': record['colour'],
+            'coords': record['coords'][start_index:end_index + 1],
+            'distances': record['distances'][start_index:end_index + 1] - record['distances'][start_index],
+            'station_indices': station_indices[start_position:end_position + 1] - start_index,
+            'station_names': record['station_names'][start_position:end_position + 1],
+            'station_distances': (record['station_distances'][start_position:end_position + 1]
+                                  - record['station_distances'][start_position])
+        }
         
-        # 如果没有提供fig和ax，创建新的
-        if fig is None or ax is None:
-            fig, ax = plt.subplots(1, 1, figsize=(16, 10))
-            ax.set_facecolor('white')
-            fig.patch.set_facecolor('white')
-            # 设置图形属性（仅在创建新图时设置）
-            ax.set_aspect('equal', adjustable='box')
-            # 移除网格、坐标轴标签和刻度
-            ax.grid(False)
-            ax.set_xticks([])
-            ax.set_yticks([])
-            ax.set_xlabel('')
-            ax.set_ylabel('')
-            # 移除坐标轴边框
-            ax.spines['top'].set_visible(False)
-            ax.spines['right'].set_visible(False)
-            ax.spines['bottom'].set_visible(False)
-            ax.spines['left'].set_visible(False)
-        
-        # 分离线路点和车站点
-        line_points = []
-        stations = []
+        logger.info("提取区间: %s -> %s", start_station, end_station)
+        logger.info("区间包含 %d 个点", len(segment['coords']))
         
-        for point in segment_points:
-            line_points.append([point['lon'], point['lat']])
-            if point['is_station']:
-                stations.append({
-                    'name': point['station_name'],
-                    'lon': point['lon'],
-                    'lat': point['lat']
-                })
+        return segment
+
+    def build_station_catalog(self, json_filenames):
+        """建立全线网的车站目录，记录每个车站由哪些线路经过
+        
+        Returns:
+            {车站名: [{'filename', 'relation_id', 'line_name', 'path_index', 'distance'}, ...]}，
+            其中 path_index 为车站在该线路路径中的索引，distance 为距线路起点的沿线距离（米）
+        """
+        catalog = {}
+        for filename in json_filenames:
+            record = self.load_line(filename)
+            if record is None:
+                continue
+            for name, positions in record['station_lookup'].items():
+                for position in positions:
+                    catalog.setdefault(name, []).append({
+                        'filename': filename,
+                        'relation_id': record['relation_id'],
+                        'line_name': record['name'],
+                        'path_index': int(record['station_indices'][position]),
+                        'distance': float(record['station_distances'][position])
+                    })
+        logger.info("车站目录包含 %d 个车站", len(catalog))
+        return catalog
+
+    def section_length(self, record, start_station, end_station):
+        """返回线路上两个车站之间的沿线距离（米），直接读取预先计算的累计距离
+
+        Returns:
+            沿线距离，未找到车站或两站位于互不相连的部分时返回 None
+        """
+        start_position, end_position = self.find_station_positions(record, start_station, end_station)
+        if start_position is None or end_position is None:
+            return None
+        distances = record['station_distances']
+        return float(abs(distances[end_position] - distances[start_position]))
+
+    def station_distance_matrix(self, record):
+        """返回线路上所有车站两两之间的沿线距离矩阵
+
+        Returns:
+            (车站名列表, 形状为 (车站数, 车站数) 的距离矩阵（米）)，顺序与车站表一致；
+            位于互不相连的部分的两站之间为 nan
+        """
+        distances = np.asarray(record['station_distances'])
+        matrix = np.abs(distances[:, np.newaxis] - distances[np.newaxis, :])
+        parts = station_parts(record)
+        matrix[parts[:, np.newaxis] != parts[np.newaxis, :]] = np.nan
+        return list(record['station_names']), matrix
+
+    def plot_segment_from_json(self, json_filename, start_station, end_station, fig=None, ax=None, alpha=0.8, show_plot=True):
+        """从线路文件（npz 或 JSON）读取数据并绘制指定区间的地铁线路图"""
+        record = self.load_line(json_filename)
+        if record is None:
+            return None, None
         
-        # 绘制线路
-        if line_points:
-            coords_array = np.array(line_points)
-            ax.plot(coords_array[:, 0], coords_array[:, 1], 
-                color=line_color, linewidth=4, solid_capstyle='round',
-                alpha=alpha, zorder=1)
+        if not len(record['coords']):
+            logger.warning("线路文件中没有路径数据")
+            return None, None
         
-        # 绘制车站
-        for station in stations:
-            ax.plot(station['lon'], station['lat'], 'o', 
-                color='white', markersize=3, markeredgecolor=line_color, 
-                markeredgewidth=0, zorder=1)
-            
-            # 添加车站名称标签
-            # ax.annotate(station['name'], 
-            #         (station['lon'], station['lat']),
-            #         xytext=(0, -10), textcoords='offset points',
-            #         fontsize=8, ha='center', va='center')
+        # 提取指定区间的路径段
+        segment = self.extract_segment_record(record, start_station, end_station)
         
-        # 更新坐标轴范围以包含新线路
-        all_lons = [p[0] for p in line_points]
-        all_lats = [p[1] for p in line_points]
-        
-        if all_lons and all_lats:
-            # 获取当前坐标轴范围
-            current_xlim = ax.get_xlim()
-            current_ylim = ax.get_ylim()
-
-            # 计算新的范围
-            new_min_lon = min(min(all_lons), current_xlim[0])
-            new_max_lon = max(max(all_lons), current_xlim[1])
-            new_min_lat = min(min(all_lats), current_ylim[0])
-            new_max_lat = max(max(all_lats), current_ylim[1])
-
-            # 检查各个方向的扩展情况
-            lon_extended_left = new_min_lon < current_xlim[0]
-            lon_extended_right = new_max_lon > current_xlim[1]
-            lat_extended_bottom = new_min_lat < current_ylim[0]
-            lat_extended_top = new_max_lat > current_ylim[1]
-
-            # 计算基础边距
-            base_lon_margin = (new_max_lon - new_min_lon) * 0.05
-            base_lat_margin = (new_max_lat - new_min_lat) * 0.05
-
-            # 根据扩展情况决定各方向的边距
-            left_margin = base_lon_margin if lon_extended_left else 0
-            right_margin = base_lon_margin if lon_extended_right else 0
-            bottom_margin = base_lat_margin if lat_extended_bottom else 0
-            top_margin = base_lat_margin if lat_extended_top else 0
-
-            ax.set_xlim(new_min_lon - left_margin, new_max_lon + right_margin)
-            ax.set_ylim(new_min_lat - bottom_margin, new_max_lat + top_margin)
+        if segment is None:
+            logger.warning("无法提取指定区间")
+            return None, None
+        
+        fig, ax = self.render_lines([segment], fig, ax, alpha=alpha)
         
         # 只有在show_plot为True时才显示图形
         if show_plot:
             plt.tight_layout()
             plt.show()
         
-        print(f"绘制完成: {line_name} ({start_station} -> {end_station})")
-        print(f"区间点数: {len(segment_points)}")
-        print(f"区间车站数: {len(stations)}")
+        logger.info("绘制完成: %s (%s -> %s)", record['name'], start_station, end_station)
+        logger.info("区间点数: %d", len(segment['coords']))
+        logger.info("区间车站数: %d", len(segment['station_indices']))
         
         return fig, ax
 
@@ -655,7 +1946,7 @@ class MetroLinePlotter:
         Args:
             segment_configs: 配置列表，每个配置包含:
                 {
-                    'json_filename': 'metro_line_xxx.json',
+                    'json_filename': 'metro_line_xxx.npz',
                     'start_station': '起始站名',
                     'end_station': '终点站名'
                 }
@@ -663,41 +1954,228 @@ class MetroLinePlotter:
             show_plot: 是否显示图形
         """
         if not segment_configs:
-            print("没有提供区间配置")
+            logger.warning("没有提供区间配置")
             return fig, ax
         
+        segments = []
         for i, config in enumerate(segment_configs):
             json_filename = config.get('json_filename')
             start_station = config.get('start_station')
             end_station = config.get('end_station')
             
             if not all([json_filename, start_station, end_station]):
-                print(f"配置 {i} 缺少必要参数")
+                logger.warning("配置 %s 缺少必要参数", i)
                 continue
             
-            # 最后一个区间时显示图形
-            show = show_plot and (i == len(segment_configs) - 1)
-            fig, ax = self.plot_segment_from_json(
-                json_filename, start_station, end_station,
-                fig, ax, alpha=alpha, show_plot=show
-            )
-            
-            if fig is None or ax is None:
-                print(f"绘制区间 {start_station} -> {end_station} 失败")
+            record = self.load_line(json_filename)
+            segment = self.extract_segment_record(record, start_station, end_station) if record else None
+            if segment is None:
+                logger.warning("绘制区间 %s -> %s 失败", start_station, end_station)
                 continue
+            segments.append(segment)
+        
+        if not segments:
+            return fig, ax
+        
+        fig, ax = self.render_lines(segments, fig, ax, alpha=alpha)
+        
+        # 只有在show_plot为True时才显示图形
+        if show_plot:
+            plt.tight_layout()
+            plt.show()
+        
+        logger.info("绘制完成: %d 个区间", len(segments))
         
         return fig, ax
 
+    def export_figure(self, spec):
+        """按配置绘制一张图并保存到文件，不显示窗口
+        
+        Args:
+            spec: 图形配置字典:
+                {
+                    'output': 'figure/fig2.png',   # 输出路径，按后缀保存为 PNG/SVG/PDF
+                    'lines': ['metro_line_xxx.npz', ...],   # 可选，绘制的完整线路
+                    'segments': [{...}, ...],   # 可选，绘制的区间，格式同 plot_multiple_segments
+                    'line_alpha': 0.1,   # 可选，完整线路的不透明度
+                    'basemap': True,   # 可选，完整线路以缓存的栅格底图绘制（见 render_basemap）
+                    'segment_alpha': 0.8,   # 可选，区间的不透明度
+                    'figsize': (16, 10),   # 可选，图形尺寸（英寸）
+                    'dpi': 200   # 可选，位图分辨率
+                }
+        
+        Returns:
+            输出文件路径
+        """
+        output = spec['output']
+        fig, ax = self.create_figure(figsize=spec.get('figsize', (16, 10)))
+        
+        try:
+            if spec.get('basemap'):
+                self.render_basemap(spec.get('lines', []), fig, ax, alpha=spec.get('line_alpha', 0.8),
+                                    dpi=spec.get('dpi', 200))
+            else:
+                lines = [self.load_line(f) for f in spec.get('lines', []) if f]
+                self.render_lines([record for record in lines if record is not None], fig, ax,
+                                  alpha=spec.get('line_alpha', 0.8))
+            if spec.get('segments'):
+                self.plot_multiple_segments(spec['segments'], fig, ax,
+                                            alpha=spec.get('segment_alpha', 0.8), show_plot=False)
+            
+            if os.path.dirname(output):
+                os.makedirs(os.path.dirname(output), exist_ok=True)
+            with self.stats.stage('export'):
+                fig.tight_layout()
+                fig.savefig(output, dpi=spec.get('dpi', 200), facecolor=fig.get_facecolor())
+        finally:
+            # 批量导出时及时释放图形，避免内存累积
+            plt.close(fig)
+        
+        logger.info("已导出: %s", output)
+        return output
+
+    def export_figures(self, specs, process_workers=None):
+        """在进程池中并行导出多张图（Agg 后端，不显示窗口）
+        
+        Args:
+            specs: 图形配置列表，格式见 export_figure
+            process_workers: 导出进程数，默认为CPU核数
+        
+        Returns:
+            与 specs 顺序一致的输出路径列表，导出失败的图对应 None
+        """
+        results = [None] * len(specs)
+        self.prepare_basemaps(specs)
+        # 导出进程与当前绘图器共用底图缓存
+        with ProcessPoolExecutor(max_workers=process_workers, initializer=init_export_worker,
+                                 initargs=(self.basemap_cache,)) as pool:
+            futures = {pool.submit(export_figure, spec): i for i, spec in enumerate(specs)}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    logger.warning("导出 %s 失败: %s", specs[i].get('output'), e)
+        
+        logger.info("导出完成: %d/%d 张图", sum(1 for r in results if r), len(specs))
+        return results
+
+    def prepare_basemaps(self, specs):
+        """在分发导出任务前绘制各图用到的底图并存入缓存，相同的底图只绘制一次
+        
+        否则多个导出进程会同时发现缓存中没有底图，各自重复绘制。没有底图缓存时不做任何事。
+        """
+        if not self.basemap_cache:
+            return
+        prepared = set()
+        for spec in specs:
+            if not spec.get('basemap'):
+                continue
+            key = (tuple(spec.get('lines', [])), spec.get('line_alpha', 0.8),
+                   tuple(spec.get('figsize', (16, 10))), spec.get('dpi', 200))
+            if key in prepared:
+                continue
+            prepared.add(key)
+            fig, ax = self.create_figure(figsize=spec.get('figsize', (16, 10)))
+            try:
+                self.render_basemap(spec.get('lines', []), fig, ax, alpha=spec.get('line_alpha', 0.8),
+                                    dpi=spec.get('dpi', 200))
+            finally:
+                plt.close(fig)
+
+    def load_network(self, json_filenames, cache_file=NETWORK_CACHE_FILE):
+        """返回由线路文件构建的线网图
+        
+        线网保存在 cache_file 中，线路文件未变化时直接读取，否则重新构建并保存。
+        cache_file 为 None 时不使用缓存。
+        """
+        json_filenames = [f for f in json_filenames if f]
+        signatures = file_signatures(json_filenames)
+        
+        if cache_file:
+            network = MetroNetwork.load(cache_file)
+            if network is not None and network.signatures == signatures:
+                return network
+        
+        records = []
+        for filename in json_filenames:
+            record = self.load_line(filename)
+            if record is not None:
+                records.append((filename, record))
+        network = MetroNetwork.from_records(records, signatures)
+        logger.info("已构建线网: %d 个车站, %d 条区间", len(network.adjacency), len(network.edges))
+        
+        if cache_file:
+            network.save(cache_file)
+        return network
+
+    def plan_route(self, json_filenames, start_station, end_station, transfer_penalty=TRANSFER_PENALTY):
+        """查找两站之间沿线距离最短的乘车路线
+        
+        Returns:
+            区间配置列表，可直接传给 plot_multiple_segments，每个配置额外包含该段的
+            'distance'（米）；无法到达时返回空列表
+        """
+        network = self.load_network(json_filenames)
+        total_distance, legs = network.shortest_path(start_station, end_station, transfer_penalty)
+        
+        if total_distance is None:
+            logger.warning("未找到路线: %s -> %s", start_station, end_station)
+            return []
+        
+        logger.info("路线 %s -> %s: %d 段, 共 %.2f km", start_station, end_station, len(legs), total_distance / 1000)
+        return legs
+
+    def plot_route(self, json_filenames, start_station, end_station, fig=None, ax=None, alpha=0.8, show_plot=True):
+        """查找并绘制两站之间的最短路线"""
+        segment_configs = self.plan_route(json_filenames, start_station, end_station)
+        return self.plot_multiple_segments(segment_configs, fig, ax, alpha=alpha, show_plot=show_plot)
+
+def setup_fonts():
+    """设置中文字体支持"""
+    plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
+    plt.rcParams['axes.unicode_minus'] = False
+
+def build_line_file(relation_id, line_data, quiet=None):
+    """在进程池中由提取得到的线路数据生成线路文件，返回 (文件名, 统计结果)"""
+    plotter = MetroLinePlotter(cache=False, quiet=quiet)
+    return plotter.build_line_file(relation_id, line_data), plotter.stats.to_dict()
+
+def share_trunk_ways(lines_data, quiet=None):
+    """在进程池中合并同一批线路共用的轨道，返回 (修改后的 lines_data, 统计结果)"""
+    plotter = MetroLinePlotter(cache=False, quiet=quiet)
+    return plotter.share_trunk_ways(lines_data), plotter.stats.to_dict()
+
+def merge_way_component(ways_info, quiet=None, metric='haversine'):
+    """在进程池中合并一组相连的way，返回 (路径列表, 统计结果)"""
+    plotter = MetroLinePlotter(cache=False, quiet=quiet)
+    plotter.metric = metric
+    return plotter.merge_way_component(ways_info), plotter.stats.to_dict()
+
+# 导出进程中共用的绘图器，同一进程导出的多张图共享已加载的线路
+export_plotter = None
+
+def init_export_worker(basemap_cache=None):
+    """导出进程的初始化：切换到无界面的 Agg 后端，字体只设置一次，底图缓存与主进程相同"""
+    global export_plotter
+    matplotlib.use('Agg')
+    export_plotter = MetroLinePlotter(cache=False, basemap_cache=basemap_cache or False)
+
+def export_figure(spec):
+    """在进程池中导出一张图"""
+    return export_plotter.export_figure(spec)
+
 # 使用示例
 if __name__ == "__main__":
     plotter = MetroLinePlotter()
     
-    # 处理线路
-    json_filenames = []
-    for line in METRO_LINES:
-            filename = plotter.process_metro_line(relation_id=line['relation_id'])
-            if filename:
-                json_filenames.append(filename)
+    # 处理线路（并发获取，文件顺序与 METRO_LINES 一致）；设置 PROFILE_FILE 时用 cProfile 分析这一部分
+    with profile(PROFILE_FILE) if PROFILE_FILE else contextlib.nullcontext():
+        json_filenames = plotter.process_metro_lines([line['relation_id'] for line in METRO_LINES])
+
+    # 也可以从本地 OSM 提取文件处理，不访问 Overpass
+    # extract_files = plotter.process_extract('zhejiang-latest.osm.pbf')
+    # json_filenames = [extract_files[line['relation_id']] for line in METRO_LINES]
 
     # 如果需要强制更新某条线路的缓存
     # json_filenames.append(plotter.process_metro_line(relation_id=13538220, force_update=True))
@@ -708,7 +2186,11 @@ if __name__ == "__main__":
 
     # 方法2: 绘制多条线路
     if json_filenames:
-        fig, ax = plotter.plot_multiple_lines(json_filenames, alpha = 0.01, show_plot=False)
+        fig, ax = plotter.plot_multiple_lines([f for f in json_filenames if f], alpha = 0.01, show_plot=False)
+    
+    # 交互浏览整个线网：缩放、平移时只绘制视野内的线路，并按缩放程度切换简化级别
+    # if json_filenames:
+    #     plotter.plot_multiple_lines([f for f in json_filenames if f], alpha=0.8, show_plot=True, interactive=True)
     
     # 方法3: 绘制单个区间
     # if json_filenames:
@@ -743,4 +2225,19 @@ if __name__ == "__main__":
                 'end_station': '浙大国际校区'
             }
         ]
-        plotter.plot_multiple_segments(segment_configs, fig, ax, show_plot=True)
\ No newline at end of file
+        plotter.plot_multiple_segments(segment_configs, fig, ax, show_plot=True)
+
+    # 方法5: 自动查找两站之间的路线并绘制
+    # if json_filenames:
+    #     plotter.plot_route(json_filenames, '古荡', '余杭高铁站', fig=fig, ax=ax, show_plot=True)
+
+    # 方法6: 无界面批量导出图片（PNG/SVG/PDF）
+    # if json_filenames:
+    #     plotter.export_figures([
+    #         {'output': 'figure/fig2.png', 'lines': json_filenames, 'line_alpha': 0.01, 'segments': segment_configs},
+    #     ])
+
+    # 输出各步骤耗时与计数，设置 REPORT_FILE 时保存为 JSON 报告
+    plotter.stats.log_summary()
+    if REPORT_FILE:
+        plotter.stats.save_report(REPORT_FILE)
@@ -0,0 +1,149 @@
+import heapq
+import itertools
+import json
+import os
+
+from line_data import station_parts
+
+# 网络文件格式版本
+NETWORK_FORMAT_VERSION = 2
+
+
+def file_signatures(json_filenames):
+    """返回线路文件的 [绝对路径, 修改时间, 大小] 列表，用于判断网络缓存是否过期"""
+    signatures = []
+    for filename in json_filenames:
+        stat = os.stat(filename)
+        signatures.append([os.path.abspath(filename), stat.st_mtime_ns, stat.st_size])
+    return signatures
+
+
+class MetroNetwork:
+    """由各线路文件构建的线网图
+
+    节点为车站名（同名车站视为换乘站），每条线路上相邻的两个车站之间连一条边，
+    边权为两站间的沿线距离（米），并记录边所属的线路文件。
+    """
+
+    def __init__(self, edges=None, signatures=None):
+        """
+        Args:
+            edges: [起点站, 终点站, 距离, 线路文件] 列表，按双向建立邻接表
+            signatures: 构建网络时各线路文件的签名
+        """
+        self.edges = edges or []
+        self.signatures = signatures or []
+
+        self.adjacency = {}
+        for start, end, distance, filename in self.edges:
+            self.adjacency.setdefault(start, []).append((end, distance, filename))
+            self.adjacency.setdefault(end, []).append((start, distance, filename))
+
+    @classmethod
+    def from_records(cls, records, signatures=None):
+        """由 (线路文件, 线路记录) 列表构建线网，线路互不相连的各部分之间不连边"""
+        edges = []
+        for filename, record in records:
+            names = record['station_names']
+            distances = record['station_distances']
+            parts = station_parts(record)
+            for position, name in enumerate(names):
+                if position > 0 and names[position - 1] != name and parts[position - 1] == parts[position]:
+                    edges.append([names[position - 1], name,
+                                  float(distances[position] - distances[position - 1]), filename])
+        return cls(edges, signatures)
+
+    def save(self, filename):
+        """保存线网到 JSON 文件"""
+        data = {
+            'format_version': NETWORK_FORMAT_VERSION,
+            'signatures': self.signatures,
+            'edges': self.edges
+        }
+        tmp_filename = f"{filename}.tmp"
+        with open(tmp_filename, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_filename, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """读取线网文件，文件不存在或格式版本不符时返回 None"""
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if data.get('format_version') != NETWORK_FORMAT_VERSION:
+            return None
+        return cls(data['edges'], data['signatures'])
+
+    def shortest_path(self, start_station, end_station, transfer_penalty=0):
+        """用 Dijkstra 算法查找两站间的最短路线，按乘坐的线路拆分为多段
+
+        搜索状态为 (车站, 当前线路)，换乘时额外计入 transfer_penalty 米，
+        避免在共线区段上来回换乘。同名车站在不同线路上的位置可能相距数百米，
+        直线距离不是沿线距离的下界，因此不使用 A* 的距离估计；线网只有数百个车站，搜索开销很小。
+
+        Returns:
+            (总距离, 路段列表)，每个路段为
+            {'json_filename', 'start_station', 'end_station', 'distance'}；
+            无法到达时返回 (None, [])
+        """
+        if start_station not in self.adjacency or end_station not in self.adjacency:
+            return None, []
+        if start_station == end_station:
+            return 0.0, []
+
+        start_state = (start_station, None)
+        costs = {start_state: 0.0}
+        previous = {}
+        # 队列元素中的序号用于耗费相同时排序，避免比较车站名与线路
+        order = itertools.count()
+        queue = [(0.0, next(order), start_station, None)]
+        end_state = None
+
+        while queue:
+            cost, _, station, line = heapq.heappop(queue)
+            if cost > costs.get((station, line), float('inf')):
+                continue
+            if station == end_station:
+                end_state = (station, line)
+                break
+            for neighbor, distance, filename in self.adjacency[station]:
+                new_cost = cost + distance
+                if line is not None and filename != line:
+                    new_cost += transfer_penalty
+                state = (neighbor, filename)
+                if new_cost < costs.get(state, float('inf')):
+                    costs[state] = new_cost
+                    previous[state] = (station, line)
+                    heapq.heappush(queue, (new_cost, next(order), neighbor, filename))
+
+        if end_state is None:
+            return None, []
+
+        # 回溯路径，连续乘坐同一线路的边合并为一个路段
+        states = [end_state]
+        while states[-1] != start_state:
+            states.append(previous[states[-1]])
+        states.reverse()
+
+        legs = []
+        for (prev_station, prev_line), (station, line) in zip(states, states[1:]):
+            distance = costs[(station, line)] - costs[(prev_station, prev_line)]
+            if legs and legs[-1]['json_filename'] == line:
+                legs[-1]['end_station'] = station
+                legs[-1]['distance'] += distance
+            else:
+                if legs:
+                    # 换乘代价不计入路段长度
+                    distance -= transfer_penalty
+                legs.append({
+                    'json_filename': line,
+                    'start_station': prev_station,
+                    'end_station': station,
+                    'distance': distance
+                })
+
+        total_distance = sum(leg['distance'] for leg in legs)
+        return total_distance, legs
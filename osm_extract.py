@@ -0,0 +1,291 @@
+import math
+import xml.etree.ElementTree as ET
+from array import array
+
+import numpy as np
+
+from instrument import logger
+
+# 需要保留标签的节点（车站、站台等），其余节点只保留坐标
+KEPT_NODE_TAG_KEYS = ('railway', 'public_transport')
+# 需要保留的way（轨道、站台等），其余way（道路、建筑等）不会是线路关系的成员，直接丢弃
+KEPT_WAY_TAG_KEYS = ('railway', 'public_transport')
+# 节点ID过滤时每次处理的节点数，限制临时数组的大小
+FILTER_CHUNK_SIZE = 1 << 20
+# osmium 中关系成员类型的缩写
+MEMBER_TYPES = {'n': 'node', 'w': 'way', 'r': 'relation'}
+
+
+def has_kept_tag(tags, keys):
+    """tags 中是否有 keys 中的任一键，tags 可以是字典或 osmium 的标签列表"""
+    return bool(tags) and any(key in tags for key in keys)
+
+
+class OsmCollector:
+    """单次遍历 OSM 数据时收集线路关系及其所需的节点与way
+
+    OSM 文件中节点、way、关系依次出现，遍历到关系之前无法知道需要哪些节点和way，
+    因此节点坐标与way的节点列表以紧凑数组保存，遍历结束后再按关系取用。
+    只保留带轨道、公共交通标签的way；节点标签只保留车站、站台等需要的部分。
+    way_locations 为 True 时way自带节点坐标（osmium 的节点位置索引），
+    此时只保存带标签的节点，不保存整个文件的节点坐标。
+    """
+
+    def __init__(self, relation_ids=None, route_types=('subway', 'light_rail'), way_locations=False):
+        """
+        Args:
+            relation_ids: 需要的关系ID，None 表示所有 route 为 route_types 之一的线路关系
+            route_types: relation_ids 为 None 时收集的线路类型
+            way_locations: way是否随节点列表一起提供各节点坐标
+        """
+        self.relation_ids = set(relation_ids) if relation_ids is not None else None
+        self.route_types = set(route_types)
+        self.way_locations = way_locations
+
+        self.node_ids = array('q')
+        self.node_lats = array('d')
+        self.node_lons = array('d')
+        self.node_tags = {}
+        self.node_count = 0
+
+        self.way_ids = array('q')
+        self.way_offsets = array('q', [0])
+        self.way_refs = array('q')
+        # way_locations 为 True 时与 way_refs 对应的节点坐标，缺少位置的节点为 NaN
+        self.way_lats = array('d')
+        self.way_lons = array('d')
+        self.way_count = 0
+
+        self.relations = []
+
+    def node(self, node_id, lat, lon, tags):
+        self.node_count += 1
+        kept = has_kept_tag(tags, KEPT_NODE_TAG_KEYS)
+        if not kept and self.way_locations:
+            return
+        self.node_ids.append(node_id)
+        self.node_lats.append(lat)
+        self.node_lons.append(lon)
+        if kept:
+            self.node_tags[node_id] = tags
+
+    def way(self, way_id, refs, tags, lats=None, lons=None):
+        """lats、lons 为各节点坐标（way_locations 为 True 时提供）"""
+        self.way_count += 1
+        if not has_kept_tag(tags, KEPT_WAY_TAG_KEYS):
+            return
+        self.way_ids.append(way_id)
+        self.way_refs.extend(refs)
+        self.way_offsets.append(len(self.way_refs))
+        if self.way_locations:
+            self.way_lats.extend(lats)
+            self.way_lons.extend(lons)
+
+    def needed_node_mask(self, node_ids):
+        """返回 node_ids 中被保留的way引用或作为关系成员的节点（布尔数组），分块处理以限制临时内存"""
+        needed = [np.frombuffer(self.way_refs, dtype=np.int64)]
+        needed.extend(np.array([m['ref'] for m in relation['members'] if m['type'] == 'node'], dtype=np.int64)
+                      for relation in self.relations)
+        needed = np.unique(np.concatenate(needed))
+        mask = np.zeros(len(node_ids), dtype=bool)
+        if not len(needed):
+            return mask
+        for start in range(0, len(node_ids), FILTER_CHUNK_SIZE):
+            chunk = node_ids[start:start + FILTER_CHUNK_SIZE]
+            positions = np.minimum(np.searchsorted(needed, chunk), len(needed) - 1)
+            mask[start:start + FILTER_CHUNK_SIZE] = needed[positions] == chunk
+        return mask
+
+    def relation(self, relation_id, members, tags, version=None, timestamp=None):
+        """members 为 (类型, ref, role) 列表"""
+        if self.relation_ids is not None:
+            if relation_id not in self.relation_ids:
+                return
+        elif tags.get('type') != 'route' or tags.get('route') not in self.route_types:
+            return
+        self.relations.append({
+            'type': 'relation',
+            'id': relation_id,
+            'version': version,
+            'timestamp': timestamp,
+            'members': [{'type': member_type, 'ref': ref, 'role': role} for member_type, ref, role in members],
+            'tags': tags
+        })
+
+    def relations_data(self):
+        """返回 {relation_id: data}，data 与 Overpass "out geom" 查询结果格式一致
+
+        每个关系的数据包含关系本身、带坐标的成员节点、带几何的成员way，
+        以及成员way上带车站标签的节点。
+        """
+        node_ids = np.frombuffer(self.node_ids, dtype=np.int64)
+        node_lats = np.frombuffer(self.node_lats, dtype=np.float64)
+        node_lons = np.frombuffer(self.node_lons, dtype=np.float64)
+        way_ids = np.frombuffer(self.way_ids, dtype=np.int64)
+        way_offsets = np.frombuffer(self.way_offsets, dtype=np.int64)
+        way_refs = np.frombuffer(self.way_refs, dtype=np.int64)
+        way_lats = np.frombuffer(self.way_lats, dtype=np.float64)
+        way_lons = np.frombuffer(self.way_lons, dtype=np.float64)
+
+        # 保存了所有节点坐标时，先只留下用得到的节点，再排序
+        if not self.way_locations:
+            mask = self.needed_node_mask(node_ids)
+            node_ids, node_lats, node_lons = node_ids[mask], node_lats[mask], node_lons[mask]
+            del mask
+
+        # 文件通常已按ID排序，否则先排序再二分查找
+        node_order = np.argsort(node_ids, kind='stable')
+        sorted_node_ids = node_ids[node_order]
+        way_order = np.argsort(way_ids, kind='stable')
+        sorted_way_ids = way_ids[way_order]
+
+        def find(sorted_ids, order, ids):
+            ids = np.asarray(ids, dtype=np.int64)
+            positions = np.searchsorted(sorted_ids, ids)
+            positions = np.minimum(positions, max(len(sorted_ids) - 1, 0))
+            found = (sorted_ids[positions] == ids) if len(sorted_ids) else np.zeros(len(ids), dtype=bool)
+            return order[positions], found
+
+        def node_element(node_id, index):
+            element = {'type': 'node', 'id': int(node_id),
+                       'lat': float(node_lats[index]), 'lon': float(node_lons[index])}
+            if int(node_id) in self.node_tags:
+                element['tags'] = self.node_tags[int(node_id)]
+            return element
+
+        result = {}
+        for relation in self.relations:
+            node_elements = []
+            way_elements = []
+            seen_nodes = set()
+
+            member_node_ids = [m['ref'] for m in relation['members'] if m['type'] == 'node']
+            if member_node_ids:
+                indices, found = find(sorted_node_ids, node_order, member_node_ids)
+                for node_id, index, ok in zip(member_node_ids, indices, found):
+                    if ok and node_id not in seen_nodes:
+                        seen_nodes.add(node_id)
+                        node_elements.append(node_element(node_id, index))
+
+            member_way_ids = [m['ref'] for m in relation['members'] if m['type'] == 'way']
+            if member_way_ids:
+                way_indices, way_found = find(sorted_way_ids, way_order, member_way_ids)
+                for way_id, way_index, ok in zip(member_way_ids, way_indices, way_found):
+                    if not ok:
+                        continue
+                    start, end = way_offsets[way_index], way_offsets[way_index + 1]
+                    refs = way_refs[start:end]
+                    indices, found = find(sorted_node_ids, node_order, refs)
+                    # 缺少节点（超出提取范围）的部分跳过
+                    if self.way_locations:
+                        lats, lons = way_lats[start:end], way_lons[start:end]
+                        valid = ~np.isnan(lats)
+                        geometry = [{'lat': lat, 'lon': lon}
+                                    for lat, lon in zip(lats[valid].tolist(), lons[valid].tolist())]
+                    else:
+                        geometry = [{'lat': float(node_lats[i]), 'lon': float(node_lons[i])}
+                                    for i in indices[found].tolist()]
+                    if len(geometry) < 2:
+                        continue
+                    way_elements.append({'type': 'way', 'id': int(way_id), 'nodes': refs.tolist(),
+                                         'geometry': geometry})
+                    for node_id, index in zip(refs[found].tolist(), indices[found].tolist()):
+                        if node_id in self.node_tags and node_id not in seen_nodes:
+                            seen_nodes.add(node_id)
+                            node_elements.append(node_element(node_id, index))
+
+            result[relation['id']] = {'elements': node_elements + way_elements + [relation]}
+        return result
+
+
+def read_osm_xml(filename, collector):
+    """以流式方式读取 .osm（XML）文件，逐个元素交给 collector"""
+    context = ET.iterparse(filename, events=('start', 'end'))
+    _, root = next(context)
+    for event, element in context:
+        if event != 'end':
+            continue
+        tag = element.tag
+        if tag == 'node':
+            tags = {child.get('k'): child.get('v') for child in element if child.tag == 'tag'}
+            collector.node(int(element.get('id')), float(element.get('lat')), float(element.get('lon')), tags)
+        elif tag == 'way':
+            refs = [int(child.get('ref')) for child in element if child.tag == 'nd']
+            tags = {child.get('k'): child.get('v') for child in element if child.tag == 'tag'}
+            collector.way(int(element.get('id')), refs, tags)
+        elif tag == 'relation':
+            tags = {}
+            members = []
+            for child in element:
+                if child.tag == 'tag':
+                    tags[child.get('k')] = child.get('v')
+                elif child.tag == 'member':
+                    members.append((child.get('type'), int(child.get('ref')), child.get('role', '')))
+            version = element.get('version')
+            collector.relation(int(element.get('id')), members, tags,
+                               int(version) if version is not None else None, element.get('timestamp'))
+        else:
+            continue
+        # 处理完的元素立即释放，不保留整棵 XML 元素树
+        element.clear()
+        root.clear()
+
+
+def read_osm_pbf(filename, collector):
+    """读取 .osm.pbf 文件（需要安装 osmium，即 pyosmium）
+
+    节点坐标由 osmium 的节点位置索引（flex_mem）保存，遍历到way时直接取得各节点坐标，
+    collector 只需保存带标签的节点与轨道、站台等way。
+    """
+    try:
+        import osmium
+    except ImportError:
+        raise ImportError("读取 .osm.pbf 文件需要安装 osmium: pip install osmium")
+
+    class Handler(osmium.SimpleHandler):
+        def node(self, n):
+            # 不需要的节点只计数，不构建标签字典
+            if n.location.valid() and has_kept_tag(n.tags, KEPT_NODE_TAG_KEYS):
+                collector.node(n.id, n.location.lat, n.location.lon, {tag.k: tag.v for tag in n.tags})
+            else:
+                collector.node_count += 1
+
+        def way(self, w):
+            if not has_kept_tag(w.tags, KEPT_WAY_TAG_KEYS):
+                collector.way_count += 1
+                return
+            refs, lats, lons = [], [], []
+            for node in w.nodes:
+                refs.append(node.ref)
+                valid = node.location.valid()
+                lats.append(node.location.lat if valid else math.nan)
+                lons.append(node.location.lon if valid else math.nan)
+            collector.way(w.id, refs, {tag.k: tag.v for tag in w.tags}, lats, lons)
+
+        def relation(self, r):
+            timestamp = r.timestamp.strftime('%Y-%m-%dT%H:%M:%SZ') if r.timestamp else None
+            members = [(MEMBER_TYPES.get(member.type, member.type), member.ref, member.role) for member in r.members]
+            collector.relation(r.id, members, {tag.k: tag.v for tag in r.tags}, r.version, timestamp)
+
+    Handler().apply_file(filename, locations=True, idx='flex_mem')
+
+
+def read_extract(filename, relation_ids=None, route_types=('subway', 'light_rail')):
+    """单次遍历本地 OSM 提取文件（.osm.pbf 或 .osm），返回各线路关系的数据
+
+    Args:
+        relation_ids: 需要的关系ID，None 表示所有 route 为 route_types 之一的线路关系
+
+    Returns:
+        {relation_id: data}，data 格式与 Overpass 查询结果一致
+    """
+    pbf = filename.endswith('.pbf')
+    collector = OsmCollector(relation_ids, route_types, way_locations=pbf)
+    if pbf:
+        read_osm_pbf(filename, collector)
+    else:
+        read_osm_xml(filename, collector)
+    logger.info("读取 %s: %d 个节点, %d 个way (保留 %d 个节点, %d 个way), %d 条线路关系",
+                filename, collector.node_count, collector.way_count, len(collector.node_ids),
+                len(collector.way_ids), len(collector.relations))
+    return collector.relations_data()
@@ -0,0 +1,57 @@
+import os
+import time
+
+from cache import ResponseCache
+
+# 每条响应 100 字节，上限可容纳两条
+CONTENT_SIZE = 100
+MAX_SIZE = 250
+
+
+def set_times(cache, query, accessed, modified=None):
+    """设置缓存文件的访问时间与修改时间（相对当前时间的秒数），不依赖文件系统的 atime 更新策略"""
+    now = time.time()
+    modified = accessed if modified is None else modified
+    os.utime(cache.path(query), (now + accessed, now + modified))
+
+
+def test_entry_past_ttl_is_miss(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl=60)
+    cache.put('a', b'x' * CONTENT_SIZE)
+    assert cache.get('a') == b'x' * CONTENT_SIZE
+
+    # 下载时间早于有效期
+    set_times(cache, 'a', accessed=0, modified=-120)
+    assert cache.get('a') is None
+    assert cache.open('a') is None
+    # 离线重新处理时忽略有效期
+    assert cache.get('a', ignore_ttl=True) == b'x' * CONTENT_SIZE
+
+
+def test_eviction_removes_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_size=MAX_SIZE)
+    cache.put('a', b'a' * CONTENT_SIZE)
+    cache.put('b', b'b' * CONTENT_SIZE)
+    set_times(cache, 'a', accessed=-20)
+    set_times(cache, 'b', accessed=-10)
+
+    cache.put('c', b'c' * CONTENT_SIZE)
+    assert cache.get('a') is None
+    assert cache.get('b') == b'b' * CONTENT_SIZE
+    assert cache.get('c') == b'c' * CONTENT_SIZE
+    assert len(cache.entries()) == 2
+
+
+def test_get_refreshes_recency(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_size=MAX_SIZE)
+    cache.put('a', b'a' * CONTENT_SIZE)
+    cache.put('b', b'b' * CONTENT_SIZE)
+    set_times(cache, 'a', accessed=-20)
+    set_times(cache, 'b', accessed=-10)
+
+    # 读取 a 后 b 成为最近最少使用的响应
+    assert cache.get('a') == b'a' * CONTENT_SIZE
+    cache.put('c', b'c' * CONTENT_SIZE)
+    assert cache.get('b') is None
+    assert cache.get('a') == b'a' * CONTENT_SIZE
+    assert cache.get('c') == b'c' * CONTENT_SIZE
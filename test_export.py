@@ -0,0 +1,54 @@
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+
+import main
+from cache import ResponseCache
+from line_data import path_points_to_record, save_record_npz
+from main import MetroLinePlotter
+
+
+def write_lines(directory, count=3, points=50):
+    """写入几条简单的线路文件，返回文件名列表"""
+    filenames = []
+    for i in range(count):
+        path_points = [{'lon': lon, 'lat': 30.0 + i * 0.01, 'is_station': j in (0, points - 1),
+                        'station_name': f'站{i}_{j}'}
+                       for j, lon in enumerate(np.linspace(120.0, 120.1, points).tolist())]
+        record = path_points_to_record(path_points, i, {'name': f'线路{i}', 'colour': '#ff0000'})
+        filename = str(directory / f'line_{i}.npz')
+        save_record_npz(record, filename)
+        filenames.append(filename)
+    return filenames
+
+
+def test_export_reuses_cached_basemap(tmp_path, monkeypatch):
+    # 进程池中的导出进程由 fork 创建，继承这里替换的方法，每次绘制底图都记录到文件
+    log = tmp_path / 'rasterized.log'
+    rasterize_lines = MetroLinePlotter.rasterize_lines
+
+    def counting_rasterize(self, *args):
+        with open(log, 'a') as f:
+            f.write('x\n')
+        return rasterize_lines(self, *args)
+
+    monkeypatch.setattr(MetroLinePlotter, 'rasterize_lines', counting_rasterize)
+    lines = write_lines(tmp_path)
+    cache = ResponseCache(str(tmp_path / 'basemap_cache'), suffix='.npz')
+    plotter = MetroLinePlotter(cache=False, quiet=True, basemap_cache=cache)
+    specs = [{'output': str(tmp_path / f'fig{i}.png'), 'lines': lines, 'basemap': True,
+              'line_alpha': 0.1, 'figsize': (4, 3), 'dpi': 50} for i in range(3)]
+
+    results = plotter.export_figures(specs, process_workers=2)
+
+    assert results == [spec['output'] for spec in specs]
+    assert log.read_text().count('x') == 1
+    assert len(cache.entries()) == 1
+
+
+def test_cache_false_disables_basemap_cache_by_default():
+    assert MetroLinePlotter(cache=False, quiet=True).basemap_cache is None
+    worker_cache = ResponseCache.__new__(ResponseCache)
+    main.init_export_worker(worker_cache)
+    assert main.export_plotter.basemap_cache is worker_cache
@@ -0,0 +1,43 @@
+import numpy as np
+
+from geo import haversine_matrix, haversine_one_to_many
+from main import MetroLinePlotter
+
+# 向量化距离与逐点计算 calculate_distance 的允许误差（米）
+TOLERANCE = 1e-6
+
+
+def random_city_points(rng, count):
+    """在约 50 公里范围内随机生成点（杭州附近）"""
+    lats = 30.25 + rng.uniform(-0.25, 0.25, count)
+    lons = 120.15 + rng.uniform(-0.25, 0.25, count)
+    return lats, lons
+
+
+def test_haversine_one_to_many_matches_scalar():
+    plotter = MetroLinePlotter(cache=False, quiet=True)
+    rng = np.random.default_rng(0)
+    lats, lons = random_city_points(rng, 500)
+    for lat, lon in zip(lats[:20], lons[:20]):
+        distances = haversine_one_to_many(lat, lon, lats, lons)
+        expected = np.array([plotter.calculate_distance(lat, lon, lat2, lon2) for lat2, lon2 in zip(lats, lons)])
+        assert distances.shape == lats.shape
+        assert np.max(np.abs(distances - expected)) < TOLERANCE
+
+
+def test_haversine_matrix_matches_scalar():
+    plotter = MetroLinePlotter(cache=False, quiet=True)
+    rng = np.random.default_rng(1)
+    lats1, lons1 = random_city_points(rng, 40)
+    lats2, lons2 = random_city_points(rng, 60)
+    matrix = haversine_matrix(lats1, lons1, lats2, lons2)
+    expected = np.array([[plotter.calculate_distance(lat1, lon1, lat2, lon2) for lat2, lon2 in zip(lats2, lons2)]
+                         for lat1, lon1 in zip(lats1, lons1)])
+    assert matrix.shape == (40, 60)
+    assert np.max(np.abs(matrix - expected)) < TOLERANCE
+
+
+def test_haversine_identical_points():
+    lats, lons = np.array([30.25, 30.3]), np.array([120.15, 120.2])
+    assert np.all(haversine_one_to_many(30.25, 120.15, lats[:1], lons[:1]) == 0)
+    assert np.all(np.diag(haversine_matrix(lats, lons, lats, lons)) < TOLERANCE)
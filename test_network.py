@@ -0,0 +1,59 @@
+import numpy as np
+
+from network import MetroNetwork
+
+
+def line_record(names, distances, parts=None):
+    """只含构建线网所需字段的线路记录，车站沿经线排列"""
+    count = len(names)
+    return {
+        'station_names': names,
+        'station_distances': np.array(distances, dtype=np.float64),
+        'station_indices': np.arange(count),
+        'coords': np.column_stack([np.full(count, 120.0), 30.0 + np.array(distances) / 111000]),
+        'parts': np.array(parts if parts is not None else [0], dtype=np.int64)
+    }
+
+
+def test_shortest_path_prefers_shorter_route_with_transfer():
+    network = MetroNetwork.from_records([
+        ('a.npz', line_record(['甲', '乙', '丙', '丁'], [0, 1000, 2000, 9000])),
+        ('b.npz', line_record(['丙', '戊', '丁'], [0, 1000, 2000])),
+    ])
+    distance, legs = network.shortest_path('甲', '丁', transfer_penalty=500)
+    assert distance == 4000
+    assert [(leg['json_filename'], leg['start_station'], leg['end_station']) for leg in legs] == [
+        ('a.npz', '甲', '丙'), ('b.npz', '丙', '丁')]
+
+    # 换乘代价超过绕行的距离时留在原线路
+    distance, legs = network.shortest_path('甲', '丁', transfer_penalty=6000)
+    assert distance == 9000
+    assert [leg['json_filename'] for leg in legs] == ['a.npz']
+
+
+def test_transfer_station_far_from_its_first_position():
+    # 换乘站"乙"在 a 线上的位置远离 b 线，直线距离大于实际的沿线距离
+    far = line_record(['甲', '乙'], [0, 100])
+    far['coords'][1] = [121.0, 31.0]
+    network = MetroNetwork.from_records([
+        ('a.npz', far),
+        ('b.npz', line_record(['乙', '丙', '丁'], [0, 100, 200])),
+        ('c.npz', line_record(['甲', '丁'], [0, 5000])),
+    ])
+    distance, legs = network.shortest_path('甲', '丁')
+    assert distance == 300
+    assert [leg['json_filename'] for leg in legs] == ['a.npz', 'b.npz']
+
+
+def test_disconnected_parts_are_not_linked(tmp_path):
+    network = MetroNetwork.from_records([
+        ('a.npz', line_record(['甲', '乙', '丙', '丁'], [0, 1000, 50000, 51000], parts=[0, 2])),
+    ], signatures=[['a.npz', 0, 0]])
+    assert network.shortest_path('甲', '乙')[0] == 1000
+    assert network.shortest_path('甲', '丁') == (None, [])
+
+    filename = tmp_path / 'network.json'
+    network.save(str(filename))
+    loaded = MetroNetwork.load(str(filename))
+    assert loaded.edges == network.edges
+    assert loaded.signatures == network.signatures
@@ -0,0 +1,180 @@
+import json
+import random
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import main
+from json_stream import iter_elements
+from line_data import load_record
+from main import MetroLinePlotter
+
+STATION_COUNT = 4
+WAY_COUNT = 3
+# 与另一关系共用全部轨道way的关系: {关系ID: 轨道所属的关系ID}
+SHARED_TRACKS = {32: 31}
+
+
+def canned_relation_elements(relation_id):
+    """一条关系的 "out geom" 元素：WAY_COUNT 个首尾相接的way（约 1 公里），轨道上的 STATION_COUNT 个车站"""
+    track_id = SHARED_TRACKS.get(relation_id, relation_id)
+    base_id = track_id * 1000
+    station_base_id = relation_id * 1000
+    lat = 30.0 + track_id * 0.01
+    points = [[120.0 + i * 1e-3, lat] for i in range(WAY_COUNT * 3 + 1)]
+    nodes = [{'type': 'node', 'id': base_id + i, 'lat': lat_, 'lon': lon} for i, (lon, lat_) in enumerate(points)]
+    ways = []
+    for i in range(WAY_COUNT):
+        refs = list(range(base_id + i * 3, base_id + i * 3 + 4))
+        ways.append({'type': 'way', 'id': base_id + i, 'nodes': refs, 'tags': {'railway': 'subway'},
+                     'geometry': [{'lat': p[1], 'lon': p[0]} for p in points[i * 3:i * 3 + 4]]})
+    stations = [{'type': 'node', 'id': station_base_id + 500 + i, 'lat': lat + 1e-4, 'lon': 120.0 + i * 3e-3,
+                 'tags': {'railway': 'stop', 'name': f'站{relation_id}_{i}'}} for i in range(STATION_COUNT)]
+    members = ([{'type': 'node', 'ref': station['id'], 'role': 'stop'} for station in stations] +
+               [{'type': 'way', 'ref': way['id'], 'role': ''} for way in ways])
+    relation = {'type': 'relation', 'id': relation_id, 'version': 1, 'timestamp': '2025-01-01T00:00:00Z',
+                'members': members, 'tags': {'name': f'线路{relation_id}', 'colour': '#ff0000'}}
+    return nodes + stations + ways + [relation]
+
+
+class StubOverpass:
+    """在线程中运行的本地 Overpass 服务，按查询中的关系ID返回 "out geom" 数据
+
+    failures 中的状态码依次用于最先到达的请求，之后的请求正常返回。
+    """
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.queries = []
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                query = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+                with stub.lock:
+                    stub.queries.append(query)
+                    status = stub.failures.pop(0) if stub.failures else 200
+                if status != 200:
+                    self.send_response(status)
+                    self.send_header('Retry-After', '0')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                ids = [int(i) for i in re.search(r'relation\((?:id:)?([\d,]+)\)', query).group(1).split(',')]
+                elements = list({(element['type'], element['id']): element for relation_id in ids
+                                 for element in canned_relation_elements(relation_id)}.values())
+                body = json.dumps({'version': 0.6, 'generator': 'stub', 'elements': elements}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/api/interpreter'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """线路文件写入临时目录，重试不等待"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, 'RETRY_BACKOFF', 0)
+    return tmp_path
+
+
+def check_line_file(filename, relation_id):
+    record = load_record(filename)
+    assert record['relation_id'] == relation_id
+    assert record['name'] == f'线路{relation_id}'
+    assert list(record['station_names']) == [f'站{relation_id}_{i}' for i in range(STATION_COUNT)]
+
+
+@pytest.mark.parametrize('stream', [True, False])
+def test_retry_after_429_and_504(workdir, monkeypatch, stream):
+    monkeypatch.setattr(main, 'STREAM_RESPONSES', stream)
+    with StubOverpass(failures=[429, 504]) as stub:
+        plotter = MetroLinePlotter(overpass_url=stub.url, cache=False, quiet=True)
+        filenames = plotter.process_metro_lines([7], process_workers=1)
+    assert len(stub.queries) == 3
+    assert plotter.stats.counters['retries'] == 2
+    assert filenames == [f'metro_line_7.{main.OUTPUT_FORMAT}']
+    check_line_file(filenames[0], 7)
+
+
+def test_batch_query(workdir, monkeypatch):
+    monkeypatch.setattr(main, 'OVERPASS_BATCH_SIZE', 2)
+    relation_ids = [11, 12, 13]
+    with StubOverpass(failures=[504]) as stub:
+        plotter = MetroLinePlotter(overpass_url=stub.url, cache=False, quiet=True)
+        filenames = plotter.process_metro_lines(relation_ids, max_workers=1, process_workers=2, batch_query=True)
+    # 两批查询，其中一批先失败一次
+    assert len(stub.queries) == 3
+    assert sorted(len(re.search(r'relation\((?:id:)?([\d,]+)\)', query).group(1).split(','))
+                  for query in stub.queries) == [1, 2, 2]
+    assert filenames == [f'metro_line_{relation_id}.{main.OUTPUT_FORMAT}' for relation_id in relation_ids]
+    for filename, relation_id in zip(filenames, relation_ids):
+        check_line_file(filename, relation_id)
+
+
+def test_retries_exhausted(workdir):
+    with StubOverpass(failures=[429] * (main.MAX_RETRIES + 1)) as stub:
+        plotter = MetroLinePlotter(overpass_url=stub.url, cache=False, quiet=True)
+        filenames = plotter.process_metro_lines([21], process_workers=1)
+    assert len(stub.queries) == main.MAX_RETRIES + 1
+    assert filenames == [None]
+
+
+def test_batch_shared_trunk(workdir, monkeypatch):
+    monkeypatch.setattr(main, 'OVERPASS_BATCH_SIZE', 2)
+    with StubOverpass() as stub:
+        plotter = MetroLinePlotter(overpass_url=stub.url, cache=False, quiet=True)
+        filenames = plotter.process_metro_lines([31, 32], process_workers=2, batch_query=True)
+        assert plotter.stats.counters['trunk_ways_shared'] == WAY_COUNT
+        for filename, relation_id, other_id in zip(filenames, (31, 32), (32, 31)):
+            check_line_file(filename, relation_id)
+            assert load_record(filename)['fingerprint']['shared_trunk'] == [other_id]
+
+        # 单独处理时轨道不再与其他线路共用，不复用之前的合并结果
+        plotter = MetroLinePlotter(overpass_url=stub.url, cache=False, quiet=True)
+        filenames = plotter.process_metro_lines([31], process_workers=1, force_update=True, check_freshness=False)
+        assert 'merges_reused' not in plotter.stats.counters
+        assert 'shared_trunk' not in load_record(filenames[0])['fingerprint']
+
+
+def random_chunks(data, rng):
+    """在随机字节位置切分数据（可能切开多字节字符和数字）"""
+    cuts = sorted(rng.sample(range(1, len(data)), min(len(data) - 1, rng.randint(1, 40))))
+    return [data[start:end] for start, end in zip([0] + cuts, cuts + [len(data)])]
+
+
+@pytest.mark.parametrize('elements', [
+    [{'type': 'node', 'id': 1, 'lat': 30.123456789, 'lon': 120.987654321,
+      'tags': {'name': '西湖文化广场站', 'note': 'a]b"c\\d', 'name:ja': 'ステーション'}},
+     {'type': 'way', 'id': 2, 'nodes': [1, 2, 3], 'tags': {'name': '轨道 ]}, "x"'}},
+     12345.678e-3, -98765, True, None, 'ab]"cd', []],
+    [],
+], ids=['mixed', 'empty'])
+def test_iter_elements_random_chunks(elements):
+    response = {'version': 0.6, 'osm3s': {'copyright': '数据 © OpenStreetMap'}, 'elements': elements,
+                'remark': 'elements after ]'}
+    data = json.dumps(response, ensure_ascii=False, indent=1).encode('utf-8')
+    rng = random.Random(0)
+    for _ in range(200):
+        assert list(iter_elements(random_chunks(data, rng))) == json.loads(data)['elements']
+    # 每块一个字节
+    assert list(iter_elements(data[i:i + 1] for i in range(len(data)))) == json.loads(data)['elements']
@@ -0,0 +1,145 @@
+import math
+
+import numpy as np
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba_array
+
+from config import LOD_PIXEL_TOLERANCE, VIEWPORT_CHUNK_POINTS
+from geo import EARTH_RADIUS
+from line_data import lod_parts
+
+
+def split_chunks(coords, chunk_points):
+    """将一条折线切成每段不超过 chunk_points 个点的小段，相邻小段共用端点，拼起来与原折线相同
+
+    每段至少 2 个点，chunk_points 小于 2 时按 2 处理。
+    """
+    chunk_points = max(int(chunk_points), 2)
+    if len(coords) <= chunk_points:
+        return [coords]
+    step = chunk_points - 1
+    return [coords[start:start + chunk_points] for start in range(0, len(coords) - 1, step)]
+
+
+class ViewportCollection(LineCollection):
+    """绘制前先让 ViewportRenderer 按当前视野更新线段的 LineCollection"""
+
+    def __init__(self, viewport, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.viewport = viewport
+
+    def draw(self, renderer):
+        self.viewport.update_if_dirty()
+        super().draw(renderer)
+
+
+class ViewportRenderer:
+    """交互窗口中随缩放、平移更新的线路绘制
+
+    每条线路在每个简化级别下都预先切成小段，并记录各小段的外包矩形（按级别汇总为一个
+    (M, 4) 数组，作为外包矩形索引）。坐标轴范围变化时（xlim_changed / ylim_changed），
+    按视野内每像素对应的距离选择简化级别，只把外包矩形与视野相交的小段交给 LineCollection，
+    平移、放大后需要绘制的顶点数只与视野内的线路有关。
+
+    一次平移会先后触发 xlim_changed 与 ylim_changed，回调中只做标记，
+    实际的裁剪推迟到下一次绘制该集合之前进行，每次重绘只计算一次。
+    """
+
+    def __init__(self, ax, records, alpha=0.8, chunk_points=VIEWPORT_CHUNK_POINTS,
+                 pixel_tolerance=LOD_PIXEL_TOLERANCE):
+        """
+        Args:
+            ax: 绘制的坐标轴
+            records: 线路记录列表（见 line_data.path_points_to_record）
+            alpha: 线路的不透明度
+            chunk_points: 每个小段的最大点数，越小裁剪越精细，但每次更新需判断的小段越多
+            pixel_tolerance: 允许的简化误差（像素）
+        """
+        self.ax = ax
+        self.pixel_tolerance = pixel_tolerance
+        self.view = None
+        self.dirty = True
+        self.level = None
+        self.visible_points = 0
+
+        # 级别 0 为完整路径，其余为各记录中出现过的简化容差，从细到粗
+        tolerances = set()
+        for record in records:
+            if record.get('lod_tolerances') is not None:
+                tolerances.update(float(tolerance) for tolerance in record['lod_tolerances'])
+        self.levels = []
+        for tolerance in [0.0] + sorted(tolerances):
+            segments = []
+            colors = []
+            for record in records:
+                for part in lod_parts(record, tolerance):
+                    if len(part) < 2:
+                        continue
+                    chunks = split_chunks(np.asarray(part), chunk_points)
+                    segments.extend(chunks)
+                    colors.extend([record['colour']] * len(chunks))
+            bounds = np.array([[chunk[:, 0].min(), chunk[:, 0].max(), chunk[:, 1].min(), chunk[:, 1].max()]
+                               for chunk in segments], dtype=np.float64).reshape(-1, 4)
+            self.levels.append({
+                'tolerance': tolerance,
+                'segments': segments,
+                'bounds': bounds,
+                'colors': to_rgba_array(colors) if colors else np.empty((0, 4)),
+                'points': np.array([len(chunk) for chunk in segments], dtype=np.int64)
+            })
+
+        self.collection = ViewportCollection(self, [], linewidths=4, capstyle='round', joinstyle='round',
+                                             alpha=alpha, zorder=1)
+        ax.add_collection(self.collection, autolim=False)
+        # 线路范围计入数据范围，自动缩放时与静态绘制一致
+        full_bounds = self.levels[0]['bounds']
+        if len(full_bounds):
+            ax.update_datalim([[full_bounds[:, 0].min(), full_bounds[:, 2].min()],
+                               [full_bounds[:, 1].max(), full_bounds[:, 3].max()]])
+
+        # 回调以闭包注册，由坐标轴持有，生命周期与坐标轴相同
+        ax.callbacks.connect('xlim_changed', lambda _: self.mark_dirty())
+        ax.callbacks.connect('ylim_changed', lambda _: self.mark_dirty())
+
+    def mark_dirty(self):
+        """坐标轴范围已变化，下次绘制前重新裁剪"""
+        self.dirty = True
+
+    def update_if_dirty(self):
+        """坐标轴范围变化后尚未更新时更新"""
+        if self.dirty:
+            self.update()
+
+    def tolerance(self, view):
+        """视野内每像素对应的距离（米）乘以允许的像素误差"""
+        min_lon, max_lon, min_lat, max_lat = view
+        metres_per_degree = math.pi * EARTH_RADIUS / 180
+        width = (max_lon - min_lon) * metres_per_degree * math.cos(math.radians((min_lat + max_lat) / 2))
+        height = (max_lat - min_lat) * metres_per_degree
+        width_px = max(self.ax.bbox.width, 1.0)
+        height_px = max(self.ax.bbox.height, 1.0)
+        return max(width / width_px, height / height_px) * self.pixel_tolerance
+
+    def update(self, force=False):
+        """按当前坐标轴范围重新选择简化级别并裁剪视野外的小段"""
+        self.dirty = False
+        xlim, ylim = self.ax.get_xlim(), self.ax.get_ylim()
+        view = (min(xlim), max(xlim), min(ylim), max(ylim))
+        if view == self.view and not force:
+            return
+        self.view = view
+
+        tolerance = self.tolerance(view)
+        level_index = 0
+        for index, level in enumerate(self.levels):
+            if level['tolerance'] <= tolerance:
+                level_index = index
+        level = self.levels[level_index]
+
+        bounds = level['bounds']
+        visible = np.flatnonzero((bounds[:, 0] <= view[1]) & (bounds[:, 1] >= view[0]) &
+                                 (bounds[:, 2] <= view[3]) & (bounds[:, 3] >= view[2]))
+        self.collection.set_segments([level['segments'][i] for i in visible.tolist()])
+        self.collection.set_color(level['colors'][visible])
+        self.level = level_index
+        self.visible_points = int(level['points'][visible].sum())